@@ -0,0 +1,359 @@
+import hashlib
+import json
+from functools import partial
+
+import frappe
+import requests
+from frappe.utils import cstr, now_datetime
+
+from foodcharity.gazetteer import (
+    clear_buildings_cache,
+    clear_missing,
+    clear_streets_cache,
+    clear_sync_state,
+    clear_zones_cache,
+    is_missing,
+    mark_missing,
+)
+from foodcharity.guard import get_coalesced
+from foodcharity.qnas import (
+    LOOKUP_MAX_RETRIES,
+    LOOKUP_TIMEOUT,
+    QnasUnavailableError,
+    get_qnas_json,
+)
+from foodcharity.realtime import publish_order_changes
+from foodcharity.routing import parse_coordinate
+from foodcharity.spatial import encode_geohash, get_geohash
+
+BATCH_SIZE = 1000
+STREET_FETCH_TTL = 30
+# Orders still out for delivery follow corrections to their building's coordinates
+OPEN_ORDER_CONDITION = "IFNULL(order_status, '') NOT IN ('Delivered', 'Collected')"
+# Outlasts the slowest lookup (connect and read timeout on every attempt) plus saving the street
+STREET_FETCH_LOCK_TTL_MS = (sum(LOOKUP_TIMEOUT) * (LOOKUP_MAX_RETRIES + 1) + 10) * 1000
+STREET_FETCH_WAIT = 5
+
+STANDARD_COLUMNS = ["name", "creation", "modified", "modified_by", "owner", "docstatus", "idx"]
+
+
+def normalize_number(value):
+    """Trim user input and drop leading zeros from numeric address parts ("012 " -> "12")"""
+    value = cstr(value).strip()
+    return str(int(value)) if value.isdigit() else value
+
+
+def get_street_name(zone_number, street_number):
+    """Street names follow the `{zone}-{street_number}` autoname"""
+    return f"{normalize_number(zone_number)}-{normalize_number(street_number)}"
+
+
+def get_building_name(zone_number, street_number, building_number):
+    """Building names follow the `{zone}-{street_number}-{building_number}` autoname"""
+    return "-".join(normalize_number(part) for part in (zone_number, street_number, building_number))
+
+
+def get_building_key(zone_number, street_number, building_number):
+    """Building name for an address, or None if any part is missing"""
+    if not all(normalize_number(part) for part in (zone_number, street_number, building_number)):
+        return None
+    return get_building_name(zone_number, street_number, building_number)
+
+
+def resolve_building(zone_number, street_number, building_number, fields=("latitude", "longitude")):
+    """Look a building up by primary key instead of filtering on its address columns"""
+    name = get_building_key(zone_number, street_number, building_number)
+    if not name:
+        return None
+    return frappe.db.get_value("Building", name, list(fields), as_dict=True)
+
+
+def resolve_buildings(addresses, fields=("latitude", "longitude")):
+    """Resolve many (zone, street, building) addresses in one `name IN (...)` query.
+
+    Returns a dict keyed by building name, see `get_building_key`."""
+    names = {get_building_key(*address) for address in addresses}
+    names.discard(None)
+    if not names:
+        return {}
+
+    buildings = frappe.get_all(
+        "Building",
+        filters={"name": ["in", list(names)]},
+        fields=["name", *fields]
+    )
+    return {b.name: b for b in buildings}
+
+
+def bulk_upsert(doctype, rows, update_fields=None, batch_size=BATCH_SIZE):
+    """Write `rows` (dicts keyed by column, including `name`) with multi-row
+    INSERT ... ON DUPLICATE KEY UPDATE statements of up to `batch_size` rows.
+
+    Only `update_fields` are overwritten on existing records; pass an empty list
+    to leave existing records untouched. Bypasses document controllers, so it is
+    only meant for the address doctypes which have no controller logic."""
+    if not rows:
+        return 0
+
+    fields = [f for f in rows[0] if f != "name"]
+    if update_fields is None:
+        update_fields = fields
+
+    columns = STANDARD_COLUMNS + fields
+    placeholders = "({})".format(", ".join(["%s"] * len(columns)))
+    if update_fields:
+        updates = ", ".join(f"`{f}` = VALUES(`{f}`)" for f in [*update_fields, "modified", "modified_by"])
+    else:
+        updates = "`name` = `name`"
+
+    now = now_datetime()
+    user = frappe.session.user
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        values = []
+        for row in batch:
+            values.extend([row["name"], now, now, user, user, 0, 0])
+            values.extend(row.get(f) for f in fields)
+
+        frappe.db.sql(
+            """INSERT INTO `tab{doctype}` ({columns}) VALUES {rows}
+            ON DUPLICATE KEY UPDATE {updates}""".format(
+                doctype=doctype,
+                columns=", ".join(f"`{c}`" for c in columns),
+                rows=", ".join([placeholders] * len(batch)),
+                updates=updates,
+            ),
+            values,
+        )
+
+    return len(rows)
+
+
+def upsert_zones(zones):
+    """Upsert zones from a QNAS `get_zones` payload"""
+    clear_zones_cache()
+    clear_sync_state()
+    return bulk_upsert("Zone", [
+        {
+            "name": normalize_number(z["zone_number"]),
+            "zone_number": normalize_number(z["zone_number"]),
+            "zone_name_en": z.get("zone_name_en", ""),
+            "zone_name_ar": z.get("zone_name_ar", "")
+        }
+        for z in zones
+    ])
+
+
+def upsert_streets(zone_number, streets):
+    """Upsert the full street list of a zone from a QNAS `get_streets` payload
+    and mark the zone's streets as synced"""
+    clear_streets_cache(zone_number)
+    clear_sync_state()
+    frappe.db.set_value("Zone", normalize_number(zone_number), "streets_synced_on", now_datetime(), update_modified=False)
+    return bulk_upsert("Street", [
+        {
+            "name": get_street_name(zone_number, s["street_number"]),
+            "zone": normalize_number(zone_number),
+            "street_number": normalize_number(s["street_number"]),
+            "street_name_en": s.get("street_name_en", ""),
+            "street_name_ar": s.get("street_name_ar", "")
+        }
+        for s in streets
+    ])
+
+
+def ensure_street(zone_number, street_number):
+    """Create a bare Street record if it is missing, keeping any synced names"""
+    street_name = get_street_name(zone_number, street_number)
+    clear_streets_cache(zone_number)
+    clear_sync_state()
+    bulk_upsert("Street", [{
+        "name": street_name,
+        "zone": normalize_number(zone_number),
+        "street_number": normalize_number(street_number)
+    }], update_fields=[])
+    return street_name
+
+
+def upsert_buildings(zone_number, street_number, buildings, batch_size=BATCH_SIZE):
+    """Upsert the buildings of a street from a QNAS `get_buildings` payload"""
+    street_name = get_street_name(zone_number, street_number)
+    clear_buildings_cache(zone_number, street_number)
+    clear_missing(normalize_number(zone_number), normalize_number(street_number))
+    count = bulk_upsert("Building", [
+        {
+            "name": get_building_name(zone_number, street_number, b["building_number"]),
+            "zone": normalize_number(zone_number),
+            "street": street_name,
+            "street_number": normalize_number(street_number),
+            "building_number": normalize_number(b["building_number"]),
+            "latitude": b.get("x"),
+            "longitude": b.get("y"),
+            "geohash": get_geohash(b.get("x"), b.get("y"))
+        }
+        for b in buildings
+    ], update_fields=["latitude", "longitude", "geohash"], batch_size=batch_size)
+    update_building_orders(zone_number, street_number)
+    return count
+
+
+def get_order_coordinate_fields(coordinate):
+    """Orders columns for a `coordinate`, as set by Orders.set_latitude_longitude"""
+    latitude, longitude = parse_coordinate(coordinate)
+    return {
+        "coordinate": coordinate,
+        "latitude": latitude or 0,
+        "longitude": longitude or 0,
+        "geohash": encode_geohash(latitude, longitude),
+    }
+
+
+def update_building_orders(zone_number, street_number, building_number=None):
+    """Copy the current coordinates of a street's buildings (or just one) onto
+    its open orders.
+
+    Orders keep their own copy of the building coordinate for routing and the
+    spatial queries, without this a corrected building would leave its open
+    orders on the old one. Returns the number of orders changed."""
+    values = {"zone": normalize_number(zone_number), "street": normalize_number(street_number)}
+    conditions = ["zone_number = %(zone)s", "street_number = %(street)s", OPEN_ORDER_CONDITION]
+    if building_number:
+        conditions.append("building_number = %(building)s")
+        values["building"] = normalize_number(building_number)
+
+    return set_building_coordinates(frappe.db.sql(f"""
+        SELECT name, assigned_volunteer, zone_number, street_number, building_number, coordinate
+        FROM `tabOrders`
+        WHERE {" AND ".join(conditions)}
+    """, values, as_dict=True))
+
+
+def set_building_coordinates(orders):
+    """Give orders (rows with their address, `coordinate` and `assigned_volunteer`)
+    the coordinate of their local building where it differs, with one query
+    for the buildings and one for the updates. Returns the number changed."""
+    if not orders:
+        return 0
+
+    buildings = resolve_buildings([(o.zone_number, o.street_number, o.building_number) for o in orders])
+    updates, drivers = {}, set()
+    for o in orders:
+        building = buildings.get(get_building_key(o.zone_number, o.street_number, o.building_number))
+        if not (building and building.latitude and building.longitude):
+            continue
+        coordinate = f"{building.latitude},{building.longitude}"
+        if coordinate != o.coordinate:
+            updates[o.name] = get_order_coordinate_fields(coordinate)
+            drivers.add(o.assigned_volunteer)
+
+    if updates:
+        frappe.db.bulk_update("Orders", updates)
+        publish_order_changes(list(updates), drivers)
+    return len(updates)
+
+
+def fetch_street_buildings(zone_number, street_number):
+    """Buildings of a street from QNAS, remembering streets it doesn't know.
+
+    An empty list or a 404 is cached as a miss, so repeat lookups of an
+    unknown street return [] without calling QNAS until the miss expires or
+    the street's buildings are saved. Other errors are raised as before."""
+    zone_number, street_number = normalize_number(zone_number), normalize_number(street_number)
+    if is_missing(zone_number, street_number):
+        return []
+
+    try:
+        buildings = get_qnas_json(f"get_buildings/{zone_number}/{street_number}")
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        buildings = []
+
+    if not buildings:
+        mark_missing(zone_number, street_number)
+    return buildings or []
+
+
+def street_fetch_key(zone_number, street_number):
+    return f"foodcharity:qnas:street:{zone_number}:{street_number}"
+
+
+def load_street_buildings(zone_number, street_number, commit=False):
+    """Buildings of a street from QNAS, fetched and saved locally by one caller at a time.
+
+    Concurrent lookups of the same street (guests picking a building while an
+    order is saved) wait for the first one and reuse its result for a few
+    seconds instead of calling QNAS again and racing on the Building inserts.
+    When QNAS is slow they give up with QnasUnavailableError rather than
+    fetching the street again. Pass `commit` outside of a document save so
+    the buildings are kept."""
+    zone_number, street_number = normalize_number(zone_number), normalize_number(street_number)
+    if is_missing(zone_number, street_number):
+        return []
+
+    return get_coalesced(
+        street_fetch_key(zone_number, street_number),
+        partial(fetch_and_save_street, zone_number, street_number, commit),
+        STREET_FETCH_TTL,
+        lock_ttl_ms=STREET_FETCH_LOCK_TTL_MS,
+        wait=STREET_FETCH_WAIT,
+        on_timeout=partial(raise_street_fetch_pending, zone_number, street_number),
+    )
+
+
+def raise_street_fetch_pending(zone_number, street_number):
+    raise QnasUnavailableError(f"QNAS lookup of street {zone_number}-{street_number} is still running")
+
+
+def fetch_and_save_street(zone_number, street_number, commit=False):
+    buildings = fetch_street_buildings(zone_number, street_number)
+    if not buildings:
+        return buildings
+
+    try:
+        ensure_street(zone_number, street_number)
+        upsert_buildings(zone_number, street_number, buildings)
+        if commit:
+            frappe.db.commit()
+    except Exception as e:
+        frappe.log_error(f"Error saving buildings locally: {str(e)}")
+    return buildings
+
+
+def fetch_building(zone_number, street_number, building_number, commit=False):
+    """A single building with coordinates from QNAS, or None, remembering misses like
+    `fetch_street_buildings` so an unknown building number costs one QNAS call.
+    The whole street is saved locally on the way, see `load_street_buildings`."""
+    building_number = normalize_number(building_number)
+    if is_missing(normalize_number(zone_number), normalize_number(street_number), building_number):
+        return None
+
+    for building in load_street_buildings(zone_number, street_number, commit=commit):
+        if normalize_number(building.get("building_number")) == building_number:
+            if building.get("x") and building.get("y"):
+                return building
+            break
+
+    mark_missing(normalize_number(zone_number), normalize_number(street_number), building_number)
+    return None
+
+
+def get_buildings_fingerprint(buildings):
+    """Order-independent hash of a QNAS `get_buildings` payload"""
+    payload = sorted(
+        ([str(b["building_number"]), b.get("x"), b.get("y")] for b in buildings),
+        key=lambda row: row[0]
+    )
+    return hashlib.sha1(json.dumps(payload).encode()).hexdigest()
+
+
+def mark_streets_fetched(street_names, fetched_on):
+    """Bump the fetch timestamp of streets whose buildings did not change"""
+    if not street_names:
+        return
+
+    frappe.db.sql(
+        "UPDATE `tabStreet` SET `buildings_fetched_on` = %s WHERE `name` IN %s",
+        (fetched_on, tuple(street_names)),
+    )
@@ -1,11 +1,60 @@
 import frappe
 import requests
-from frappe.utils import formatdate
-
-BASE_URL = "https://qnas.qa/"
+from frappe.utils import cint, flt, formatdate, now_datetime
+
+from foodcharity.address import (
+    fetch_building,
+    load_street_buildings,
+    normalize_number,
+    resolve_building,
+)
+from foodcharity.dispatch import plan_assignment
+from foodcharity.gazetteer import (
+    buildings_key,
+    get_cached,
+    has_local_buildings,
+    has_local_streets,
+    has_local_zones,
+    manifest_key,
+    street_option,
+    streets_key,
+    zone_option,
+    zones_key,
+)
+from foodcharity.guard import guest_endpoint
+from foodcharity.order_feed import get_changed_orders, get_changes_cursor
+from foodcharity.phone import get_phone_search_pattern
+from foodcharity.qnas import get_qnas_json
+from foodcharity.realtime import publish_order_changes, publish_order_update
+from foodcharity.routing import get_route_settings, sort_rows_by_cached_route
+from foodcharity.snapshot import load_manifest
+from foodcharity.spatial import get_nearest_building, get_orders_in_bbox, get_orders_within, parse_point
+
+# Per client IP token buckets for the public endpoints, see foodcharity.guard.
+# Generous enough for many donors sharing a mobile carrier IP.
+LOOKUP_LIMIT = {"rate": 5, "burst": 60}
+SEARCH_LIMIT = {"rate": 1, "burst": 20}
+SUBMIT_LIMIT = {"rate": 0.5, "burst": 10}
+LOGIN_LIMIT = {"rate": 0.2, "burst": 10}
+# Clustering every unassigned order is the heaviest call, a coordinator needs a few per minute
+PLAN_LIMIT = {"rate": 0.05, "burst": 3}
+MEMO_TTL = 10
+
+ORDER_STATUSES = ["Pending", "Assigned", "Out for Delivery", "Delivered", "Collected"]
+
+COORDINATOR_PAGE_LENGTH = 100
+MAX_COORDINATOR_PAGE_LENGTH = 500
+
+ASSIGN_BATCH_SIZE = 1000
+
+# Per order results of assign_orders
+ASSIGNED = "assigned"
+NOT_FOUND = "not found"
+SKIPPED = "skipped"
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
 def get_event_settings():
     """Get event configuration for the order page"""
     try:
@@ -30,50 +79,27 @@ def get_event_settings():
         }
 
 
-def get_qnas_headers():
-    """Get QNAS API headers from settings"""
-    try:
-        settings = frappe.get_single("Foodcharity Settings")
-        if settings.qnas_enabled and settings.qnas_api_token and settings.qnas_api_domain:
-            return {
-                "X-Token": settings.get_password("qnas_api_token"),
-                "X-Domain": settings.qnas_api_domain,
-                "Accept": "application/json"
-            }
-    except Exception:
-        pass
-    return {"Accept": "application/json"}
-
-
-def has_local_data():
-    """Check if local QNAS data exists"""
-    return frappe.db.count("Zone") > 0
-
-
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
 def get_zones():
+    """Fetch zone options from the gazetteer cache"""
+    return get_cached(zones_key(), get_zone_options)
+
+
+def get_zone_options():
     """Fetch zones - from local DB if synced, otherwise from API"""
     # Try local data first
-    if has_local_data():
+    if has_local_zones():
         zones = frappe.get_all(
             "Zone",
             fields=["zone_number", "zone_name_en", "zone_name_ar"],
             order_by="zone_number asc"
         )
-        return [
-            {
-                "value": z.zone_number,
-                "label": f"{z.zone_number} - {z.zone_name_en} ({z.zone_name_ar})"
-            }
-            for z in zones
-        ]
+        return [zone_option(z) for z in zones]
 
     # Fallback to API
     try:
-        headers = get_qnas_headers()
-        response = requests.get(f"{BASE_URL}get_zones", headers=headers)
-        response.raise_for_status()
-        zones = response.json()
+        zones = get_qnas_json("get_zones")
         return [
             {
                 "value": str(z["zone_number"]),
@@ -87,30 +113,27 @@ def get_zones():
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
 def get_streets(zone_number):
+    """Fetch street options for a zone from the gazetteer cache"""
+    return get_cached(streets_key(zone_number), lambda: get_street_options(zone_number))
+
+
+def get_street_options(zone_number):
     """Fetch streets - from local DB if synced, otherwise from API"""
-    # Try local data first
-    if has_local_data():
+    # Try local data first, unless this zone's streets haven't been synced yet
+    if has_local_streets(zone_number):
         streets = frappe.get_all(
             "Street",
             filters={"zone": zone_number},
             fields=["street_number", "street_name_en", "street_name_ar"],
             order_by="street_number asc"
         )
-        return [
-            {
-                "value": s.street_number,
-                "label": f"{s.street_number} - {s.street_name_en or ''} ({s.street_name_ar or ''})"
-            }
-            for s in streets
-        ]
+        return [street_option(s) for s in streets]
 
     # Fallback to API
     try:
-        headers = get_qnas_headers()
-        response = requests.get(f"{BASE_URL}get_streets/{zone_number}", headers=headers)
-        response.raise_for_status()
-        streets = response.json()
+        streets = get_qnas_json(f"get_streets/{zone_number}")
         return [
             {
                 "value": str(s["street_number"]),
@@ -124,7 +147,16 @@ def get_streets(zone_number):
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
 def get_buildings(zone_number, street_number):
+    """Fetch building options for a street from the gazetteer cache"""
+    return get_cached(
+        buildings_key(zone_number, street_number),
+        lambda: get_building_options(zone_number, street_number)
+    )
+
+
+def get_building_options(zone_number, street_number):
     """Fetch buildings - from local DB if available, otherwise from API and save locally"""
     # Try local data first
     buildings = frappe.get_all(
@@ -147,13 +179,7 @@ def get_buildings(zone_number, street_number):
 
     # Not found locally, fetch from QNAS API and save
     try:
-        headers = get_qnas_headers()
-        response = requests.get(f"{BASE_URL}get_buildings/{zone_number}/{street_number}", headers=headers)
-        response.raise_for_status()
-        api_buildings = response.json()
-
-        # Save buildings locally for future use
-        save_buildings_locally(zone_number, street_number, api_buildings)
+        api_buildings = load_street_buildings(zone_number, street_number, commit=True)
 
         return [
             {
@@ -169,66 +195,28 @@ def get_buildings(zone_number, street_number):
         return []
 
 
-def save_buildings_locally(zone_number, street_number, buildings):
-    """Save buildings fetched from QNAS API to local doctypes"""
-    try:
-        # Ensure Street exists
-        street_name = f"{zone_number}-{street_number}"
-        if not frappe.db.exists("Street", street_name):
-            street_doc = frappe.get_doc({
-                "doctype": "Street",
-                "name": street_name,
-                "zone": zone_number,
-                "street_number": street_number
-            })
-            street_doc.insert(ignore_permissions=True)
-
-        # Save each building
-        for b in buildings:
-            building_number = str(b.get("building_number"))
-            building_name = f"{zone_number}-{street_number}-{building_number}"
-
-            if not frappe.db.exists("Building", building_name):
-                building_doc = frappe.get_doc({
-                    "doctype": "Building",
-                    "name": building_name,
-                    "zone": zone_number,
-                    "street": street_name,
-                    "street_number": street_number,
-                    "building_number": building_number,
-                    "latitude": b.get("x"),
-                    "longitude": b.get("y")
-                })
-                building_doc.insert(ignore_permissions=True)
-
-        frappe.db.commit()
-    except Exception as e:
-        frappe.log_error(f"Error saving buildings locally: {str(e)}")
+@frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
+def get_gazetteer_manifest():
+    """URLs of the static zone/street snapshot files, empty until a sync has built them"""
+    return get_cached(manifest_key(), load_manifest) or {}
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
 def get_location(zone_number, street_number, building_number):
     """Fetch coordinates for a specific building"""
     # Try local data first
-    if has_local_data():
-        building = frappe.db.get_value(
-            "Building",
-            {"zone": zone_number, "street_number": street_number, "building_number": building_number},
-            ["latitude", "longitude"],
-            as_dict=True
-        )
+    if has_local_buildings():
+        building = resolve_building(zone_number, street_number, building_number)
         if building:
             return {"latitude": building.latitude, "longitude": building.longitude}
 
     # Fallback to API
     try:
-        headers = get_qnas_headers()
-        response = requests.get(f"{BASE_URL}get_buildings/{zone_number}/{street_number}", headers=headers)
-        response.raise_for_status()
-        buildings = response.json()
-        for building in buildings:
-            if building["building_number"] == str(building_number):
-                return {"latitude": building["x"], "longitude": building["y"]}
+        building = fetch_building(zone_number, street_number, building_number, commit=True)
+        if building:
+            return {"latitude": building["x"], "longitude": building["y"]}
         return {}
     except requests.exceptions.RequestException as e:
         frappe.log_error(f"Error fetching location: {str(e)}")
@@ -236,35 +224,21 @@ def get_location(zone_number, street_number, building_number):
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
 def get_building_coordinates(zone_number, street_number, building_number):
     """Fetch building coordinates - from local DB or QNAS API, saves locally if fetched from API"""
     # Try local data first
-    building = frappe.db.get_value(
-        "Building",
-        {"zone": zone_number, "street_number": street_number, "building_number": building_number},
-        ["latitude", "longitude"],
-        as_dict=True
-    )
+    building = resolve_building(zone_number, street_number, building_number)
 
     if building and building.latitude and building.longitude:
         return {"latitude": building.latitude, "longitude": building.longitude}
 
     # Fetch from QNAS API
     try:
-        headers = get_qnas_headers()
-        response = requests.get(f"{BASE_URL}get_buildings/{zone_number}/{street_number}", headers=headers)
-        response.raise_for_status()
-        api_buildings = response.json()
-
-        for b in api_buildings:
-            if str(b.get("building_number")) == str(building_number):
-                latitude = b.get("x")
-                longitude = b.get("y")
-
-                if latitude and longitude:
-                    # Save this building locally
-                    save_single_building_locally(zone_number, street_number, building_number, latitude, longitude)
-                    return {"latitude": latitude, "longitude": longitude}
+        # Saves the street's buildings locally for the next lookup
+        b = fetch_building(zone_number, street_number, building_number, commit=True)
+        if b:
+            return {"latitude": b["x"], "longitude": b["y"]}
 
         return {}
     except Exception as e:
@@ -272,40 +246,15 @@ def get_building_coordinates(zone_number, street_number, building_number):
         return {}
 
 
-def save_single_building_locally(zone_number, street_number, building_number, latitude, longitude):
-    """Save a single building to local doctype"""
-    try:
-        # Ensure Street exists
-        street_name = f"{zone_number}-{street_number}"
-        if not frappe.db.exists("Street", street_name):
-            street_doc = frappe.get_doc({
-                "doctype": "Street",
-                "name": street_name,
-                "zone": zone_number,
-                "street_number": street_number
-            })
-            street_doc.insert(ignore_permissions=True)
-
-        # Create Building
-        building_name = f"{zone_number}-{street_number}-{building_number}"
-        if not frappe.db.exists("Building", building_name):
-            building_doc = frappe.get_doc({
-                "doctype": "Building",
-                "name": building_name,
-                "zone": zone_number,
-                "street": street_name,
-                "street_number": street_number,
-                "building_number": building_number,
-                "latitude": latitude,
-                "longitude": longitude
-            })
-            building_doc.insert(ignore_permissions=True)
-            frappe.db.commit()
-    except Exception as e:
-        frappe.log_error(f"Error saving building locally: {str(e)}")
+@frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
+def nearest_building(lat, lng):
+    """Closest local building to a GPS point, so donors can share their location instead of typing it"""
+    return get_nearest_building(*parse_point(lat, lng)) or {}
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOOKUP_LIMIT, cache_ttl=MEMO_TTL)
 def get_doctype_fields(doctype):
     """Get doctype field metadata for dynamic form rendering"""
     meta = frappe.get_meta(doctype)
@@ -328,6 +277,7 @@ def get_doctype_fields(doctype):
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**SUBMIT_LIMIT)
 def create_guest_order(data):
     """Create an order from public form (guest access)"""
     import json
@@ -335,40 +285,48 @@ def create_guest_order(data):
         data = json.loads(data)
 
     order = frappe.get_doc({"doctype": "Orders", **data})
+    order.flags.defer_coordinates = defer_coordinate_lookup()
     order.insert(ignore_permissions=True)
     frappe.db.commit()
 
     return {"success": True, "order_id": order.name}
 
 
+def defer_coordinate_lookup():
+    """Whether guest order saves leave QNAS lookups to the background resolver"""
+    return bool(frappe.db.get_single_value("Foodcharity Settings", "defer_coordinate_lookup", cache=True))
+
+
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**SEARCH_LIMIT, cache_ttl=MEMO_TTL)
 def search_orders_by_phone(phone):
     """Search orders by phone number (mobile or whatsapp)"""
     if not phone or len(phone) < 8:
         return []
 
-    orders = frappe.get_all(
-        "Orders",
-        filters=[
-            ["Orders", "mobile", "like", f"%{phone}%"]
-        ],
-        or_filters=[
-            ["Orders", "whatsapp_number", "like", f"%{phone}%"]
-        ],
-        fields=[
-            "name", "name1", "mobile", "whatsapp_number", "order_type",
-            "no_of_biriyani", "contribution_amount", "accommodation_area",
-            "zone_number", "street_number", "building_number", "door_number",
-            "accommodation_type", "compound_name", "creation",
-            "order_status", "collected_amount"
-        ],
-        order_by="creation desc",
-        limit=10
-    )
-    return orders
+    pattern = get_phone_search_pattern(phone)
+    if not pattern:
+        return []
+
+    # Each half of the UNION is a prefix match on an indexed reversed-digits key
+    fields = """
+        name, name1, mobile, whatsapp_number, order_type,
+        no_of_biriyani, contribution_amount, accommodation_area,
+        zone_number, street_number, building_number, door_number,
+        accommodation_type, compound_name, creation,
+        order_status, collected_amount
+    """
+    return frappe.db.sql(f"""
+        SELECT {fields} FROM `tabOrders` WHERE mobile_search_key LIKE %(pattern)s
+        UNION
+        SELECT {fields} FROM `tabOrders` WHERE whatsapp_search_key LIKE %(pattern)s
+        ORDER BY creation DESC
+        LIMIT 10
+    """, {"pattern": pattern}, as_dict=True)
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**SEARCH_LIMIT)
 def get_order(order_id):
     """Get a single order by ID"""
     if not order_id:
@@ -409,6 +367,7 @@ def get_order(order_id):
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**SUBMIT_LIMIT)
 def update_guest_order(order_id, data):
     """Update an existing order"""
     import json
@@ -421,6 +380,7 @@ def update_guest_order(order_id, data):
     try:
         order = frappe.get_doc("Orders", order_id)
         order.update(data)
+        order.flags.defer_coordinates = defer_coordinate_lookup()
         order.save(ignore_permissions=True)
         frappe.db.commit()
         return {"success": True, "order_id": order.name}
@@ -431,19 +391,21 @@ def update_guest_order(order_id, data):
 
 
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOGIN_LIMIT)
 def driver_login(mobile, password):
     """Authenticate driver by mobile and password"""
     if not mobile or not password:
         return {"success": False, "error": "Mobile and password are required"}
 
-    # Strip +974 if present
-    if mobile.startswith("+974"):
-        mobile = mobile[4:]
+    # Matches on the trailing digits, with or without the +974 prefix
+    pattern = get_phone_search_pattern(mobile)
+    if not pattern:
+        return {"success": False, "error": "Driver not found"}
 
     volunteers = frappe.get_all(
         "Volunteer",
         filters=[
-            ["mobile_number", "like", f"%{mobile}%"],
+            ["mobile_search_key", "like", pattern],
             ["interest", "=", "Driver"]
         ],
         fields=["name", "full_name", "mobile_number"]
@@ -475,55 +437,94 @@ def driver_login(mobile, password):
     }
 
 
+def get_per_biriyani_charge():
+    """Per biriyani charge from settings, served from the single value cache"""
+    try:
+        return float(frappe.db.get_single_value("Foodcharity Settings", "per_biriyani_charge", cache=True) or 20)
+    except Exception:
+        return 20
+
+
 @frappe.whitelist(allow_guest=True)
-def get_driver_orders(driver_id):
-    """Get all orders assigned to a driver"""
+@guest_endpoint(**LOOKUP_LIMIT)
+def get_driver_orders(driver_id, route=0):
+    """Get all orders assigned to a driver.
+
+    With `route` the orders come in planned delivery order (see
+    foodcharity.routing.plan_route) along with the route length in km
+    before and after optimization. Plans are reused while the stops stay the same."""
     if not driver_id:
         return {"orders": [], "per_biriyani_charge": 0}
 
-    # Get per biriyani charge from settings
-    try:
-        settings = frappe.get_single("Foodcharity Settings")
-        per_biriyani_charge = float(settings.per_biriyani_charge or 20)
-    except Exception:
-        per_biriyani_charge = 20
+    per_biriyani_charge = get_per_biriyani_charge()
+    orders = get_driver_order_rows(driver_id, per_biriyani_charge)
+    if not cint(route):
+        return {"orders": orders, "per_biriyani_charge": per_biriyani_charge}
 
-    orders = frappe.get_all(
-        "Orders",
-        filters={"assigned_volunteer": driver_id},
-        fields=[
-            "name", "name1", "mobile", "whatsapp_number", "order_type",
-            "no_of_biriyani", "accommodation_area", "zone_number",
-            "street_number", "building_number", "door_number",
-            "accommodation_type", "compound_name", "coordinate", "creation",
-            "collected_amount", "contribution_amount",
-            "location_request_sent", "thank_you_sent", "order_status", "remark"
-        ],
-        order_by="creation desc"
+    orders, before, after = sort_rows_by_cached_route(orders, **get_route_settings())
+    return {
+        "orders": orders,
+        "per_biriyani_charge": per_biriyani_charge,
+        "route": {"before_km": round(before / 1000, 2), "after_km": round(after / 1000, 2)}
+    }
+
+
+@frappe.whitelist(allow_guest=True)
+def get_driver_order_changes(driver_id, since=None):
+    """Orders added, changed or reassigned away from a driver since the `since` cursor.
+
+    Without `since` this returns the full order list along with the cursor to
+    poll from next."""
+    if not driver_id:
+        return {"orders": [], "removed": [], "cursor": None, "has_more": False, "per_biriyani_charge": 0}
+
+    if not since:
+        cursor = get_changes_cursor()
+        return {**get_driver_orders(driver_id), "removed": [], "cursor": cursor, "has_more": False}
+
+    per_biriyani_charge = get_per_biriyani_charge()
+    changed, removed, cursor, has_more = get_changed_orders(
+        since, ["o.assigned_volunteer = %(driver_id)s"], {"driver_id": driver_id}
     )
+    orders = get_driver_order_rows(driver_id, per_biriyani_charge, changed) if changed else []
+    return {
+        "orders": orders,
+        "removed": removed,
+        "cursor": cursor,
+        "has_more": has_more,
+        "per_biriyani_charge": per_biriyani_charge
+    }
+
 
-    # Calculate total amount and fetch coordinates for each order
+def get_driver_order_rows(driver_id, per_biriyani_charge, names=None):
+    """Orders with the coordinates stored on them at save time"""
+    conditions = ["o.assigned_volunteer = %(driver_id)s"]
+    if names:
+        conditions.append("o.name IN %(names)s")
+
+    orders = frappe.db.sql(f"""
+        SELECT
+            o.name, o.name1, o.mobile, o.whatsapp_number, o.order_type,
+            o.no_of_biriyani, o.accommodation_area, o.zone_number,
+            o.street_number, o.building_number, o.door_number,
+            o.accommodation_type, o.compound_name, o.coordinate, o.creation,
+            o.collected_amount, o.contribution_amount,
+            o.location_request_sent, o.thank_you_sent, o.order_status, o.remark,
+            o.latitude, o.longitude
+        FROM
+            `tabOrders` o
+        {get_where_clause(conditions)}
+        ORDER BY
+            o.creation DESC
+    """, {"driver_id": driver_id, "names": tuple(names or ())}, as_dict=True)
+
+    # Calculate total amount for each order
     for order in orders:
         biriyani_count = order.get("no_of_biriyani") or 0
         order["total_amount"] = biriyani_count * per_biriyani_charge
         order["collected_amount"] = order.get("collected_amount") or 0
 
-        # Fetch coordinates from Building doctype if zone, street, building are available
-        if order.get("zone_number") and order.get("street_number") and order.get("building_number"):
-            building = frappe.db.get_value(
-                "Building",
-                {
-                    "zone": order.get("zone_number"),
-                    "street_number": order.get("street_number"),
-                    "building_number": order.get("building_number")
-                },
-                ["latitude", "longitude"],
-                as_dict=True
-            )
-            if building and building.latitude and building.longitude:
-                order["coordinate"] = f"{building.latitude},{building.longitude}"
-
-    return {"orders": orders, "per_biriyani_charge": per_biriyani_charge}
+    return orders
 
 
 @frappe.whitelist(allow_guest=True)
@@ -535,6 +536,7 @@ def update_collected_amount(order_id, collected_amount):
     try:
         collected = float(collected_amount or 0)
         frappe.db.set_value("Orders", order_id, "collected_amount", collected)
+        publish_order_update(order_id, collected_amount=collected)
         frappe.db.commit()
         return {"success": True, "collected_amount": collected}
     except Exception as e:
@@ -552,6 +554,7 @@ def update_message_status(order_id, field, value=1):
 
     try:
         frappe.db.set_value("Orders", order_id, field, int(value))
+        publish_order_update(order_id, **{field: int(value)})
         frappe.db.commit()
         return {"success": True}
     except Exception as e:
@@ -561,30 +564,48 @@ def update_message_status(order_id, field, value=1):
 @frappe.whitelist(allow_guest=True)
 def get_all_drivers():
     """Get all volunteers who are drivers with their order stats"""
-    drivers = frappe.get_all(
-        "Volunteer",
-        filters={"interest": "Driver"},
-        fields=["name", "full_name", "mobile_number", "remark", "preferred_delivery_location"]
+    per_biriyani_charge = get_per_biriyani_charge()
+
+    # One aggregate over Orders grouped by driver, joined to the driver roster
+    status_counts = {status: f"{frappe.scrub(status)}_count" for status in ORDER_STATUSES}
+    # Orders without a status count as Pending, as in get_order_summary
+    status_sums = ", ".join(
+        f"SUM(COALESCE(NULLIF(order_status, ''), 'Pending') = {frappe.db.escape(status)}) AS {alias}"
+        for status, alias in status_counts.items()
     )
+    status_columns = ", ".join(f"COALESCE(s.{alias}, 0) AS {alias}" for alias in status_counts.values())
+    drivers = frappe.db.sql(f"""
+        SELECT
+            v.name, v.full_name, v.mobile_number, v.remark, v.preferred_delivery_location,
+            COALESCE(s.order_count, 0) AS order_count,
+            COALESCE(s.total_biriyani, 0) AS total_biriyani,
+            COALESCE(s.total_collected, 0) AS total_collected,
+            {status_columns}
+        FROM
+            `tabVolunteer` v
+        LEFT JOIN (
+            SELECT
+                assigned_volunteer,
+                COUNT(*) AS order_count,
+                SUM(no_of_biriyani) AS total_biriyani,
+                SUM(collected_amount) AS total_collected,
+                {status_sums}
+            FROM `tabOrders`
+            WHERE assigned_volunteer IS NOT NULL AND assigned_volunteer != ''
+            GROUP BY assigned_volunteer
+        ) s ON s.assigned_volunteer = v.name
+        WHERE
+            v.interest = 'Driver'
+        ORDER BY
+            v.modified DESC
+    """, as_dict=True)
 
-    # Get per biriyani charge
-    try:
-        settings = frappe.get_single("Foodcharity Settings")
-        per_biriyani_charge = float(settings.per_biriyani_charge or 20)
-    except Exception:
-        per_biriyani_charge = 20
-
-    # Get order stats for each driver
     for driver in drivers:
-        orders = frappe.get_all(
-            "Orders",
-            filters={"assigned_volunteer": driver.name},
-            fields=["no_of_biriyani", "collected_amount"]
-        )
-        driver["order_count"] = len(orders)
-        driver["total_biriyani"] = sum(o.no_of_biriyani or 0 for o in orders)
+        driver["order_count"] = int(driver.order_count)
+        driver["total_biriyani"] = int(driver.total_biriyani)
         driver["total_amount"] = driver["total_biriyani"] * per_biriyani_charge
-        driver["total_collected"] = sum(o.collected_amount or 0 for o in orders)
+        driver["total_collected"] = float(driver.total_collected)
+        driver["status_counts"] = {status: int(driver.pop(alias)) for status, alias in status_counts.items()}
 
     return {"drivers": drivers, "per_biriyani_charge": per_biriyani_charge}
 
@@ -612,28 +633,168 @@ def get_unassigned_orders():
 
 
 @frappe.whitelist(allow_guest=True)
-def get_all_orders_for_coordinator():
-    """Get all orders with driver info for coordinator view"""
-    orders = frappe.get_all(
-        "Orders",
-        fields=[
-            "name", "name1", "mobile", "whatsapp_number", "order_type",
-            "no_of_biriyani", "accommodation_area", "zone_number",
-            "street_number", "building_number", "door_number",
-            "assigned_volunteer", "collected_amount", "creation", "order_status", "remark"
-        ],
-        order_by="creation desc"
-    )
+@guest_endpoint(**SEARCH_LIMIT)
+def orders_within(lat, lng, radius, status=None):
+    """Orders within `radius` metres of a point, nearest first"""
+    lat, lng = parse_point(lat, lng)
+    return get_orders_within(lat, lng, flt(radius), order_status=status)
 
-    # Get driver names
-    driver_names = {}
-    for order in orders:
-        if order.assigned_volunteer and order.assigned_volunteer not in driver_names:
-            vol = frappe.db.get_value("Volunteer", order.assigned_volunteer, "full_name")
-            driver_names[order.assigned_volunteer] = vol or order.assigned_volunteer
-        order["driver_name"] = driver_names.get(order.assigned_volunteer, "")
 
-    return orders
+@frappe.whitelist(allow_guest=True)
+@guest_endpoint(**SEARCH_LIMIT)
+def orders_in_bbox(min_lat, min_lng, max_lat, max_lng, status=None):
+    """Orders inside a bounding box, e.g. the coordinator's map view"""
+    min_lat, min_lng = parse_point(min_lat, min_lng)
+    max_lat, max_lng = parse_point(max_lat, max_lng)
+    return get_orders_in_bbox(min_lat, min_lng, max_lat, max_lng, order_status=status)
+
+
+@frappe.whitelist(allow_guest=True)
+def get_all_orders_for_coordinator(
+    status=None, area=None, zone=None, driver=None, search=None, cursor=None, page_length=COORDINATOR_PAGE_LENGTH
+):
+    """Get one page of orders with driver info for coordinator view.
+
+    Pages are keyed on (creation, name) rather than an offset, so paging stays
+    cheap deep into the list and rows don't shift while new orders arrive.
+    Pass the returned `next_cursor` back to get the following page."""
+    page_length = min(cint(page_length) or COORDINATOR_PAGE_LENGTH, MAX_COORDINATOR_PAGE_LENGTH)
+    conditions, values = get_coordinator_order_conditions(status, area, zone, driver, search)
+
+    total = changes_cursor = None
+    if not cursor:
+        # Only the first page needs the count and the delta feed cursor,
+        # later pages keep the ones already shown
+        changes_cursor = get_changes_cursor()
+        total = count_coordinator_orders(conditions, values)
+
+    if cursor:
+        cursor = frappe.parse_json(cursor)
+        conditions.append("(o.creation < %(cursor_creation)s OR (o.creation = %(cursor_creation)s AND o.name < %(cursor_name)s))")
+        values.update(cursor_creation=cursor["creation"], cursor_name=cursor["name"])
+
+    values["page_length"] = page_length + 1
+    orders = get_coordinator_order_rows(conditions, values, "LIMIT %(page_length)s")
+
+    next_cursor = None
+    if len(orders) > page_length:
+        orders = orders[:page_length]
+        last = orders[-1]
+        next_cursor = frappe.as_json({"creation": str(last.creation), "name": last.name}, indent=None)
+
+    return {"orders": orders, "next_cursor": next_cursor, "total": total, "changes_cursor": changes_cursor}
+
+
+@frappe.whitelist(allow_guest=True)
+def get_order_changes(since, status=None, area=None, zone=None, driver=None, search=None):
+    """Orders changed since the `since` cursor under the coordinator's current filters.
+
+    `orders` should be merged into the loaded list, `removed` names dropped from it.
+    `total` is only recounted when something changed."""
+    conditions, values = get_coordinator_order_conditions(status, area, zone, driver, search)
+    changed, removed, cursor, has_more = get_changed_orders(since, conditions, values)
+
+    orders = []
+    if changed:
+        orders = get_coordinator_order_rows(["o.name IN %(names)s"], {"names": tuple(changed)})
+
+    total = count_coordinator_orders(conditions, values) if changed or removed else None
+    return {"orders": orders, "removed": removed, "cursor": cursor, "has_more": has_more, "total": total}
+
+
+def get_coordinator_order_rows(conditions, values, limit=""):
+    return frappe.db.sql(f"""
+        SELECT
+            o.name, o.name1, o.mobile, o.whatsapp_number, o.order_type,
+            o.no_of_biriyani, o.accommodation_area, o.zone_number,
+            o.street_number, o.building_number, o.door_number,
+            o.assigned_volunteer, o.contribution_amount, o.collected_amount,
+            o.creation, o.order_status, o.remark,
+            COALESCE(v.full_name, o.assigned_volunteer, '') AS driver_name
+        FROM
+            `tabOrders` o
+        LEFT JOIN
+            `tabVolunteer` v ON v.name = o.assigned_volunteer
+        {get_where_clause(conditions)}
+        ORDER BY
+            o.creation DESC, o.name DESC
+        {limit}
+    """, values, as_dict=True)
+
+
+def count_coordinator_orders(conditions, values):
+    return frappe.db.sql(f"""
+        SELECT COUNT(*) FROM `tabOrders` o
+        {get_where_clause(conditions)}
+    """, values)[0][0]
+
+
+def get_coordinator_order_conditions(status=None, area=None, zone=None, driver=None, search=None):
+    """Build the WHERE conditions for the coordinator order filters"""
+    conditions = []
+    values = {}
+
+    if status:
+        if status == "Pending":
+            conditions.append("(o.order_status = %(status)s OR o.order_status IS NULL OR o.order_status = '')")
+        else:
+            conditions.append("o.order_status = %(status)s")
+        values["status"] = status
+
+    if area:
+        conditions.append("o.accommodation_area = %(area)s")
+        values["area"] = area
+
+    if zone:
+        conditions.append("o.zone_number = %(zone)s")
+        values["zone"] = normalize_number(zone)
+
+    if driver == "unassigned":
+        conditions.append("(o.assigned_volunteer IS NULL OR o.assigned_volunteer = '')")
+    elif driver:
+        conditions.append("o.assigned_volunteer = %(driver)s")
+        values["driver"] = driver
+
+    if search:
+        conditions.append("(o.name1 LIKE %(search)s OR o.mobile LIKE %(search)s OR o.name LIKE %(search)s)")
+        values["search"] = f"%{search.strip()}%"
+
+    return conditions, values
+
+
+def get_where_clause(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+@frappe.whitelist(allow_guest=True)
+def get_order_summary():
+    """Order, biriyani and collection totals per status for the coordinator dashboard"""
+    rows = frappe.db.sql("""
+        SELECT
+            COALESCE(NULLIF(order_status, ''), 'Pending') AS status,
+            COUNT(*) AS order_count,
+            COALESCE(SUM(no_of_biriyani), 0) AS total_biriyani,
+            COALESCE(SUM(collected_amount), 0) AS total_collected
+        FROM `tabOrders`
+        GROUP BY status
+    """, as_dict=True)
+
+    per_biriyani_charge = get_per_biriyani_charge()
+    status_counts = {status: 0 for status in ORDER_STATUSES}
+    biriyani_by_status = {status: 0 for status in ORDER_STATUSES}
+    for row in rows:
+        status_counts[row.status] = int(row.order_count)
+        biriyani_by_status[row.status] = int(row.total_biriyani)
+
+    total_biriyani = sum(biriyani_by_status.values())
+    return {
+        "total_orders": sum(status_counts.values()),
+        "total_biriyani": total_biriyani,
+        "total_amount": total_biriyani * per_biriyani_charge,
+        "total_collected": sum(float(row.total_collected) for row in rows),
+        "status_counts": status_counts,
+        "biriyani_by_status": biriyani_by_status,
+    }
 
 
 @frappe.whitelist(allow_guest=True)
@@ -643,15 +804,16 @@ def assign_order_to_driver(order_id, driver_id):
         return {"success": False, "error": "Order ID required"}
 
     try:
-        frappe.db.set_value("Orders", order_id, "assigned_volunteer", driver_id or None)
-        # Update status based on assignment
-        if driver_id:
-            frappe.db.set_value("Orders", order_id, "order_status", "Assigned")
-        else:
-            frappe.db.set_value("Orders", order_id, "order_status", "Pending")
+        results, previous_drivers = assign_orders([order_id], driver_id)
+        if results[order_id] == NOT_FOUND:
+            return {"success": False, "error": "Order not found"}
+
+        if results[order_id] == ASSIGNED:
+            publish_order_changes(order_id, [driver_id, *previous_drivers], assigned_volunteer=driver_id or None)
         frappe.db.commit()
         return {"success": True}
     except Exception as e:
+        frappe.db.rollback()
         return {"success": False, "error": str(e)}
 
 
@@ -666,20 +828,143 @@ def bulk_assign_orders(order_ids, driver_id):
         return {"success": False, "error": "No orders provided"}
 
     try:
-        for order_id in order_ids:
-            frappe.db.set_value("Orders", order_id, "assigned_volunteer", driver_id or None)
-            # Update status to Assigned if driver is set
-            if driver_id:
-                frappe.db.set_value("Orders", order_id, "order_status", "Assigned")
-            else:
-                frappe.db.set_value("Orders", order_id, "order_status", "Pending")
+        results, previous_drivers = assign_orders(order_ids, driver_id)
+        assigned = [order_id for order_id, result in results.items() if result == ASSIGNED]
+        publish_order_changes(assigned, [driver_id, *previous_drivers], assigned_volunteer=driver_id or None)
+        frappe.db.commit()
+        return {"success": True, "count": len(assigned), "results": results}
+    except Exception as e:
+        frappe.db.rollback()
+        return {"success": False, "error": str(e)}
+
+
+@frappe.whitelist(allow_guest=True)
+@guest_endpoint(**PLAN_LIMIT, cache_ttl=MEMO_TTL)
+def get_assignment_plan(max_biriyani=None, drivers=None):
+    """Proposed driver for every unassigned delivery order, nothing is saved.
+
+    See foodcharity.dispatch.plan_assignment, pass the returned `assignments`
+    to commit_assignment_plan to apply it."""
+    if isinstance(drivers, str):
+        drivers = frappe.parse_json(drivers)
+    return plan_assignment(cint(max_biriyani) or None, drivers or None)
+
+
+@frappe.whitelist(allow_guest=True)
+def commit_assignment_plan(assignments):
+    """Apply an {order: driver} plan from get_assignment_plan in one transaction"""
+    if isinstance(assignments, str):
+        assignments = frappe.parse_json(assignments)
+
+    if not assignments:
+        return {"success": False, "error": "No orders provided"}
+
+    try:
+        results = assign_planned_orders(assignments)
+        assigned = [order_id for order_id, result in results.items() if result == ASSIGNED]
+        by_driver = {}
+        for order_id in assigned:
+            by_driver.setdefault(assignments[order_id], []).append(order_id)
+        for driver_id, order_ids in by_driver.items():
+            publish_order_changes(order_ids, [driver_id], assigned_volunteer=driver_id, order_status="Assigned")
         frappe.db.commit()
-        return {"success": True, "count": len(order_ids)}
+        return {"success": True, "count": len(assigned), "results": results}
     except Exception as e:
+        frappe.db.rollback()
         return {"success": False, "error": str(e)}
 
 
+def assign_planned_orders(assignments, batch_size=ASSIGN_BATCH_SIZE):
+    """Assign each order to its own driver with one UPDATE ... CASE per batch.
+
+    Only orders still unassigned are written, anything assigned since the
+    plan was made is skipped, as are orders planned for a non-driver."""
+    drivers = set(frappe.get_all(
+        "Volunteer", filters={"name": ["in", list(set(assignments.values()))], "interest": "Driver"}, pluck="name"
+    ))
+    now = now_datetime()
+    results = {}
+
+    order_ids = list(assignments)
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        current = dict(frappe.db.sql(
+            "SELECT name, assigned_volunteer FROM `tabOrders` WHERE name IN %s FOR UPDATE", (tuple(batch),)
+        ))
+
+        to_assign = []
+        for order_id in batch:
+            if order_id not in current or assignments[order_id] not in drivers:
+                results[order_id] = NOT_FOUND
+            elif current[order_id]:
+                results[order_id] = SKIPPED
+            else:
+                results[order_id] = ASSIGNED
+                to_assign.append(order_id)
+
+        if to_assign:
+            cases = " ".join(["WHEN %s THEN %s"] * len(to_assign))
+            values = [value for order_id in to_assign for value in (order_id, assignments[order_id])]
+            frappe.db.sql(f"""
+                UPDATE `tabOrders`
+                SET assigned_volunteer = CASE name {cases} END, order_status = 'Assigned',
+                    modified = %s, modified_by = %s
+                WHERE name IN %s
+            """, (*values, now, frappe.session.user, tuple(to_assign)))
+
+    return results
+
+
+def assign_orders(order_ids, driver_id, batch_size=ASSIGN_BATCH_SIZE):
+    """Assign orders to `driver_id` (or unassign them when it is empty) with one
+    UPDATE per batch instead of a set_value per field and order.
+
+    Orders already with that driver are skipped so their delivery status is kept.
+    Returns the result for every order id and the drivers orders were taken from.
+    Commit or roll back is left to the caller, so all batches share one transaction."""
+    driver_id = driver_id or None
+    status = "Assigned" if driver_id else "Pending"
+    now = now_datetime()
+    results = {}
+    previous_drivers = set()
+
+    order_ids = list(dict.fromkeys(order_ids))
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        current = dict(frappe.db.sql(
+            "SELECT name, assigned_volunteer FROM `tabOrders` WHERE name IN %s FOR UPDATE", (tuple(batch),)
+        ))
+
+        to_assign = []
+        for order_id in batch:
+            if order_id not in current:
+                results[order_id] = NOT_FOUND
+            elif (current[order_id] or None) == driver_id:
+                results[order_id] = SKIPPED
+            else:
+                results[order_id] = ASSIGNED
+                to_assign.append(order_id)
+                previous_drivers.add(current[order_id])
+
+        if to_assign:
+            frappe.db.sql("""
+                UPDATE `tabOrders`
+                SET assigned_volunteer = %(driver)s, order_status = %(status)s,
+                    modified = %(now)s, modified_by = %(user)s
+                WHERE name IN %(names)s
+            """, {
+                "driver": driver_id,
+                "status": status,
+                "now": now,
+                "user": frappe.session.user,
+                "names": tuple(to_assign)
+            })
+
+    return results, previous_drivers - {None, ""}
+
+
 @frappe.whitelist(allow_guest=True)
+@guest_endpoint(**LOGIN_LIMIT)
 def coordinator_login(password):
     """Authenticate coordinator by password"""
     if not password:
@@ -706,12 +991,12 @@ def update_order_status(order_id, status):
     if not order_id:
         return {"success": False, "error": "Order ID required"}
 
-    valid_statuses = ["Pending", "Assigned", "Out for Delivery", "Delivered", "Collected"]
-    if status not in valid_statuses:
+    if status not in ORDER_STATUSES:
         return {"success": False, "error": "Invalid status"}
 
     try:
         frappe.db.set_value("Orders", order_id, "order_status", status)
+        publish_order_update(order_id, order_status=status)
         frappe.db.commit()
         return {"success": True, "status": status}
     except Exception as e:
@@ -726,6 +1011,7 @@ def update_order_remark(order_id, remark):
 
     try:
         frappe.db.set_value("Orders", order_id, "remark", remark or "")
+        publish_order_update(order_id)
         frappe.db.commit()
         return {"success": True}
     except Exception as e:
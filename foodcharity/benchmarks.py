@@ -0,0 +1,202 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import frappe
+import numpy as np
+from frappe.utils import now_datetime
+
+from foodcharity.address import ensure_street, get_building_name, upsert_buildings
+from foodcharity.api import get_streets, get_zones, search_orders_by_phone
+from foodcharity.dispatch import cluster
+from foodcharity.gazetteer import clear_cache, streets_key, zones_key
+from foodcharity.phone import get_phone_search_key
+from foodcharity.qnas import QnasFetcher
+from foodcharity.routing import nearest_neighbour_order
+
+BENCH_ZONE = "989"
+BUILDING_BENCH_ROWS = 2000
+GAZETTEER_BENCH_REQUESTS = 500
+QNAS_BENCH_STREETS = 200
+QNAS_BENCH_RATE = 100
+QNAS_BENCH_WORKERS = 16
+QNAS_STUB_LATENCY = 0.05
+PHONE_BENCH_ORDERS = 100000
+PHONE_BENCH_LOOKUPS = 50
+ROUTE_BENCH_SIZES = (5000, 50000)
+DISPATCH_BENCH_ORDERS = 5000
+DISPATCH_BENCH_DRIVERS = 100
+
+
+def run_benchmarks():
+    """Yield (label, result) for each benchmark. Writes are rolled back by the caller."""
+    yield "Building upsert", benchmark_building_upsert()
+    yield "Gazetteer", benchmark_gazetteer()
+    yield "QNAS street fetch", benchmark_qnas_fetch()
+    yield "Phone lookup", benchmark_phone_lookup()
+    for size in ROUTE_BENCH_SIZES:
+        yield "Nearest neighbour route", benchmark_nearest_neighbour(size)
+    yield "Assignment plan", benchmark_assignment_plan()
+
+
+def ensure_bench_zone():
+    if not frappe.db.exists("Zone", BENCH_ZONE):
+        frappe.get_doc({"doctype": "Zone", "zone_number": BENCH_ZONE, "zone_name_en": "Benchmark"}).insert(
+            ignore_permissions=True
+        )
+
+
+def benchmark_building_upsert(rows=BUILDING_BENCH_ROWS):
+    """Per-document exists/insert against the bulk upsert of a synthetic street"""
+    ensure_bench_zone()
+    payload = [
+        {"building_number": str(n), "x": 25.2 + n / 100000, "y": 51.5 + n / 100000}
+        for n in range(1, rows + 1)
+    ]
+
+    street_name = ensure_street(BENCH_ZONE, "1")
+    start = time.monotonic()
+    for b in payload:
+        building_name = get_building_name(BENCH_ZONE, "1", b["building_number"])
+        if not frappe.db.exists("Building", building_name):
+            frappe.get_doc({
+                "doctype": "Building",
+                "zone": BENCH_ZONE,
+                "street": street_name,
+                "street_number": "1",
+                "building_number": b["building_number"],
+                "latitude": b["x"],
+                "longitude": b["y"]
+            }).insert(ignore_permissions=True)
+    per_document = rows / (time.monotonic() - start)
+
+    ensure_street(BENCH_ZONE, "2")
+    start = time.monotonic()
+    upsert_buildings(BENCH_ZONE, "2", payload)
+    bulk = rows / (time.monotonic() - start)
+
+    return f"{rows} buildings: {per_document:.0f} rows/s per document, {bulk:.0f} rows/s bulk"
+
+
+def benchmark_gazetteer(requests=GAZETTEER_BENCH_REQUESTS):
+    """Signup-surge load, a zone list and a street list per request, uncached against cached"""
+    ensure_bench_zone()
+    for street_number in range(1, 51):
+        ensure_street(BENCH_ZONE, str(street_number))
+
+    def run(uncached):
+        start = time.monotonic()
+        for _ in range(requests):
+            if uncached:
+                clear_cache(zones_key())
+                clear_cache(streets_key(BENCH_ZONE))
+            get_zones()
+            get_streets(BENCH_ZONE)
+        return requests / (time.monotonic() - start)
+
+    return f"{requests} requests: {run(uncached=True):.0f}/s uncached, {run(uncached=False):.0f}/s cached"
+
+
+class StubQnasHandler(BaseHTTPRequestHandler):
+    """Local QNAS stand-in, every street has 20 buildings and answers after `QNAS_STUB_LATENCY`"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(QNAS_STUB_LATENCY)
+        body = json.dumps([
+            {"building_number": str(n), "x": 25.28 + n / 1000, "y": 51.52 + n / 1000}
+            for n in range(1, 21)
+        ]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def benchmark_qnas_fetch(streets=QNAS_BENCH_STREETS, rate=QNAS_BENCH_RATE, workers=QNAS_BENCH_WORKERS):
+    """Street fetches against a local stub, wall time should track the rate limit rather than latency"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubQnasHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_port}/"
+        with QnasFetcher(base_url=base_url, requests_per_second=rate, max_workers=workers) as fetcher:
+            start = time.monotonic()
+            for _ in fetcher.fetch_many(range(streets), lambda street: f"get_buildings/1/{street}"):
+                pass
+            elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return f"{streets} streets in {elapsed:.2f}s ({streets / elapsed:.0f}/s, limit {rate}/s, {workers} workers)"
+
+
+def benchmark_phone_lookup(orders=PHONE_BENCH_ORDERS, lookups=PHONE_BENCH_LOOKUPS):
+    """Leading-wildcard LIKE scan against the reversed-digits key on synthetic orders"""
+    now = now_datetime()
+    rows = []
+    for n in range(orders):
+        mobile = f"6{n:07d}"
+        whatsapp = f"+974 3{n:07d}"
+        rows.append((
+            f"PHONE-BENCH-{n}", now, now, "Administrator", "Administrator", f"Bench {n}", mobile, whatsapp,
+            get_phone_search_key(mobile), get_phone_search_key(whatsapp), "Pending",
+        ))
+    frappe.db.bulk_insert(
+        "Orders",
+        [
+            "name", "creation", "modified", "owner", "modified_by", "name1", "mobile", "whatsapp_number",
+            "mobile_search_key", "whatsapp_search_key", "order_status",
+        ],
+        rows,
+    )
+    phones = [f"3{n:07d}" for n in range(0, orders, max(1, orders // lookups))]
+
+    start = time.monotonic()
+    for phone in phones:
+        frappe.db.sql_list(
+            """SELECT name FROM `tabOrders` WHERE mobile LIKE %(phone)s OR whatsapp_number LIKE %(phone)s
+            ORDER BY creation DESC LIMIT 10""",
+            {"phone": f"%{phone}%"}
+        )
+    scan = (time.monotonic() - start) / len(phones)
+
+    start = time.monotonic()
+    for phone in phones:
+        search_orders_by_phone(phone)
+    indexed = (time.monotonic() - start) / len(phones)
+
+    return f"{orders} orders: LIKE scan {scan * 1000:.1f} ms, indexed key {indexed * 1000:.1f} ms per lookup"
+
+
+def benchmark_nearest_neighbour(size):
+    """Grid-indexed walk on synthetic orders spread over Qatar"""
+    rng = np.random.default_rng(11)
+    lat = 24.6 + rng.random(size) * 1.5
+    lng = 50.8 + rng.random(size) * 0.8
+
+    start = time.monotonic()
+    nearest_neighbour_order(lat, lng)
+    return f"{size} orders in {time.monotonic() - start:.2f}s"
+
+
+def benchmark_assignment_plan(orders=DISPATCH_BENCH_ORDERS, drivers=DISPATCH_BENCH_DRIVERS):
+    """Capacity constrained clustering of synthetic orders across a driver roster"""
+    rng = np.random.default_rng(13)
+    areas = ["Al Sadd", "Wakrah", "Lusail", None]
+    points = [
+        frappe._dict(lat=24.9 + rng.random() * 0.6, lng=51.2 + rng.random() * 0.4, load=int(rng.integers(1, 6)), area=areas[n % 4])
+        for n in range(orders)
+    ]
+    roster = [frappe._dict(name=f"D{n}", preferred_delivery_location=areas[n % 4]) for n in range(drivers)]
+    cap = np.ceil(sum(p.load for p in points) / drivers * 1.1)
+
+    start = time.monotonic()
+    cluster(points, roster, [], np.full(drivers, cap))
+    return f"{orders} orders, {drivers} drivers in {time.monotonic() - start:.2f}s"
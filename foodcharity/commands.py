@@ -0,0 +1,69 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("explain-foodcharity-queries")
+@pass_context
+def explain_foodcharity_queries(context):
+    """EXPLAIN the hot API queries and flag any that still scan the full table"""
+    from foodcharity.indexes import explain_hot_queries
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        full_scans = 0
+        for label, plan in explain_hot_queries():
+            click.secho(label, bold=True)
+            for row in plan:
+                full_scan = row.get("type") == "ALL"
+                full_scans += full_scan
+                click.secho(
+                    f"  table={row.get('table')} type={row.get('type')} key={row.get('key')} "
+                    f"rows={row.get('rows')} extra={row.get('Extra') or ''}",
+                    fg="red" if full_scan else "green",
+                )
+        if full_scans:
+            click.secho(f"{full_scans} full table scan(s) found, run `bench migrate` to create the indexes", fg="red")
+    finally:
+        frappe.destroy()
+
+
+@click.command("qnas-stats")
+@pass_context
+def qnas_stats(context):
+    """Show QNAS call, error and latency counters per endpoint"""
+    from foodcharity.qnas import get_qnas_stats
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        for endpoint, counters in sorted(get_qnas_stats().items()):
+            click.echo(
+                f"{endpoint}: calls={counters.get('calls', 0)} errors={counters.get('errors', 0)} "
+                f"rejected={counters.get('rejected', 0)} avg_ms={counters['avg_ms']}"
+            )
+    finally:
+        frappe.destroy()
+
+
+@click.command("run-foodcharity-benchmarks")
+@pass_context
+def run_foodcharity_benchmarks(context):
+    """Time the hot paths on synthetic data, everything written is rolled back"""
+    from foodcharity.benchmarks import run_benchmarks
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        for label, result in run_benchmarks():
+            click.echo(f"{label}: {result}")
+    finally:
+        frappe.db.rollback()
+        frappe.destroy()
+
+
+commands = [explain_foodcharity_queries, qnas_stats, run_foodcharity_benchmarks]
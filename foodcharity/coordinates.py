@@ -0,0 +1,97 @@
+import frappe
+import requests
+
+from foodcharity.address import ensure_street, normalize_number, set_building_coordinates, upsert_buildings
+from foodcharity.gazetteer import is_missing, mark_missing
+from foodcharity.qnas import QnasUnavailableError, get_sync_fetcher
+
+RESOLVE_JOB_ID = "foodcharity_resolve_coordinates"
+
+# Orders still to be delivered that have an address but no coordinate yet
+PENDING_CONDITION = """(o.coordinate IS NULL OR o.coordinate = '')
+    AND o.zone_number != '' AND o.street_number != '' AND o.building_number != ''
+    AND o.order_status NOT IN ('Delivered', 'Collected')"""
+
+
+def enqueue_coordinate_resolution():
+    """Queue the resolver once the order is committed, at most one job waits at a time"""
+    frappe.enqueue(
+        "foodcharity.coordinates.resolve_pending_coordinates",
+        queue="short",
+        job_id=RESOLVE_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+def resolve_pending_coordinates():
+    """Fill `coordinate` on orders saved without one.
+
+    Orders whose building is already local are filled straight away, the rest
+    are fetched from QNAS one street at a time, so a street shared by many
+    orders costs a single request, and saved locally for the next lookup.
+    Streets and buildings QNAS doesn't know go into the miss cache like
+    interactive lookups, so later runs skip them until the misses expire."""
+    backfill_coordinates()
+
+    streets = get_pending_streets()
+    if not streets or not frappe.db.get_single_value("Foodcharity Settings", "qnas_enabled"):
+        return
+
+    misses = []
+    with get_sync_fetcher() as fetcher:
+        for (zone_number, street_number), buildings, error in fetcher.fetch_many(
+            list(streets), lambda street: f"get_buildings/{street[0]}/{street[1]}"
+        ):
+            if isinstance(error, QnasUnavailableError):
+                # QNAS is down, the next run picks the remaining streets up
+                break
+            if is_not_found(error):
+                buildings, error = [], None
+            if error:
+                frappe.log_error(f"Error fetching buildings for {zone_number}-{street_number}: {error}")
+                continue
+
+            if not buildings:
+                misses.append((zone_number, street_number, None))
+                continue
+            ensure_street(zone_number, street_number)
+            upsert_buildings(zone_number, street_number, buildings)
+            found = {normalize_number(b["building_number"]) for b in buildings if b.get("x") and b.get("y")}
+            misses += [
+                (zone_number, street_number, building)
+                for building in streets[(zone_number, street_number)] if building not in found
+            ]
+
+    backfill_coordinates()
+    frappe.db.commit()
+    # After the commit, saving a street clears its misses once committed
+    for zone_number, street_number, building_number in misses:
+        mark_missing(zone_number, street_number, building_number)
+
+
+def is_not_found(error):
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.exceptions.HTTPError) and response is not None and response.status_code == 404
+
+
+def get_pending_streets():
+    """{(zone, street): pending building numbers}, leaving out known QNAS misses"""
+    streets = {}
+    for zone_number, street_number, building_number in frappe.db.sql(f"""
+        SELECT DISTINCT o.zone_number, o.street_number, o.building_number
+        FROM `tabOrders` o
+        WHERE {PENDING_CONDITION}
+    """):
+        if not is_missing(zone_number, street_number, building_number):
+            streets.setdefault((zone_number, street_number), []).append(building_number)
+    return streets
+
+
+def backfill_coordinates():
+    """Copy local building coordinates onto the orders still missing one"""
+    return set_building_coordinates(frappe.db.sql(f"""
+        SELECT o.name, o.assigned_volunteer, o.zone_number, o.street_number, o.building_number, o.coordinate
+        FROM `tabOrders` o
+        WHERE {PENDING_CONDITION}
+    """, as_dict=True))
@@ -0,0 +1,229 @@
+import math
+
+import frappe
+import numpy as np
+
+from foodcharity.routing import project
+
+MAX_ITERATIONS = 10
+# Headroom over an even split of the biriyani when no cap is given
+BALANCE_SLACK = 0.1
+# Distances to orders in a driver's preferred area count this much
+PREFERRED_AREA_WEIGHT = 0.5
+
+
+def plan_assignment(max_biriyani=None, drivers=None):
+    """Propose drivers for every unassigned order, nothing is written.
+
+    Orders are clustered by coordinate with a capacity constrained k-means:
+    each driver is a centroid, seeded from the orders they already carry or
+    from their preferred delivery area, and each round hands orders out in
+    order of regret (how much worse their second choice is) to the closest
+    driver still under `max_biriyani`. Orders in a driver's preferred area
+    count as closer. Orders without a coordinate go to a driver preferring
+    their area when one has room. Without `max_biriyani` every driver is
+    capped at an even share of all biriyani plus some headroom.
+
+    Returns the plan for `api.commit_assignment_plan` and per-driver totals."""
+    roster = get_roster(drivers)
+    orders = get_unassigned_orders()
+    if not roster or not orders:
+        return make_plan(roster, orders, {}, max_biriyani or 0)
+
+    existing = get_assigned_points([d.name for d in roster])
+    total = sum(o.load for o in orders) + sum(d.load for d in roster)
+    cap = int(max_biriyani or math.ceil(total / len(roster) * (1 + BALANCE_SLACK)))
+    capacity = np.array([max(0, cap - d.load) for d in roster], dtype=float)
+
+    located = [o for o in orders if o.lat is not None]
+    assignments = {}
+    if located:
+        choice = cluster(located, roster, existing, capacity)
+        for order, d in zip(located, choice.tolist()):
+            if d >= 0:
+                assignments[order.name] = roster[d].name
+                capacity[d] -= order.load
+
+    # Orders without a coordinate follow the drivers' preferred areas, least loaded first
+    for order in orders:
+        if order.lat is not None or not order.area:
+            continue
+        candidates = [
+            d for d, driver in enumerate(roster)
+            if driver.preferred_delivery_location == order.area and capacity[d] >= order.load
+        ]
+        if candidates:
+            d = max(candidates, key=lambda d: capacity[d])
+            assignments[order.name] = roster[d].name
+            capacity[d] -= order.load
+
+    return make_plan(roster, orders, assignments, cap)
+
+
+def cluster(orders, roster, existing, capacity):
+    """Driver index per order (-1 when no driver has room), see `plan_assignment`"""
+    k = len(roster)
+    lat = [o.lat for o in orders] + [p[1] for p in existing]
+    lng = [o.lng for o in orders] + [p[2] for p in existing]
+    x, y = project(lat, lng)
+    n = len(orders)
+    ox, oy = x[:n], y[:n]
+    load = np.array([o.load for o in orders], dtype=float)
+
+    # Orders a driver already carries keep pulling their centroid
+    driver_index = {d.name: i for i, d in enumerate(roster)}
+    fixed_sum = np.zeros((k, 2))
+    fixed_count = np.zeros(k)
+    for (driver, _, _), px, py in zip(existing, x[n:], y[n:]):
+        fixed_sum[driver_index[driver]] += (px, py)
+        fixed_count[driver_index[driver]] += 1
+
+    # Areas as integer codes, orders without an area and drivers without a preference never match
+    codes = {}
+    areas = np.array([codes.setdefault(o.area, len(codes)) if o.area else -1 for o in orders])
+    preferred = np.array([codes.get(d.preferred_delivery_location, -2) for d in roster])
+    weight = np.where(areas[:, None] == preferred[None, :], PREFERRED_AREA_WEIGHT, 1.0)
+
+    centroids = seed_centroids(ox, oy, areas, preferred, fixed_sum, fixed_count)
+    choice = None
+    for _ in range(MAX_ITERATIONS):
+        cost = np.hypot(ox[:, None] - centroids[:, 0], oy[:, None] - centroids[:, 1]) * weight
+        new_choice = assign_with_capacity(cost, load, capacity)
+        if choice is not None and np.array_equal(new_choice, choice):
+            break
+        choice = new_choice
+
+        for d in range(k):
+            members = choice == d
+            count = members.sum() + fixed_count[d]
+            if count:
+                centroids[d] = (fixed_sum[d] + (ox[members].sum(), oy[members].sum())) / count
+
+    return choice
+
+
+def seed_centroids(x, y, areas, preferred, fixed_sum, fixed_count):
+    """Start each driver at their current orders, else in their preferred area,
+    else at the order farthest from every centroid placed so far. Drivers
+    sharing a preferred area start at its orders farthest from each other."""
+    k = len(preferred)
+    centroids = np.zeros((k, 2))
+    nearest = np.full(len(x), np.inf)
+
+    def place(d, point):
+        nonlocal nearest
+        centroids[d] = point
+        nearest = np.minimum(nearest, np.hypot(x - point[0], y - point[1]))
+
+    unplaced = []
+    for d in range(k):
+        if fixed_count[d]:
+            place(d, fixed_sum[d] / fixed_count[d])
+        else:
+            unplaced.append(d)
+
+    for d in unplaced:
+        in_area = areas == preferred[d]
+        if not in_area.any():
+            candidates = np.ones(len(x), dtype=bool)
+        else:
+            candidates = in_area
+        if np.isinf(nearest[candidates]).all():
+            # Nothing placed nearby yet, start from the middle of the area (or the northernmost order)
+            point = (x[in_area].mean(), y[in_area].mean()) if in_area.any() else (x[np.argmax(y)], y[np.argmax(y)])
+        else:
+            i = int(np.argmax(np.where(candidates, nearest, -1)))
+            point = (x[i], y[i])
+        place(d, point)
+
+    return centroids
+
+
+def assign_with_capacity(cost, load, capacity):
+    """Give each order its cheapest driver with room left, deciding the orders
+    with the most to lose from a worse driver first"""
+    preference = np.argsort(cost, axis=1)
+    if cost.shape[1] > 1:
+        ranked = np.take_along_axis(cost, preference[:, :2], axis=1)
+        regret = ranked[:, 1] - ranked[:, 0]
+    else:
+        regret = -cost[:, 0]
+
+    # Plain lists, the loop below mostly stops at the first choice
+    preference, load, remaining = preference.tolist(), load.tolist(), capacity.tolist()
+    choice = np.full(len(cost), -1)
+    for i in np.argsort(-regret, kind="stable").tolist():
+        for d in preference[i]:
+            if remaining[d] >= load[i]:
+                choice[i] = d
+                remaining[d] -= load[i]
+                break
+    return choice
+
+
+def make_plan(roster, orders, assignments, cap):
+    loads = {order.name: order.load for order in orders}
+    drivers = []
+    for driver in roster:
+        names = [name for name, d in assignments.items() if d == driver.name]
+        biriyani = sum(loads[name] for name in names)
+        drivers.append({
+            "driver": driver.name,
+            "full_name": driver.full_name,
+            "preferred_delivery_location": driver.preferred_delivery_location,
+            "orders": len(names),
+            "biriyani": biriyani,
+            "load": driver.load + biriyani,
+        })
+
+    return {
+        "assignments": assignments,
+        "drivers": drivers,
+        "unplanned": [order.name for order in orders if order.name not in assignments],
+        "max_biriyani": cap,
+    }
+
+
+def get_roster(drivers=None):
+    """Drivers with the biriyani they still have to deliver"""
+    conditions = ["v.interest = 'Driver'"]
+    if drivers:
+        conditions.append("v.name IN %(drivers)s")
+
+    roster = frappe.db.sql(f"""
+        SELECT v.name, v.full_name, v.preferred_delivery_location, COALESCE(SUM(o.no_of_biriyani), 0) AS biriyani
+        FROM `tabVolunteer` v
+        LEFT JOIN `tabOrders` o ON o.assigned_volunteer = v.name
+            AND o.order_status NOT IN ('Delivered', 'Collected')
+        WHERE {" AND ".join(conditions)}
+        GROUP BY v.name, v.full_name, v.preferred_delivery_location
+        ORDER BY v.name
+    """, {"drivers": tuple(drivers or ())}, as_dict=True)
+    for driver in roster:
+        driver.load = int(driver.pop("biriyani"))
+    return roster
+
+
+def get_unassigned_orders():
+    """Unassigned delivery orders with their coordinates"""
+    orders = frappe.db.sql("""
+        SELECT o.name, o.no_of_biriyani, o.accommodation_area AS area, o.latitude AS lat, o.longitude AS lng
+        FROM `tabOrders` o
+        WHERE (o.assigned_volunteer IS NULL OR o.assigned_volunteer = '') AND o.order_type = 'Delivery'
+        ORDER BY o.creation
+    """, as_dict=True)
+
+    for order in orders:
+        order.load = int(order.pop("no_of_biriyani") or 0)
+        if not (order.lat and order.lng):
+            order.lat = order.lng = None
+    return orders
+
+
+def get_assigned_points(drivers):
+    """(driver, lat, lng) of the located orders the drivers already carry"""
+    return frappe.db.sql("""
+        SELECT assigned_volunteer, latitude, longitude
+        FROM `tabOrders`
+        WHERE assigned_volunteer IN %s AND latitude != 0 AND longitude != 0
+    """, (tuple(drivers),))
@@ -3,6 +3,19 @@
 
 from frappe.model.document import Document
 
+from foodcharity.address import update_building_orders
+from foodcharity.gazetteer import clear_buildings_cache
+from foodcharity.spatial import get_geohash
+
 
 class Building(Document):
-	pass
+	def validate(self):
+		self.geohash = get_geohash(self.latitude, self.longitude)
+
+	def on_update(self):
+		clear_buildings_cache(self.zone, self.street_number)
+		if self.has_value_changed("latitude") or self.has_value_changed("longitude"):
+			update_building_orders(self.zone, self.street_number, self.building_number)
+
+	def on_trash(self):
+		clear_buildings_cache(self.zone, self.street_number)
@@ -0,0 +1,196 @@
+# Copyright (c) 2024, Aadhil and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from foodcharity.address import (
+	bulk_upsert,
+	ensure_street,
+	fetch_building,
+	fetch_street_buildings,
+	get_building_name,
+	get_buildings_fingerprint,
+	load_street_buildings,
+	resolve_building,
+	resolve_buildings,
+	street_fetch_key,
+	upsert_buildings,
+)
+from foodcharity.gazetteer import clear_cache, missing_key
+from foodcharity.indexes import INDEXES, ensure_indexes, explain_hot_queries
+from foodcharity.qnas import QnasUnavailableError
+from foodcharity.spatial import encode_geohash, get_covering_cells, get_nearest_building
+
+TEST_ZONE = "990"
+
+
+def make_payload(count, offset=0.0):
+	return [
+		{"building_number": str(n), "x": 25.2 + n / 100000 + offset, "y": 51.5 + n / 100000}
+		for n in range(1, count + 1)
+	]
+
+
+class TestBuilding(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		if not frappe.db.exists("Zone", TEST_ZONE):
+			frappe.get_doc({
+				"doctype": "Zone",
+				"zone_number": TEST_ZONE,
+				"zone_name_en": "Test Zone"
+			}).insert(ignore_permissions=True)
+
+	def test_upsert_inserts_then_updates(self):
+		ensure_street(TEST_ZONE, "1")
+		self.assertEqual(upsert_buildings(TEST_ZONE, "1", make_payload(5)), 5)
+		upsert_buildings(TEST_ZONE, "1", make_payload(5, offset=1))
+
+		building = frappe.db.get_value("Building", get_building_name(TEST_ZONE, "1", "3"), ["street", "latitude"], as_dict=True)
+		self.assertEqual(building.street, f"{TEST_ZONE}-1")
+		self.assertAlmostEqual(building.latitude, 26.2 + 3 / 100000, places=6)
+		self.assertEqual(frappe.db.count("Building", {"zone": TEST_ZONE, "street_number": "1"}), 5)
+
+	def test_ensure_street_keeps_synced_names(self):
+		ensure_street(TEST_ZONE, "2")
+		frappe.db.set_value("Street", f"{TEST_ZONE}-2", "street_name_en", "Synced Street")
+		ensure_street(TEST_ZONE, "2")
+		self.assertEqual(frappe.db.get_value("Street", f"{TEST_ZONE}-2", "street_name_en"), "Synced Street")
+
+	def test_resolve_building_normalizes_input(self):
+		ensure_street(TEST_ZONE, "5")
+		upsert_buildings(TEST_ZONE, "5", make_payload(3))
+
+		self.assertIsNotNone(resolve_building(f" 0{TEST_ZONE}", "05 ", "2"))
+		self.assertIsNone(resolve_building(TEST_ZONE, "5", "99"))
+		self.assertIsNone(resolve_building(TEST_ZONE, "5", ""))
+
+		buildings = resolve_buildings([(TEST_ZONE, "5", "1"), (TEST_ZONE, "5", "3"), (TEST_ZONE, "5", "99"), (None, "5", "1")])
+		self.assertEqual(sorted(buildings), [f"{TEST_ZONE}-5-1", f"{TEST_ZONE}-5-3"])
+
+	def test_fingerprint_ignores_payload_order(self):
+		payload = make_payload(10)
+		self.assertEqual(get_buildings_fingerprint(payload), get_buildings_fingerprint(payload[::-1]))
+		self.assertNotEqual(get_buildings_fingerprint(payload), get_buildings_fingerprint(make_payload(10, offset=0.001)))
+
+	def test_hot_queries_use_indexes(self):
+		ensure_indexes()
+		for doctype, _, index_name in INDEXES:
+			self.assertTrue(frappe.db.has_index(f"tab{doctype}", index_name), index_name)
+
+		# Test tables are tiny, so check an index is usable rather than that the optimizer picks it
+		for label, plan in explain_hot_queries():
+			self.assertTrue(all(row.get("possible_keys") for row in plan), label)
+
+	def test_bulk_upsert_updates_only_given_fields(self):
+		street_name = ensure_street(TEST_ZONE, "3")
+		rows = [
+			{
+				"name": get_building_name(TEST_ZONE, "3", str(n)),
+				"zone": TEST_ZONE,
+				"street": street_name,
+				"street_number": "3",
+				"building_number": str(n),
+				"latitude": 25.0,
+				"longitude": 51.0,
+			}
+			for n in range(1, 6)
+		]
+		# Spread over several statements
+		self.assertEqual(bulk_upsert("Building", rows, batch_size=2), 5)
+		self.assertEqual(frappe.db.count("Building", {"zone": TEST_ZONE, "street_number": "3"}), 5)
+
+		for row in rows:
+			row.update(latitude=26.0, longitude=52.0)
+		bulk_upsert("Building", rows, update_fields=["latitude"], batch_size=2)
+		self.assertEqual(frappe.db.get_value("Building", rows[4]["name"], ["latitude", "longitude"]), (26.0, 51.0))
+
+		# No update fields leaves existing records untouched
+		for row in rows:
+			row.update(latitude=27.0)
+		bulk_upsert("Building", rows, update_fields=[])
+		self.assertEqual(frappe.db.get_value("Building", rows[0]["name"], "latitude"), 26.0)
+		self.assertEqual(frappe.db.count("Building", {"zone": TEST_ZONE, "street_number": "3"}), 5)
+
+	def test_qnas_misses_are_cached(self):
+		for street in ("6", "7"):
+			clear_cache(missing_key(TEST_ZONE, street))
+			clear_cache(street_fetch_key(TEST_ZONE, street))
+
+		with patch("foodcharity.address.get_qnas_json", return_value=make_payload(3)) as qnas:
+			self.assertIsNotNone(fetch_building(TEST_ZONE, "6", "2"))
+			self.assertIsNone(fetch_building(TEST_ZONE, "6", "99"))
+			self.assertIsNone(fetch_building(TEST_ZONE, "06", "099"))
+		qnas.assert_called_once()
+
+		with patch("foodcharity.address.get_qnas_json", return_value=[]) as qnas:
+			self.assertEqual(fetch_street_buildings(TEST_ZONE, "7"), [])
+			self.assertIsNone(fetch_building(TEST_ZONE, "7", "1"))
+		self.assertEqual(qnas.call_count, 1)
+
+		# Saving the street's buildings (as a sync does) forgets its misses
+		ensure_street(TEST_ZONE, "7")
+		upsert_buildings(TEST_ZONE, "7", make_payload(1))
+		frappe.db.after_commit.run()
+		with patch("foodcharity.address.get_qnas_json", return_value=make_payload(1)) as qnas:
+			self.assertIsNotNone(fetch_building(TEST_ZONE, "7", "1"))
+		qnas.assert_called_once()
+
+	def test_street_fetch_is_shared_and_saved(self):
+		clear_cache(missing_key(TEST_ZONE, "8"))
+		clear_cache(street_fetch_key(TEST_ZONE, "8"))
+
+		with patch("foodcharity.address.get_qnas_json", return_value=make_payload(4)) as qnas:
+			self.assertEqual(len(load_street_buildings(TEST_ZONE, "8")), 4)
+			self.assertEqual(len(load_street_buildings(TEST_ZONE, "08")), 4)
+		qnas.assert_called_once()
+		self.assertEqual(frappe.db.count("Building", {"zone": TEST_ZONE, "street_number": "8"}), 4)
+
+		# While another worker holds the street lock, callers wait for its result
+		key = street_fetch_key(TEST_ZONE, "9")
+		clear_cache(key)
+		frappe.cache.set(frappe.cache.make_key(f"{key}:lock"), 1, px=2000)
+		try:
+			with patch("foodcharity.address.get_qnas_json") as qnas, patch("foodcharity.guard.get_memo") as get_memo:
+				get_memo.side_effect = [None, None, (make_payload(2),)]
+				self.assertEqual(len(load_street_buildings(TEST_ZONE, "9")), 2)
+			qnas.assert_not_called()
+
+			# A fetch outlasting the wait is not repeated by the waiters
+			frappe.cache.set(frappe.cache.make_key(f"{key}:lock"), 1, px=2000)
+			with patch("foodcharity.address.get_qnas_json") as qnas, patch("foodcharity.address.STREET_FETCH_WAIT", 0.2):
+				self.assertRaises(QnasUnavailableError, load_street_buildings, TEST_ZONE, "9")
+			qnas.assert_not_called()
+		finally:
+			frappe.cache.delete(frappe.cache.make_key(f"{key}:lock"))
+
+	def test_nearest_building(self):
+		ensure_street(TEST_ZONE, "10")
+		upsert_buildings(TEST_ZONE, "10", [
+			{"building_number": "1", "x": 25.9001, "y": 51.0001},
+			{"building_number": "2", "x": 25.9011, "y": 51.0011},
+			# Saved the other way round by QNAS
+			{"building_number": "3", "x": 51.0031, "y": 25.9031},
+		])
+		building_name = get_building_name(TEST_ZONE, "10", "3")
+		self.assertEqual(frappe.db.get_value("Building", building_name, "geohash"), encode_geohash(25.9031, 51.0031))
+
+		self.assertEqual(get_nearest_building(25.9012, 51.0012).name, get_building_name(TEST_ZONE, "10", "2"))
+		nearest = get_nearest_building(25.903, 51.003)
+		self.assertEqual((nearest.name, nearest.latitude), (building_name, 25.9031))
+		self.assertLess(nearest.distance, 20)
+		# Widens the search until something turns up, but not forever
+		self.assertEqual(get_nearest_building(25.91, 51.01).name, building_name)
+		self.assertIsNone(get_nearest_building(25.99, 51.09))
+
+	def test_covering_cells_include_every_point_in_the_box(self):
+		cells = get_covering_cells(25.28, 51.52, 25.3, 51.55)
+		self.assertLessEqual(len(cells), 32)
+		for lat in (25.28, 25.29, 25.2999):
+			for lng in (51.52, 51.535, 51.5499):
+				geohash = encode_geohash(lat, lng)
+				self.assertTrue(any(geohash.startswith(cell) for cell in cells), geohash)
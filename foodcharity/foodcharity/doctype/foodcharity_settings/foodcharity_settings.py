@@ -2,12 +2,32 @@
 # For license information, please see license.txt
 
 import frappe
+from frappe import _
 from frappe.model.document import Document
-from frappe.utils import now_datetime
-import requests
+from frappe.utils import add_days, now_datetime
+
+from foodcharity.address import (
+	get_buildings_fingerprint,
+	mark_streets_fetched,
+	upsert_buildings,
+	upsert_streets,
+	upsert_zones,
+)
+from foodcharity.gazetteer import clear_gazetteer
+from foodcharity.qnas import QnasUnavailableError, clear_qnas_headers, get_sync_fetcher
+from foodcharity.routing import parse_coordinate
+from foodcharity.snapshot import build_snapshots
 
 
 class FoodcharitySettings(Document):
+	def validate(self):
+		if self.depot_coordinate and parse_coordinate(self.depot_coordinate)[0] is None:
+			frappe.throw(_("Kitchen / Depot Coordinate must be latitude,longitude, e.g. 25.2854,51.5310"))
+
+	def on_update(self):
+		# Pick up a changed token or domain without waiting for the header cache to expire
+		clear_qnas_headers()
+
 	@frappe.whitelist()
 	def sync_qnas_data(self):
 		"""Sync all QNAS data (zones, streets, buildings) to local doctypes"""
@@ -27,7 +47,8 @@ class FoodcharitySettings(Document):
 	@frappe.whitelist()
 	def sync_buildings_only(self):
 		"""Sync only buildings, resuming from last position"""
-		start_index = self.last_synced_street_index or 0
+		# Incremental sync resumes by itself, already fetched streets are not stale
+		start_index = 0 if self.incremental_sync else (self.last_synced_street_index or 0)
 		frappe.enqueue(
 			sync_buildings_only,
 			queue="long",
@@ -38,83 +59,95 @@ class FoodcharitySettings(Document):
 		frappe.msgprint(f"Building sync started from street index {start_index}. This may take a while.")
 
 
-def get_qnas_headers():
-	"""Get QNAS API headers from settings"""
-	settings = frappe.get_single("Foodcharity Settings")
-	if settings.qnas_enabled and settings.qnas_api_token and settings.qnas_api_domain:
+class StreetSync:
+	"""Writes fetched building lists, skipping streets whose fingerprint is unchanged"""
+
+	def __init__(self):
+		self.fetched_on = now_datetime()
+		self.building_count = 0
+		self.fetched = 0
+		self.unchanged = 0
+		self.changed = 0
+		self.failed = 0
+		self.unchanged_streets = []
+
+	def save(self, street, buildings):
+		self.fetched += 1
+		fingerprint = get_buildings_fingerprint(buildings)
+		if fingerprint == street.buildings_fingerprint:
+			self.unchanged += 1
+			self.unchanged_streets.append(street.name)
+			return
+
+		self.building_count += upsert_buildings(street.zone, street.street_number, buildings)
+		frappe.db.set_value("Street", street.name, {
+			"buildings_fingerprint": fingerprint,
+			"buildings_fetched_on": self.fetched_on
+		}, update_modified=False)
+		self.changed += 1
+
+	def flush(self):
+		"""Record the fetch time of unchanged streets in one statement"""
+		mark_streets_fetched(self.unchanged_streets, self.fetched_on)
+		self.unchanged_streets = []
+
+	def get_stats(self):
 		return {
-			"X-Token": settings.get_password("qnas_api_token"),
-			"X-Domain": settings.qnas_api_domain,
-			"Accept": "application/json"
+			"synced_buildings": self.building_count,
+			"streets_fetched": self.fetched,
+			"streets_unchanged": self.unchanged,
+			"streets_changed": self.changed,
+			"streets_failed": self.failed
 		}
-	return {"Accept": "application/json"}
+
+
+def get_streets_to_sync(order_by=None):
+	"""Streets whose buildings should be fetched, only stale ones in incremental mode"""
+	settings = frappe.get_single("Foodcharity Settings")
+	or_filters = None
+	if settings.incremental_sync:
+		cutoff = add_days(now_datetime(), -(settings.street_refresh_ttl_days or 0))
+		or_filters = [
+			["buildings_fetched_on", "is", "not set"],
+			["buildings_fetched_on", "<", cutoff]
+		]
+
+	return frappe.get_all(
+		"Street",
+		fields=["name", "zone", "street_number", "buildings_fingerprint"],
+		or_filters=or_filters,
+		order_by=order_by
+	)
 
 
 def sync_all_qnas_data():
 	"""Background job to sync all QNAS data"""
-	import time
-
-	headers = get_qnas_headers()
-	base_url = "https://qnas.qa/"
+	fetcher = get_sync_fetcher()
 
 	# Sync zones
 	frappe.publish_realtime("qnas_sync_progress", {"message": "Fetching zones..."})
 
 	try:
-		response = requests.get(f"{base_url}get_zones", headers=headers)
-		response.raise_for_status()
-		zones = response.json()
-
-		zone_count = 0
-		for z in zones:
-			zone_number = str(z["zone_number"])
-			if not frappe.db.exists("Zone", zone_number):
-				frappe.get_doc({
-					"doctype": "Zone",
-					"zone_number": zone_number,
-					"zone_name_en": z.get("zone_name_en", ""),
-					"zone_name_ar": z.get("zone_name_ar", "")
-				}).insert(ignore_permissions=True)
-			else:
-				frappe.db.set_value("Zone", zone_number, {
-					"zone_name_en": z.get("zone_name_en", ""),
-					"zone_name_ar": z.get("zone_name_ar", "")
-				})
-			zone_count += 1
+		zones = fetcher.get_json("get_zones")
 
+		zone_count = upsert_zones(zones)
 		frappe.db.commit()
 		frappe.publish_realtime("qnas_sync_progress", {"message": f"Synced {zone_count} zones. Fetching streets..."})
 
 		# Sync streets for each zone
 		street_count = 0
-		for z in zones:
-			zone_number = str(z["zone_number"])
-			time.sleep(0.5)  # Rate limiting
+		zone_numbers = [str(z["zone_number"]) for z in zones]
 
-			try:
-				response = requests.get(f"{base_url}get_streets/{zone_number}", headers=headers)
-				response.raise_for_status()
-				streets = response.json()
-
-				for s in streets:
-					street_number = str(s["street_number"])
-					street_name = f"{zone_number}-{street_number}"
-
-					if not frappe.db.exists("Street", street_name):
-						frappe.get_doc({
-							"doctype": "Street",
-							"zone": zone_number,
-							"street_number": street_number,
-							"street_name_en": s.get("street_name_en", ""),
-							"street_name_ar": s.get("street_name_ar", "")
-						}).insert(ignore_permissions=True)
-					else:
-						frappe.db.set_value("Street", street_name, {
-							"street_name_en": s.get("street_name_en", ""),
-							"street_name_ar": s.get("street_name_ar", "")
-						})
-					street_count += 1
+		for zone_number, streets, error in fetcher.fetch_many(zone_numbers, lambda zone: f"get_streets/{zone}"):
+			if isinstance(error, QnasUnavailableError):
+				# QNAS stayed down past the breaker wait, stop instead of failing every zone
+				raise error
+			if error:
+				frappe.log_error(f"Error syncing streets for zone {zone_number}: {str(error)}")
+				continue
 
+			try:
+				street_count += upsert_streets(zone_number, streets)
 				frappe.db.commit()
 			except Exception as e:
 				frappe.log_error(f"Error syncing streets for zone {zone_number}: {str(e)}")
@@ -122,51 +155,35 @@ def sync_all_qnas_data():
 		frappe.publish_realtime("qnas_sync_progress", {"message": f"Synced {street_count} streets. Fetching buildings..."})
 
 		# Sync buildings for each street
-		building_count = 0
-		streets_list = frappe.get_all("Street", fields=["name", "zone", "street_number"])
+		street_sync = StreetSync()
+		streets_list = get_streets_to_sync()
 
-		for idx, street in enumerate(streets_list):
-			time.sleep(0.5)  # Rate limiting
+		results = fetcher.fetch_many(streets_list, lambda street: f"get_buildings/{street.zone}/{street.street_number}")
+		for idx, (street, buildings, error) in enumerate(results):
+			if isinstance(error, QnasUnavailableError):
+				raise error
 
 			try:
-				response = requests.get(
-					f"{base_url}get_buildings/{street.zone}/{street.street_number}",
-					headers=headers
-				)
-				response.raise_for_status()
-				buildings = response.json()
-
-				for b in buildings:
-					building_number = str(b["building_number"])
-					building_name = f"{street.zone}-{street.street_number}-{building_number}"
-
-					if not frappe.db.exists("Building", building_name):
-						frappe.get_doc({
-							"doctype": "Building",
-							"zone": street.zone,
-							"street": street.name,
-							"street_number": street.street_number,
-							"building_number": building_number,
-							"latitude": b.get("x"),
-							"longitude": b.get("y")
-						}).insert(ignore_permissions=True)
-					else:
-						frappe.db.set_value("Building", building_name, {
-							"latitude": b.get("x"),
-							"longitude": b.get("y")
-						})
-					building_count += 1
+				if error:
+					raise error
 
-				if idx % 10 == 0:
-					frappe.db.commit()
-					frappe.publish_realtime("qnas_sync_progress", {
-						"message": f"Synced {building_count} buildings ({idx + 1}/{len(streets_list)} streets)..."
-					})
+				street_sync.save(street, buildings)
 
 			except Exception as e:
+				street_sync.failed += 1
 				frappe.log_error(f"Error syncing buildings for street {street.name}: {str(e)}")
 
+			if idx % 10 == 0:
+				street_sync.flush()
+				frappe.db.commit()
+				frappe.publish_realtime("qnas_sync_progress", {
+					"message": f"Synced {street_sync.building_count} buildings ({idx + 1}/{len(streets_list)} streets)..."
+				})
+
+		street_sync.flush()
+		clear_gazetteer()
 		frappe.db.commit()
+		building_count = street_sync.building_count
 
 		# Update settings with sync status
 		settings = frappe.get_single("Foodcharity Settings")
@@ -174,11 +191,21 @@ def sync_all_qnas_data():
 		settings.total_zones = frappe.db.count("Zone")
 		settings.total_streets = frappe.db.count("Street")
 		settings.total_buildings = frappe.db.count("Building")
+		settings.update(street_sync.get_stats())
 		settings.save(ignore_permissions=True)
 		frappe.db.commit()
 
+		try:
+			build_snapshots()
+			frappe.db.commit()
+		except Exception as e:
+			frappe.log_error(f"Error building gazetteer snapshots: {str(e)}")
+
 		frappe.publish_realtime("qnas_sync_progress", {
-			"message": f"Sync complete! {zone_count} zones, {street_count} streets, {building_count} buildings.",
+			"message": (
+				f"Sync complete! {zone_count} zones, {street_count} streets, {building_count} buildings "
+				f"({street_sync.unchanged} streets unchanged)."
+			),
 			"complete": True
 		})
 
@@ -188,18 +215,17 @@ def sync_all_qnas_data():
 			"message": f"Error: {str(e)}",
 			"error": True
 		})
+	finally:
+		fetcher.close()
 
 
 def sync_buildings_only(start_index=0):
 	"""Background job to sync only buildings, resuming from last position"""
-	import time
-
-	headers = get_qnas_headers()
-	base_url = "https://qnas.qa/"
+	fetcher = get_sync_fetcher()
 
 	try:
 		# Get all streets from local DB
-		streets_list = frappe.get_all("Street", fields=["name", "zone", "street_number"], order_by="name asc")
+		streets_list = get_streets_to_sync(order_by="name asc")
 		total_streets = len(streets_list)
 
 		if start_index >= total_streets:
@@ -213,77 +239,74 @@ def sync_buildings_only(start_index=0):
 			"message": f"Resuming from street {start_index + 1}/{total_streets}..."
 		})
 
-		building_count = 0
-		current_index = start_index
+		street_sync = StreetSync()
 
-		for idx, street in enumerate(streets_list[start_index:], start=start_index):
-			time.sleep(0.5)  # Rate limiting
-			current_index = idx
+		# Results come back in street order, so the resume index stays contiguous
+		results = fetcher.fetch_many(
+			streets_list[start_index:],
+			lambda street: f"get_buildings/{street.zone}/{street.street_number}"
+		)
+		for idx, (street, buildings, error) in enumerate(results, start=start_index):
+			if isinstance(error, QnasUnavailableError):
+				# QNAS stayed down past the breaker wait, resume from this street next time
+				street_sync.flush()
+				frappe.db.set_value("Foodcharity Settings", "Foodcharity Settings", {
+					"last_synced_street_index": idx,
+					**street_sync.get_stats()
+				})
+				frappe.db.commit()
+				raise error
 
 			try:
-				response = requests.get(
-					f"{base_url}get_buildings/{street.zone}/{street.street_number}",
-					headers=headers
-				)
-				response.raise_for_status()
-				buildings = response.json()
-
-				for b in buildings:
-					building_number = str(b["building_number"])
-					building_name = f"{street.zone}-{street.street_number}-{building_number}"
-
-					if not frappe.db.exists("Building", building_name):
-						frappe.get_doc({
-							"doctype": "Building",
-							"zone": street.zone,
-							"street": street.name,
-							"street_number": street.street_number,
-							"building_number": building_number,
-							"latitude": b.get("x"),
-							"longitude": b.get("y")
-						}).insert(ignore_permissions=True)
-					else:
-						frappe.db.set_value("Building", building_name, {
-							"latitude": b.get("x"),
-							"longitude": b.get("y")
-						})
-					building_count += 1
+				if error:
+					raise error
+
+				street_sync.save(street, buildings)
 
 				# Save progress every 10 streets
 				if idx % 10 == 0:
+					street_sync.flush()
 					frappe.db.commit()
 					# Update the last synced index
 					frappe.db.set_value("Foodcharity Settings", "Foodcharity Settings", {
 						"last_synced_street_index": idx + 1,
-						"synced_buildings": building_count
+						**street_sync.get_stats()
 					})
 					frappe.db.commit()
 					frappe.publish_realtime("qnas_sync_progress", {
-						"message": f"Synced {building_count} buildings ({idx + 1}/{total_streets} streets)..."
+						"message": f"Synced {street_sync.building_count} buildings ({idx + 1}/{total_streets} streets)..."
 					})
 
 			except Exception as e:
+				street_sync.failed += 1
 				frappe.log_error(f"Error syncing buildings for street {street.name}: {str(e)}")
 				# Save current position before error
+				street_sync.flush()
 				frappe.db.set_value("Foodcharity Settings", "Foodcharity Settings", {
 					"last_synced_street_index": idx,
-					"synced_buildings": building_count
+					**street_sync.get_stats()
 				})
 				frappe.db.commit()
 
+		street_sync.flush()
+		clear_gazetteer()
 		frappe.db.commit()
+		building_count = street_sync.building_count
 
 		# Update settings with sync status
 		settings = frappe.get_single("Foodcharity Settings")
 		settings.last_synced = now_datetime()
 		settings.last_synced_street_index = total_streets  # Mark as complete
 		settings.total_buildings = frappe.db.count("Building")
-		settings.synced_buildings = building_count
+		settings.update(street_sync.get_stats())
 		settings.save(ignore_permissions=True)
 		frappe.db.commit()
 
 		frappe.publish_realtime("qnas_sync_progress", {
-			"message": f"Building sync complete! {building_count} buildings synced.",
+			"message": (
+				f"Building sync complete! {building_count} buildings synced, "
+				f"{street_sync.unchanged} of {street_sync.fetched} streets unchanged."
+			),
 			"complete": True
 		})
 
@@ -293,3 +316,5 @@ def sync_buildings_only(start_index=0):
 			"message": f"Error: {str(e)}",
 			"error": True
 		})
+	finally:
+		fetcher.close()
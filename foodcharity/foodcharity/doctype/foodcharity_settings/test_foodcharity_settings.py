@@ -0,0 +1,173 @@
+# Copyright (c) 2024, Aadhil and Contributors
+# See license.txt
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from frappe.tests.utils import FrappeTestCase
+
+from foodcharity.qnas import CircuitBreaker, QnasClient, QnasFetcher, QnasUnavailableError, TokenBucket
+
+STUB_LATENCY = 0.05
+
+
+class StubQnasHandler(BaseHTTPRequestHandler):
+	"""Minimal QNAS stand-in: every street has 20 buildings, `flaky` streets fail once, `down` always fails"""
+
+	protocol_version = "HTTP/1.1"
+	failed_once = set()
+	requests_seen = Counter()
+	lock = threading.Lock()
+	in_flight = 0
+	peak_in_flight = 0
+	# `gate` streets are held until this many requests are in flight together
+	barrier = None
+
+	def do_GET(self):
+		parts = self.path.strip("/").split("/")
+		cls = type(self)
+		with cls.lock:
+			cls.requests_seen[self.path] += 1
+			cls.in_flight += 1
+			cls.peak_in_flight = max(cls.peak_in_flight, cls.in_flight)
+		try:
+			if parts[0] == "get_buildings" and parts[2].startswith("gate"):
+				cls.barrier.wait(timeout=5)
+			else:
+				time.sleep(STUB_LATENCY)
+		finally:
+			with cls.lock:
+				cls.in_flight -= 1
+
+		if parts[0] == "get_buildings" and parts[2].startswith("flaky") and self.path not in self.failed_once:
+			self.failed_once.add(self.path)
+			self.send_json([], status=503)
+			return
+
+		if parts[0] == "get_buildings" and parts[2] == "down":
+			self.send_json([], status=503)
+		elif parts[0] == "get_buildings":
+			self.send_json([
+				{"building_number": str(n), "x": 25.28 + n / 1000, "y": 51.52 + n / 1000}
+				for n in range(1, 21)
+			])
+		else:
+			self.send_json([], status=404)
+
+	def send_json(self, data, status=200):
+		body = json.dumps(data).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class TestFoodcharitySettings(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubQnasHandler)
+		cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/"
+		threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+		super().tearDownClass()
+
+	def fetch_streets(self, streets, **kwargs):
+		with QnasFetcher(base_url=self.base_url, backoff=0.01, **kwargs) as fetcher:
+			return list(fetcher.fetch_many(streets, lambda street: f"get_buildings/1/{street}"))
+
+	def test_fetch_many_keeps_street_order(self):
+		streets = [str(n) for n in range(40)]
+		results = self.fetch_streets(streets, requests_per_second=0, max_workers=8)
+
+		self.assertEqual([street for street, _, _ in results], streets)
+		self.assertTrue(all(error is None and len(data) == 20 for _, data, error in results))
+
+	def test_fetch_many_retries_throttled_streets(self):
+		StubQnasHandler.requests_seen.clear()
+		results = self.fetch_streets(["flaky-1", "2", "flaky-3"], requests_per_second=0, max_workers=2)
+		self.assertTrue(all(error is None for _, _, error in results))
+		# Each throttled street is retried once, the others aren't repeated
+		seen = StubQnasHandler.requests_seen
+		self.assertEqual([seen[f"/get_buildings/1/{street}"] for street in ("flaky-1", "2", "flaky-3")], [2, 1, 2])
+
+	def test_fetch_many_runs_max_workers_at_once(self):
+		"""Gate streets only answer once four requests are waiting together"""
+		StubQnasHandler.barrier = threading.Barrier(4)
+		StubQnasHandler.peak_in_flight = 0
+		results = self.fetch_streets([f"gate-{n}" for n in range(12)], requests_per_second=0, max_workers=4)
+
+		self.assertTrue(all(error is None for _, _, error in results))
+		self.assertEqual(StubQnasHandler.peak_in_flight, 4)
+
+	def test_token_bucket_limits_rate(self):
+		bucket = TokenBucket(rate=20, capacity=1)
+		start = time.monotonic()
+		for _ in range(21):
+			bucket.acquire()
+		self.assertGreaterEqual(time.monotonic() - start, 0.9)
+
+	def make_client(self, breaker, max_wait=0):
+		return QnasClient(
+			breaker=breaker, headers={"Accept": "application/json"}, base_url=self.base_url,
+			requests_per_second=0, max_retries=0, timeout=(1, 2), max_wait=max_wait,
+		)
+
+	def test_circuit_breaker_fails_fast_while_open(self):
+		breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+		with self.make_client(breaker) as client:
+			for _ in range(3):
+				self.assertRaises(requests.exceptions.HTTPError, client.get_json, "get_buildings/1/down")
+			self.assertTrue(breaker.is_open)
+
+			start = time.monotonic()
+			self.assertRaises(QnasUnavailableError, client.get_json, "get_buildings/1/2")
+			self.assertLess(time.monotonic() - start, STUB_LATENCY)
+
+	def test_circuit_breaker_closes_after_trial(self):
+		breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+		with self.make_client(breaker) as client:
+			self.assertRaises(requests.exceptions.HTTPError, client.get_json, "get_buildings/1/down")
+			self.assertTrue(breaker.is_open)
+
+			time.sleep(0.15)
+			self.assertEqual(len(client.get_json("get_buildings/1/2")), 20)
+			self.assertFalse(breaker.is_open)
+
+	def test_not_found_does_not_open_breaker(self):
+		breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+		with self.make_client(breaker) as client:
+			for _ in range(3):
+				self.assertRaises(requests.exceptions.HTTPError, client.get_json, "get_streets/1")
+			self.assertFalse(breaker.is_open)
+
+	def test_sync_client_waits_for_open_circuit(self):
+		breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+		with self.make_client(breaker, max_wait=1) as client:
+			self.assertRaises(requests.exceptions.HTTPError, client.get_json, "get_buildings/1/down")
+			self.assertTrue(breaker.is_open)
+
+			# The next street waits for the trial instead of being rejected
+			self.assertEqual(len(client.get_json("get_buildings/1/2")), 20)
+			self.assertFalse(breaker.is_open)
+
+		breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+		with self.make_client(breaker, max_wait=0.1) as client:
+			self.assertRaises(requests.exceptions.HTTPError, client.get_json, "get_buildings/1/down")
+			self.assertRaises(QnasUnavailableError, client.get_json, "get_buildings/1/2")
+			# Once a wait ran out the rest of the run fails fast
+			start = time.monotonic()
+			self.assertRaises(QnasUnavailableError, client.get_json, "get_buildings/1/3")
+			self.assertLess(time.monotonic() - start, 0.05)
@@ -2,13 +2,56 @@
 # For license information, please see license.txt
 
 import frappe
-import requests
 from frappe.model.document import Document
 
+from foodcharity.address import fetch_building, normalize_number, resolve_building
+from foodcharity.coordinates import enqueue_coordinate_resolution
+from foodcharity.phone import get_phone_search_key
+from foodcharity.realtime import publish_order_changes
+from foodcharity.routing import parse_coordinate
+from foodcharity.spatial import encode_geohash
+
 
 class Orders(Document):
 	def validate(self):
+		self.normalize_address()
 		self.update_coordinates()
+		self.set_latitude_longitude()
+		self.set_phone_search_keys()
+
+	def set_phone_search_keys(self):
+		"""Indexed keys for the guest phone lookup, see foodcharity.phone"""
+		self.mobile_search_key = get_phone_search_key(self.mobile)
+		self.whatsapp_search_key = get_phone_search_key(self.whatsapp_number)
+
+	def set_latitude_longitude(self):
+		"""Typed copy of `coordinate` for routing and dispatch, with QNAS x/y put in lat/lng order,
+		and its geohash cell for the spatial queries"""
+		latitude, longitude = parse_coordinate(self.coordinate)
+		# Float columns are NOT NULL, 0 stands for "no coordinate" like on Building
+		self.latitude, self.longitude = latitude or 0, longitude or 0
+		self.geohash = encode_geohash(latitude, longitude)
+
+	def on_update(self):
+		# Also notify the previous driver when the order was reassigned
+		previous = self.get_doc_before_save()
+		publish_order_changes(
+			self.name,
+			[self.assigned_volunteer, previous and previous.assigned_volunteer],
+			order_status=self.order_status,
+			assigned_volunteer=self.assigned_volunteer
+		)
+		if self.flags.coordinates_pending:
+			enqueue_coordinate_resolution()
+
+	def on_trash(self):
+		publish_order_changes(self.name, [self.assigned_volunteer], deleted=1)
+
+	def normalize_address(self):
+		"""Store address parts the way Building names are built, so orders join to buildings by name"""
+		for fieldname in ("zone_number", "street_number", "building_number"):
+			if self.get(fieldname):
+				self.set(fieldname, normalize_number(self.get(fieldname)))
 
 	def update_coordinates(self):
 		"""Fetch coordinates from Building doctype based on zone, street, and building number.
@@ -17,83 +60,30 @@ class Orders(Document):
 			return
 
 		# Try local Building doctype first
-		building = frappe.db.get_value(
-			"Building",
-			{
-				"zone": self.zone_number,
-				"street_number": self.street_number,
-				"building_number": self.building_number
-			},
-			["latitude", "longitude"],
-			as_dict=True
-		)
+		building = resolve_building(self.zone_number, self.street_number, self.building_number)
 
 		if building and building.latitude and building.longitude:
 			self.coordinate = f"{building.latitude},{building.longitude}"
 			return
 
+		# Guest submissions don't wait on QNAS, the background resolver fills it in
+		if self.flags.defer_coordinates:
+			if not self.is_new() and any(
+				self.has_value_changed(f) for f in ("zone_number", "street_number", "building_number")
+			):
+				self.coordinate = None
+			self.flags.coordinates_pending = not self.coordinate
+			return
+
 		# Not found locally, fetch from QNAS API
 		try:
-			settings = frappe.get_single("Foodcharity Settings")
-			if not settings.qnas_enabled:
+			if not frappe.db.get_single_value("Foodcharity Settings", "qnas_enabled", cache=True):
 				return
 
-			headers = {
-				"X-Token": settings.get_password("qnas_api_token"),
-				"X-Domain": settings.qnas_api_domain,
-				"Accept": "application/json"
-			}
-
-			response = requests.get(
-				f"https://qnas.qa/get_buildings/{self.zone_number}/{self.street_number}",
-				headers=headers
-			)
-			response.raise_for_status()
-			buildings = response.json()
-
-			for b in buildings:
-				if str(b.get("building_number")) == str(self.building_number):
-					latitude = b.get("x")
-					longitude = b.get("y")
-
-					if latitude and longitude:
-						# Save building to local doctype for future use
-						self.save_building_locally(latitude, longitude)
-						self.coordinate = f"{latitude},{longitude}"
-					break
+			# Saves the street's buildings locally for future use
+			b = fetch_building(self.zone_number, self.street_number, self.building_number)
+			if b:
+				self.coordinate = f"{b['x']},{b['y']}"
 
 		except Exception as e:
 			frappe.log_error(f"Error fetching building from QNAS: {str(e)}")
-
-	def save_building_locally(self, latitude, longitude):
-		"""Save building data to local Building doctype"""
-		try:
-			# Check if Street exists, create if not
-			street_name = f"{self.zone_number}-{self.street_number}"
-			if not frappe.db.exists("Street", street_name):
-				street_doc = frappe.get_doc({
-					"doctype": "Street",
-					"name": street_name,
-					"zone": self.zone_number,
-					"street_number": self.street_number
-				})
-				street_doc.insert(ignore_permissions=True)
-
-			# Create Building
-			building_name = f"{self.zone_number}-{self.street_number}-{self.building_number}"
-			if not frappe.db.exists("Building", building_name):
-				building_doc = frappe.get_doc({
-					"doctype": "Building",
-					"name": building_name,
-					"zone": self.zone_number,
-					"street": street_name,
-					"street_number": self.street_number,
-					"building_number": self.building_number,
-					"latitude": latitude,
-					"longitude": longitude
-				})
-				building_doc.insert(ignore_permissions=True)
-				frappe.db.commit()
-
-		except Exception as e:
-			frappe.log_error(f"Error saving building locally: {str(e)}")
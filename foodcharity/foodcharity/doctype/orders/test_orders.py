@@ -1,9 +1,536 @@
 # Copyright (c) 2024, Aadhil and Contributors
 # See license.txt
 
-# import frappe
+import itertools
+import time
+from unittest.mock import patch
+
+import frappe
+import numpy as np
 from frappe.tests.utils import FrappeTestCase
 
+from foodcharity.address import ensure_street, get_building_name, upsert_buildings
+from foodcharity.coordinates import RESOLVE_JOB_ID, resolve_pending_coordinates
+from foodcharity.api import (
+	ASSIGNED,
+	NOT_FOUND,
+	SKIPPED,
+	assign_order_to_driver,
+	bulk_assign_orders,
+	commit_assignment_plan,
+	create_guest_order,
+	driver_login,
+	get_all_drivers,
+	get_all_orders_for_coordinator,
+	get_driver_order_changes,
+	get_driver_orders,
+	get_order_changes,
+	orders_in_bbox,
+	orders_within,
+	search_orders_by_phone,
+	update_order_status,
+)
+from foodcharity.dispatch import cluster, get_roster, plan_assignment
+from foodcharity.foodcharity.report.driver_wise_order.driver_wise_order import execute as driver_wise_order
+from foodcharity.gazetteer import clear_cache, missing_key
+from foodcharity.guard import GUARD_PREFIX, take_token
+from foodcharity.phone import normalize_phone
+from foodcharity.realtime import COORDINATOR_ROOM, ORDER_CHANGE_EVENT, get_driver_room
+from foodcharity.routing import haversine, nearest_neighbour_order, plan_route, project
+
+TEST_ZONE = "992"
+
+
+# Unique per run, a driver left behind by an interrupted run can't clash with the next one
+driver_mobiles = itertools.count(70000000 + int(time.time()) % 1000000 * 10)
+
+
+def make_driver(mobile=None):
+	mobile = mobile or str(next(driver_mobiles))
+	return frappe.get_doc({
+		"doctype": "Volunteer",
+		"full_name": f"Test Driver {mobile}",
+		"mobile_number": mobile,
+		"interest": "Driver"
+	}).insert(ignore_permissions=True)
+
+
+def greedy_route(lat, lng):
+	"""Reference O(n²) nearest neighbour walk over the same projected distances"""
+	x, y = project(lat, lng)
+	remaining = list(range(len(lat)))
+	current = min(remaining, key=lambda i: (-lat[i], lng[i]))
+	remaining.remove(current)
+	route = [current]
+	while remaining:
+		current = min(remaining, key=lambda i: (x[i] - x[current]) ** 2 + (y[i] - y[current]) ** 2)
+		remaining.remove(current)
+		route.append(current)
+	return route
+
+
+def make_orders(driver, count, street_number="1"):
+	return [
+		frappe.get_doc({
+			"doctype": "Orders",
+			"name1": f"Donor {n}",
+			"mobile": f"5500{n:04d}",
+			"whatsapp_number": f"5500{n:04d}",
+			"order_type": "Delivery",
+			"delivery_needed": "Yes",
+			"no_of_biriyani": 2,
+			"accommodation_area": "Al Sadd",
+			"zone_number": TEST_ZONE,
+			"street_number": street_number,
+			"building_number": str(n),
+			"assigned_volunteer": driver
+		}).insert(ignore_permissions=True).name
+		for n in range(1, count + 1)
+	]
+
 
 class TestOrders(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		if not frappe.db.exists("Zone", TEST_ZONE):
+			frappe.get_doc({"doctype": "Zone", "zone_number": TEST_ZONE, "zone_name_en": "Orders Test"}).insert(
+				ignore_permissions=True
+			)
+		ensure_street(TEST_ZONE, "1")
+		upsert_buildings(TEST_ZONE, "1", [
+			{"building_number": str(n), "x": 25.2 + n / 10000, "y": 51.5 + n / 10000}
+			for n in range(1, 201)
+		])
+
+	def setUp(self):
+		# Endpoints commit, keep their writes in the transaction the test case rolls back
+		commit = patch.object(frappe.db, "commit")
+		commit.start()
+		self.addCleanup(commit.stop)
+
+	def test_driver_orders_include_building_coordinates(self):
+		driver = make_driver().name
+		make_orders(driver, 3)
+
+		orders = get_driver_orders(driver)["orders"]
+		self.assertEqual(len(orders), 3)
+		building = frappe.db.get_value("Building", f"{TEST_ZONE}-1-2", ["latitude", "longitude"], as_dict=True)
+		order = next(o for o in orders if o.building_number == "2")
+		self.assertEqual(order.coordinate, f"{building.latitude},{building.longitude}")
+		self.assertEqual(order.total_amount, 2 * get_driver_orders(driver)["per_biriyani_charge"])
+
+	def test_driver_orders_query_count_is_constant(self):
+		"""A 200-order driver costs the same single query as a 20-order one"""
+		small = make_driver().name
+		large = make_driver().name
+		make_orders(small, 20)
+		make_orders(large, 200)
+
+		# Warm the settings single value cache
+		get_driver_orders(small)
+
+		for driver, count in ((small, 20), (large, 200)):
+			with self.assertQueryCount(1):
+				orders = get_driver_orders(driver)["orders"]
+			self.assertEqual(len(orders), count)
+
+	def test_all_drivers_stats_from_one_query(self):
+		driver = make_driver().name
+		make_orders(driver, 4)
+		frappe.db.set_value("Orders", {"assigned_volunteer": driver, "building_number": "1"}, "order_status", "Delivered")
+		# Counted as Pending, like the order summary does
+		frappe.db.set_value("Orders", {"assigned_volunteer": driver, "building_number": "2"}, "order_status", "")
+		idle = make_driver().name
+
+		get_all_drivers()
+		with self.assertQueryCount(1):
+			drivers = {d.name: d for d in get_all_drivers()["drivers"]}
+
+		stats = drivers[driver]
+		self.assertEqual(stats.order_count, 4)
+		self.assertEqual(stats.total_biriyani, 8)
+		self.assertEqual(stats.status_counts["Delivered"], 1)
+		self.assertEqual(stats.status_counts["Pending"], 1)
+		self.assertEqual(sum(stats.status_counts.values()), 4)
+		self.assertEqual(drivers[idle].order_count, 0)
+
+	def test_coordinator_orders_page_with_cursor(self):
+		driver = make_driver()
+		make_orders(driver.name, 7)
+
+		seen = []
+		page = get_all_orders_for_coordinator(driver=driver.name, page_length=3)
+		self.assertEqual(page["total"], 7)
+		while True:
+			seen.extend(page["orders"])
+			if not page["next_cursor"]:
+				break
+			page = get_all_orders_for_coordinator(driver=driver.name, page_length=3, cursor=page["next_cursor"])
+			self.assertIsNone(page["total"])
+
+		self.assertEqual(len({o.name for o in seen}), 7)
+		self.assertEqual({o.driver_name for o in seen}, {driver.full_name})
+
+		delivered = get_all_orders_for_coordinator(driver=driver.name, status="Delivered", zone=f"0{TEST_ZONE}")
+		self.assertEqual(delivered["total"], 0)
+		pending = get_all_orders_for_coordinator(driver=driver.name, status="Pending", area="Al Sadd")
+		self.assertEqual(pending["total"], 7)
+
+	def test_delta_feed_returns_changes_and_tombstones(self):
+		driver = make_driver().name
+		other = make_driver().name
+		make_orders(driver, 3)
+		names = [o.name for o in get_driver_orders(driver)["orders"]]
+
+		since = get_driver_order_changes(driver)["cursor"]
+		self.assertEqual(get_driver_order_changes(driver, since)["orders"], [])
+
+		frappe.db.set_value("Orders", names[0], "order_status", "Delivered")
+		frappe.db.set_value("Orders", names[1], "assigned_volunteer", other)
+		frappe.delete_doc("Orders", names[2], ignore_permissions=True)
+
+		changes = get_driver_order_changes(driver, since)
+		self.assertEqual([o.name for o in changes["orders"]], [names[0]])
+		self.assertEqual(changes["orders"][0].order_status, "Delivered")
+		self.assertIn(names[1], changes["removed"])
+		self.assertIn(names[2], changes["removed"])
+		self.assertEqual(get_driver_order_changes(driver, changes["cursor"])["orders"], [])
+		# Tombstones are handed out once, later polls don't see the deletion again
+		self.assertEqual(get_driver_order_changes(driver, changes["cursor"])["removed"], [])
+
+		coordinator = get_order_changes(since, driver=other)
+		self.assertEqual([o.name for o in coordinator["orders"]], [names[1]])
+		self.assertEqual(coordinator["total"], 1)
+		self.assertIsNone(get_order_changes(coordinator["cursor"], driver=other)["total"])
+
+	def test_order_changes_are_published_to_driver_rooms(self):
+		driver = make_driver().name
+		other = make_driver().name
+		make_orders(driver, 1)
+		order = get_driver_orders(driver)["orders"][0].name
+
+		def published_rooms(publish):
+			return {c.kwargs["task_id"] for c in publish.call_args_list if c.args[0] == ORDER_CHANGE_EVENT}
+
+		with patch("frappe.publish_realtime") as publish:
+			assign_order_to_driver(order, other)
+		self.assertEqual(published_rooms(publish), {COORDINATOR_ROOM, get_driver_room(driver), get_driver_room(other)})
+
+		with patch("frappe.publish_realtime") as publish:
+			update_order_status(order, "Delivered")
+		self.assertEqual(published_rooms(publish), {COORDINATOR_ROOM, get_driver_room(other)})
+		self.assertEqual(publish.call_args.args[1]["names"], [order])
+
+		with patch("frappe.publish_realtime") as publish:
+			doc = frappe.get_doc("Orders", order)
+			doc.assigned_volunteer = driver
+			doc.save(ignore_permissions=True)
+		self.assertEqual(published_rooms(publish), {COORDINATOR_ROOM, get_driver_room(driver), get_driver_room(other)})
+
+	def test_bulk_assign_reports_each_order(self):
+		driver = make_driver().name
+		other = make_driver().name
+		make_orders(driver, 5)
+		names = [o.name for o in get_driver_orders(driver)["orders"]]
+		update_order_status(names[0], "Out for Delivery")
+		assign_order_to_driver(names[1], other)
+
+		result = bulk_assign_orders(frappe.as_json(names[1:] + ["ORD-MISSING"]), driver)
+		self.assertTrue(result["success"])
+		self.assertEqual(result["count"], 1)
+		self.assertEqual(result["results"][names[1]], ASSIGNED)
+		self.assertEqual(result["results"][names[2]], SKIPPED)
+		self.assertEqual(result["results"]["ORD-MISSING"], NOT_FOUND)
+
+		orders = {o.name: o for o in get_driver_orders(driver)["orders"]}
+		self.assertEqual(orders[names[1]].order_status, "Assigned")
+		self.assertEqual(orders[names[0]].order_status, "Out for Delivery")
+		self.assertFalse(assign_order_to_driver("ORD-MISSING", driver)["success"])
+
+	def test_bulk_assign_uses_set_based_updates(self):
+		"""Lock and update (the commit is patched out), however many orders are assigned"""
+		driver = make_driver().name
+		other = make_driver().name
+		make_orders(driver, 200)
+		names = [o.name for o in get_driver_orders(driver)["orders"]]
+
+		with self.assertQueryCount(2):
+			result = bulk_assign_orders(frappe.as_json(names), other)
+		self.assertEqual(result["count"], 200)
+
+	def test_phone_lookup_ignores_country_code(self):
+		self.assertEqual(normalize_phone("+974 5555-0001"), "97455550001")
+		self.assertEqual(normalize_phone("0097455550001"), "97455550001")
+		self.assertEqual(normalize_phone("55550001"), "97455550001")
+
+		order = frappe.get_doc({
+			"doctype": "Orders",
+			"name1": "Phone Lookup",
+			"mobile": "+974 7700 0001",
+			"whatsapp_number": "+91 98470 00001",
+			"order_type": "Delivery",
+			"delivery_needed": "No",
+			"no_of_biriyani": 1,
+			"accommodation_area": "Al Sadd"
+		}).insert(ignore_permissions=True)
+
+		for phone in ("77000001", "+97477000001", "974 7700 0001", "9847000001", "+919847000001"):
+			self.assertIn(order.name, [o.name for o in search_orders_by_phone(phone)], phone)
+		self.assertEqual(search_orders_by_phone("77000002"), [])
+
+		driver = make_driver("77000003")
+		driver.driver_password = "secret"
+		driver.save(ignore_permissions=True)
+		self.assertTrue(driver_login("+97477000003", "secret")["success"])
+		self.assertTrue(driver_login("77000003", "secret")["success"])
+		self.assertFalse(driver_login("77000004", "secret")["success"])
+
+	def test_guest_endpoints_are_rate_limited_and_memoized(self):
+		key = f"test:{frappe.generate_hash()}"
+		self.assertEqual([take_token(key, 1, 3)[0] for _ in range(4)], [True, True, True, False])
+
+		frappe.cache.delete_keys(GUARD_PREFIX)
+		frappe.local.request_ip = "203.0.113.7"
+		frappe.set_user("Guest")
+		try:
+			search_orders_by_phone("55550001")
+			with self.assertQueryCount(0):
+				search_orders_by_phone("55550001")
+
+			with self.assertRaises(frappe.TooManyRequestsError):
+				for _ in range(20):
+					driver_login("70009999", "wrong")
+		finally:
+			frappe.set_user("Administrator")
+			frappe.local.request_ip = None
+			frappe.cache.delete_keys(GUARD_PREFIX)
+
+	def test_guest_order_defers_coordinate_lookup(self):
+		frappe.db.set_single_value("Foodcharity Settings", {"defer_coordinate_lookup": 1, "qnas_enabled": 0})
+		ensure_street(TEST_ZONE, "2")
+		data = {
+			"name1": "Deferred Donor",
+			"mobile": "55009001",
+			"order_type": "Delivery",
+			"delivery_needed": "Yes",
+			"no_of_biriyani": 1,
+			"accommodation_area": "Al Sadd",
+			"zone_number": TEST_ZONE,
+			"street_number": "2",
+			"building_number": "7"
+		}
+
+		with patch("foodcharity.address.get_qnas_json") as qnas, patch("frappe.enqueue") as enqueue:
+			order_id = create_guest_order(frappe.as_json(data))["order_id"]
+		qnas.assert_not_called()
+		self.assertEqual(enqueue.call_args.kwargs["job_id"], RESOLVE_JOB_ID)
+		self.assertFalse(frappe.db.get_value("Orders", order_id, "coordinate"))
+
+		upsert_buildings(TEST_ZONE, "2", [{"building_number": "7", "x": 25.3, "y": 51.4}])
+		resolve_pending_coordinates()
+		self.assertEqual(frappe.db.get_value("Orders", order_id, "coordinate"), "25.3,51.4")
+		self.assertEqual(frappe.db.get_value("Orders", order_id, ["latitude", "longitude"]), (25.3, 51.4))
+
+	def test_order_stores_latitude_longitude(self):
+		ensure_street(TEST_ZONE, "4")
+		# QNAS sometimes returns x/y the other way round
+		upsert_buildings(TEST_ZONE, "4", [{"building_number": "1", "x": 51.45, "y": 25.35}])
+		order = frappe.get_doc("Orders", make_orders(None, 1, street_number="4")[0])
+		self.assertEqual((order.latitude, order.longitude), (25.35, 51.45))
+
+	def test_building_corrections_reach_open_orders(self):
+		ensure_street(TEST_ZONE, "4")
+		upsert_buildings(TEST_ZONE, "4", [{"building_number": str(n), "x": 25.3, "y": 51.4} for n in (1, 2)])
+		open_order, delivered = make_orders(make_driver().name, 2, street_number="4")
+		update_order_status(delivered, "Delivered")
+
+		# A sync corrects the street
+		upsert_buildings(TEST_ZONE, "4", [{"building_number": str(n), "x": 25.31, "y": 51.41} for n in (1, 2)])
+		self.assertEqual(frappe.db.get_value("Orders", open_order, ["latitude", "longitude"]), (25.31, 51.41))
+		self.assertEqual(frappe.db.get_value("Orders", delivered, "latitude"), 25.3)
+
+		# So does an edit on the desk
+		building = frappe.get_doc("Building", get_building_name(TEST_ZONE, "4", "1"))
+		building.latitude = 25.32
+		building.save(ignore_permissions=True)
+		self.assertEqual(frappe.db.get_value("Orders", open_order, "coordinate"), "25.32,51.41")
+		self.assertEqual(frappe.db.get_value("Orders", open_order, "latitude"), 25.32)
+
+	def test_orders_within_radius_and_bbox(self):
+		ensure_street(TEST_ZONE, "5")
+		upsert_buildings(TEST_ZONE, "5", [
+			{"building_number": str(n), "x": 25.8 + n / 1000, "y": 51.1} for n in range(1, 6)
+		])
+		names = make_orders(None, 5, street_number="5")
+
+		# Buildings are about 111 m apart going north
+		nearby = orders_within(25.8, 51.1, 250)
+		self.assertEqual([o.name for o in nearby], names[:2])
+		self.assertLess(nearby[0].distance, nearby[1].distance)
+		self.assertEqual(orders_within("25.8", "51.1", 250, status="Delivered"), [])
+
+		inside = orders_in_bbox(25.8025, 51.09, 25.8045, 51.11)
+		self.assertEqual(sorted(o.name for o in inside), names[2:4])
+		self.assertRaises(frappe.ValidationError, orders_within, "north", 51.1, 100)
+		self.assertRaises(frappe.ValidationError, orders_within, 25.8, 51.1, -100)
+		self.assertRaises(frappe.ValidationError, orders_within, 25.8, 51.1, 10 ** 6)
+		self.assertRaises(frappe.ValidationError, orders_in_bbox, 25.81, 51.09, 25.8, 51.11)
+
+	def test_resolver_caches_streets_qnas_does_not_know(self):
+		frappe.db.set_single_value("Foodcharity Settings", "qnas_enabled", 1)
+		clear_cache(missing_key(TEST_ZONE, "6"))
+		order = frappe.get_doc({
+			"doctype": "Orders",
+			"name1": "Unknown Street Donor",
+			"mobile": "55009002",
+			"order_type": "Delivery",
+			"delivery_needed": "Yes",
+			"no_of_biriyani": 1,
+			"accommodation_area": "Al Sadd",
+			"zone_number": TEST_ZONE,
+			"street_number": "6",
+			"building_number": "1"
+		})
+		order.flags.defer_coordinates = True
+		with patch("frappe.enqueue"):
+			order.insert(ignore_permissions=True)
+
+		try:
+			with patch("foodcharity.coordinates.get_sync_fetcher") as get_sync_fetcher:
+				fetch_many = get_sync_fetcher.return_value.__enter__.return_value.fetch_many
+				fetch_many.side_effect = lambda streets, path_for: [(street, [], None) for street in streets]
+				resolve_pending_coordinates()
+				resolve_pending_coordinates()
+		finally:
+			frappe.db.set_single_value("Foodcharity Settings", "qnas_enabled", 0)
+
+		fetched = [street for call in fetch_many.call_args_list for street in call.args[0]]
+		self.assertEqual(fetched.count((TEST_ZONE, "6")), 1)
+
+	def test_nearest_neighbour_route_matches_greedy_walk(self):
+		rng = np.random.default_rng(7)
+		lat = (25.0 + rng.random(500) * 1.1).tolist()
+		lng = (50.8 + rng.random(500) * 0.8).tolist()
+		self.assertEqual(nearest_neighbour_order(lat, lng), greedy_route(lat, lng))
+		self.assertEqual(nearest_neighbour_order([], []), [])
+		self.assertEqual(nearest_neighbour_order([25.3], [51.5]), [0])
+
+	def test_projected_distance_close_to_haversine(self):
+		rng = np.random.default_rng(3)
+		lat = 24.6 + rng.random(1000) * 1.5
+		lng = 50.8 + rng.random(1000) * 0.8
+		x, y = project(lat, lng)
+		i, j = np.arange(0, 1000, 2), np.arange(1, 1000, 2)
+		projected = np.hypot(x[i] - x[j], y[i] - y[j])
+		great_circle = haversine(lat[i], lng[i], lat[j], lng[j])
+		# Across the whole country the equirectangular error stays under 1%
+		self.assertLess(np.max(np.abs(projected - great_circle) / great_circle), 0.01)
+
+	def test_driver_wise_order_routes_each_driver(self):
+		drivers = [make_driver().name, make_driver().name]
+		for driver in drivers:
+			make_orders(driver, 6)
+
+		with patch(
+			"foodcharity.foodcharity.report.driver_wise_order.driver_wise_order.get_route_settings",
+			return_value={"depot": None, "budget_ms": 50},
+		):
+			_, data, _, _, summary = driver_wise_order({})
+		self.assertLessEqual(summary[1]["value"], summary[0]["value"])
+		for driver in drivers:
+			positions = [i for i, row in enumerate(data) if row.assigned_volunteer == driver]
+			self.assertEqual(positions, list(range(positions[0], positions[0] + 6)))
+			rows = [data[i] for i in positions]
+			lat, lng = [row.latitude for row in rows], [row.longitude for row in rows]
+			self.assertEqual(greedy_route(lat, lng), list(range(6)))
+
+	def test_route_optimization_shortens_route(self):
+		rng = np.random.default_rng(5)
+		lat = 24.6 + rng.random(300) * 1.5
+		lng = 50.8 + rng.random(300) * 0.8
+
+		for depot in (None, (25.29, 51.53)):
+			route, before, after = plan_route(lat, lng, depot=depot, budget_ms=200)
+			self.assertEqual(sorted(route), list(range(300)))
+			self.assertLess(after, before * 0.95)
+
+		route, before, after = plan_route(lat, lng, budget_ms=0)
+		self.assertEqual(route, nearest_neighbour_order(lat, lng))
+		self.assertEqual(before, after)
+
+	def test_driver_orders_in_route_order_from_depot(self):
+		driver = make_driver().name
+		make_orders(driver, 6)
+
+		with patch("foodcharity.api.get_route_settings", return_value={"depot": (25.2, 51.5), "budget_ms": 50}):
+			result = get_driver_orders(driver, route=1)
+			# The same stops reuse the plan
+			with patch("foodcharity.routing.plan_route") as plan_route_mock:
+				again = get_driver_orders(driver, route=1)
+			plan_route_mock.assert_not_called()
+		self.assertEqual([o.building_number for o in result["orders"]], ["1", "2", "3", "4", "5", "6"])
+		self.assertEqual([o.name for o in again["orders"]], [o.name for o in result["orders"]])
+		self.assertEqual(result["route"]["before_km"], result["route"]["after_km"])
+		self.assertNotIn("route", get_driver_orders(driver))
+
+	def test_assignment_plan_clusters_by_location_and_load(self):
+		ensure_street(TEST_ZONE, "3")
+		upsert_buildings(TEST_ZONE, "3", [
+			{"building_number": str(n), "x": 25.4 + n / 10000, "y": 51.3 + n / 10000}
+			for n in range(1, 11)
+		])
+		south, north = make_driver().name, make_driver().name
+		frappe.db.set_value("Volunteer", south, "preferred_delivery_location", "Al Sadd")
+		make_orders(north, 1, street_number="3")
+		expected = {name: south for name in make_orders(None, 5)}
+		expected.update({name: north for name in make_orders(None, 5, street_number="3")})
+
+		plan = plan_assignment(max_biriyani=1000, drivers=[south, north])
+		self.assertEqual({name: plan["assignments"][name] for name in expected}, expected)
+
+		# Each driver's load, including orders already carried, stays under the cap
+		capped = plan_assignment(max_biriyani=6, drivers=[south, north])
+		self.assertTrue(all(d["load"] <= 6 for d in capped["drivers"]))
+		self.assertTrue(capped["unplanned"])
+
+		with patch("frappe.publish_realtime") as publish:
+			result = commit_assignment_plan(frappe.as_json(expected))
+		self.assertEqual(result["count"], len(expected))
+
+		# The coordinator dashboard patches its driver column from the event
+		for c in publish.call_args_list:
+			if c.kwargs["task_id"] == COORDINATOR_ROOM:
+				payload = c.args[1]
+				self.assertEqual({expected[name] for name in payload["names"]}, {payload["assigned_volunteer"]})
+		for name, driver in expected.items():
+			self.assertEqual(frappe.db.get_value("Orders", name, "assigned_volunteer"), driver)
+		self.assertEqual(set(commit_assignment_plan(expected)["results"].values()), {SKIPPED})
+
+	def test_assignment_plan_ignores_delivered_orders(self):
+		"""A driver who finished a round has room for the next one"""
+		driver = make_driver().name
+		for name in make_orders(driver, 5):
+			update_order_status(name, "Delivered")
+		pending = make_orders(None, 3)
+		self.assertEqual(get_roster([driver])[0].load, 0)
+
+		plan = plan_assignment(max_biriyani=6, drivers=[driver])
+		self.assertEqual({name: plan["assignments"].get(name) for name in pending}, dict.fromkeys(pending, driver))
+
+	def test_cluster_respects_capacity_and_preferred_area(self):
+		"""Orders go to the closest driver with room, a preferred area counts as closer"""
+		roster = [
+			frappe._dict(name="near", preferred_delivery_location=None),
+			frappe._dict(name="far", preferred_delivery_location="Wakrah"),
+		]
+		existing = [("near", 25.04, 51.5), ("far", 25.09, 51.5)]
+		order = frappe._dict(lat=25.06, lng=51.5, load=1, area="Wakrah")
+		self.assertEqual(cluster([order], roster, existing, np.array([10.0, 10.0])).tolist(), [1])
+		order.area = "Lusail"
+		self.assertEqual(cluster([order], roster, existing, np.array([10.0, 10.0])).tolist(), [0])
+
+		# Room for two orders with the near driver and one with the far driver, the last is left over
+		orders = [frappe._dict(lat=25.04 + n / 10000, lng=51.5, load=2, area=None) for n in range(4)]
+		choice = cluster(orders, roster, existing, np.array([4.0, 2.0]))
+		self.assertEqual(sorted(choice.tolist()), [-1, 0, 0, 1])
@@ -3,6 +3,12 @@
 
 from frappe.model.document import Document
 
+from foodcharity.gazetteer import clear_streets_cache
+
 
 class Street(Document):
-	pass
+	def on_update(self):
+		clear_streets_cache(self.zone)
+
+	def on_trash(self):
+		clear_streets_cache(self.zone)
@@ -4,6 +4,10 @@
 # import frappe
 from frappe.model.document import Document
 
+from foodcharity.phone import get_phone_search_key
+
 
 class Volunteer(Document):
-	pass
+	def validate(self):
+		# Indexed key for the driver_login phone lookup
+		self.mobile_search_key = get_phone_search_key(self.mobile_number)
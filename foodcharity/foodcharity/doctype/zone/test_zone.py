@@ -0,0 +1,107 @@
+# Copyright (c) 2024, Aadhil and Contributors
+# See license.txt
+
+import gzip
+import json
+import os
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from foodcharity.api import get_streets, get_zones
+from foodcharity.gazetteer import (
+	CACHE_PREFIX,
+	clear_cache,
+	has_local_streets,
+	streets_key,
+	sync_state_key,
+	zones_key,
+)
+from foodcharity.snapshot import SNAPSHOT_URL, build_snapshots, get_snapshot_dir
+
+TEST_ZONE = "991"
+
+
+class TestZone(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		if not frappe.db.exists("Zone", TEST_ZONE):
+			frappe.get_doc({
+				"doctype": "Zone",
+				"zone_number": TEST_ZONE,
+				"zone_name_en": "Gazetteer Test"
+			}).insert(ignore_permissions=True)
+		for street_number in range(1, 51):
+			if not frappe.db.exists("Street", f"{TEST_ZONE}-{street_number}"):
+				frappe.get_doc({
+					"doctype": "Street",
+					"zone": TEST_ZONE,
+					"street_number": str(street_number),
+					"street_name_en": f"Street {street_number}"
+				}).insert(ignore_permissions=True)
+		frappe.db.set_value("Zone", TEST_ZONE, "streets_synced_on", now_datetime())
+
+	def setUp(self):
+		clear_cache(CACHE_PREFIX, prefix=True)
+
+	def test_cached_options_match_database(self):
+		self.assertIn(TEST_ZONE, [z["value"] for z in get_zones()])
+		self.assertEqual(len(get_streets(TEST_ZONE)), 50)
+		self.assertEqual(frappe.cache.get_value(streets_key(TEST_ZONE)), get_streets(TEST_ZONE))
+
+	def test_sync_state_tracks_zones_with_synced_streets(self):
+		self.assertTrue(has_local_streets(TEST_ZONE))
+
+		frappe.db.set_value("Zone", TEST_ZONE, "streets_synced_on", None)
+		clear_cache(sync_state_key())
+		self.assertFalse(has_local_streets(TEST_ZONE))
+
+		frappe.db.set_value("Zone", TEST_ZONE, "streets_synced_on", now_datetime())
+		clear_cache(sync_state_key())
+		self.assertTrue(has_local_streets(TEST_ZONE))
+
+	def test_clear_cache_exposes_new_rows(self):
+		get_streets(TEST_ZONE)
+		frappe.get_doc({
+			"doctype": "Street",
+			"zone": TEST_ZONE,
+			"street_number": "999",
+		}).insert(ignore_permissions=True)
+		clear_cache(streets_key(TEST_ZONE))
+		self.assertIn("999", [s["value"] for s in get_streets(TEST_ZONE)])
+
+	def test_snapshot_matches_api_options(self):
+		manifest = build_snapshots()
+		url = manifest["streets"][TEST_ZONE]
+		path = os.path.join(get_snapshot_dir(), url[len(SNAPSHOT_URL):])
+
+		with open(path) as f:
+			self.assertEqual(json.load(f), get_streets(TEST_ZONE))
+		with gzip.open(f"{path}.gz") as f:
+			self.assertEqual(json.load(f), get_streets(TEST_ZONE))
+		self.assertEqual(build_snapshots()["version"], manifest["version"])
+
+	def test_stale_snapshots_are_removed(self):
+		manifest = build_snapshots()
+		stale = os.path.join(get_snapshot_dir(), "streets-0.000000000000.json")
+		for target in (stale, f"{stale}.gz"):
+			with open(target, "w") as f:
+				f.write("[]")
+
+		build_snapshots()
+		frappe.db.after_commit.run()
+		self.assertFalse(os.path.exists(stale) or os.path.exists(f"{stale}.gz"))
+		current = os.path.join(get_snapshot_dir(), manifest["zones"][len(SNAPSHOT_URL):])
+		self.assertTrue(os.path.exists(current) and os.path.exists(f"{current}.gz"))
+
+	def test_zones_served_from_cache(self):
+		clear_cache(zones_key())
+		zones = get_zones()
+		self.assertIn(TEST_ZONE, [z["value"] for z in zones])
+
+		with patch("foodcharity.api.get_zone_options") as generator, self.assertQueryCount(0):
+			self.assertEqual(get_zones(), zones)
+		generator.assert_not_called()
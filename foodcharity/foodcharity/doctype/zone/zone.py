@@ -3,6 +3,12 @@
 
 from frappe.model.document import Document
 
+from foodcharity.gazetteer import clear_zones_cache
+
 
 class Zone(Document):
-	pass
+	def on_update(self):
+		clear_zones_cache()
+
+	def on_trash(self):
+		clear_zones_cache()
@@ -1,6 +1,8 @@
 import frappe
 from frappe import _
 
+from foodcharity.routing import get_route_settings, sort_rows_by_route
+
 def execute(filters=None):
     columns = [
         {
@@ -129,7 +131,9 @@ def execute(filters=None):
             o.collected_amount,
             o.order_status,
             o.remark,
-            o.coordinate
+            o.coordinate,
+            o.latitude,
+            o.longitude
         FROM
             `tabOrders` o
         LEFT JOIN
@@ -142,67 +146,44 @@ def execute(filters=None):
 
     data = frappe.db.sql(query, values, as_dict=True)
 
-    # Calculate extra amount for each row and parse coordinates
+    # Calculate extra amount for each row
     for row in data:
         expected_amount = (row.get("job_no") or 0) * 20
         collected = row.get("collected_amount") or 0
         row["extra_amount"] = max(0, collected - expected_amount)
 
-        # Parse coordinates for sorting
-        row["lat"] = None
-        row["lng"] = None
-        if row.get("coordinate") and "," in str(row.get("coordinate")):
-            try:
-                parts = row["coordinate"].split(",")
-                lat = float(parts[0].strip())
-                lng = float(parts[1].strip())
-                # Swap if lat > 40 (means it's longitude for Qatar)
-                if lat > 40:
-                    lat, lng = lng, lat
-                row["lat"] = lat
-                row["lng"] = lng
-            except:
-                pass
-
-    # Sort by location using nearest neighbor algorithm
-    data = sort_by_nearest_location(data)
-
-    return columns, data
-
-
-def sort_by_nearest_location(data):
-    """Sort orders by nearest neighbor to optimize delivery route"""
-    if not data:
-        return data
-
-    # Separate orders with and without coordinates
-    with_coords = [r for r in data if r.get("lat") is not None]
-    without_coords = [r for r in data if r.get("lat") is None]
-
-    if not with_coords:
-        return data
-
-    # Start with the northernmost point
-    with_coords.sort(key=lambda x: (-x["lat"], x["lng"]))
-
-    sorted_orders = [with_coords.pop(0)]
+    # Sort each driver's orders into a route, unassigned orders last
+    routes = {}
+    for row in data:
+        routes.setdefault(row.get("assigned_volunteer") or "", []).append(row)
 
-    # Nearest neighbor algorithm
-    while with_coords:
-        last = sorted_orders[-1]
-        nearest = min(with_coords, key=lambda x: distance(last, x))
-        sorted_orders.append(nearest)
-        with_coords.remove(nearest)
+    route_settings = get_route_settings()
+    data = []
+    length_before = length_after = 0
+    for driver in sorted(routes, key=lambda driver: (not driver, driver)):
+        rows, before, after = sort_rows_by_route(routes[driver], **route_settings)
+        data.extend(rows)
+        length_before += before
+        length_after += after
 
-    # Add orders without coordinates at the end
-    return sorted_orders + without_coords
+    return columns, data, None, None, get_route_summary(length_before, length_after)
 
 
-def distance(p1, p2):
-    """Calculate approximate distance between two points"""
-    lat1, lng1 = p1.get("lat", 0), p1.get("lng", 0)
-    lat2, lng2 = p2.get("lat", 0), p2.get("lng", 0)
-    return ((lat2 - lat1) ** 2 + (lng2 - lng1) ** 2) ** 0.5
+def get_route_summary(length_before, length_after):
+    """Total route length of the nearest neighbour walk and of the optimized routes"""
+    return [
+        {
+            "value": round(length_before / 1000, 2),
+            "label": _("Nearest Neighbour Route (km)"),
+            "datatype": "Float",
+        },
+        {
+            "value": round(length_after / 1000, 2),
+            "label": _("Optimized Route (km)"),
+            "datatype": "Float",
+            "indicator": "Green" if length_after < length_before else "Blue",
+        },
+    ]
 
 def get_conditions(filters):
     conditions = ["1=1"]
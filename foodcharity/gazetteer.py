@@ -0,0 +1,234 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+import frappe
+
+CACHE_PREFIX = "foodcharity:gazetteer:"
+REDIS_TTL = 24 * 60 * 60
+LOCAL_TTL = 60
+LOCAL_MAXSIZE = 2048
+MISSING_TTL = 6 * 60 * 60
+
+EMPTY = "empty"
+PARTIAL = "partial"
+POPULATED = "populated"
+
+
+class LocalCache:
+    """Small thread-safe in-process LRU with a TTL.
+
+    Entries only live for `ttl` seconds so other workers pick up invalidations
+    made elsewhere shortly after Redis has been cleared."""
+
+    def __init__(self, maxsize=LOCAL_MAXSIZE, ttl=LOCAL_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if not entry:
+                return None
+            if entry[0] < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [k for k in self.data if k.startswith(prefix)]:
+                del self.data[key]
+
+
+local_cache = LocalCache()
+
+
+def zones_key():
+    return f"{CACHE_PREFIX}zones"
+
+
+def streets_key(zone_number):
+    return f"{CACHE_PREFIX}streets:{zone_number}"
+
+
+def buildings_key(zone_number, street_number):
+    return f"{CACHE_PREFIX}buildings:{zone_number}:{street_number}"
+
+
+def manifest_key():
+    return f"{CACHE_PREFIX}manifest"
+
+
+def sync_state_key():
+    return f"{CACHE_PREFIX}sync_state"
+
+
+def missing_key(zone_number, street_number):
+    return f"{CACHE_PREFIX}missing:{zone_number}:{street_number}"
+
+
+def zone_option(zone):
+    """Render a local Zone row as a dropdown option"""
+    return {
+        "value": zone.zone_number,
+        "label": f"{zone.zone_number} - {zone.zone_name_en} ({zone.zone_name_ar})"
+    }
+
+
+def street_option(street):
+    """Render a local Street row as a dropdown option"""
+    return {
+        "value": street.street_number,
+        "label": f"{street.street_number} - {street.street_name_en or ''} ({street.street_name_ar or ''})"
+    }
+
+
+def get_local_key(key):
+    return f"{frappe.local.site}:{key}"
+
+
+def get_cached(key, generator, ttl=REDIS_TTL):
+    """Return the option list for `key` from process memory, then Redis, then `generator`.
+
+    Empty results are not cached so a failed lookup is retried on the next call."""
+    local_key = get_local_key(key)
+    value = local_cache.get(local_key)
+    if value is not None:
+        return value
+
+    value = frappe.cache.get_value(key)
+    if value is None:
+        value = generator()
+        if value:
+            frappe.cache.set_value(key, value, expires_in_sec=ttl)
+
+    if value:
+        local_cache.set(local_key, value)
+    return value
+
+
+def get_sync_state():
+    """Which address levels are available locally, maintained by the sync jobs.
+
+    `street_zones` lists the zones whose full street list has been synced, so a
+    partial sync still falls back to QNAS for the zones that are missing."""
+    return get_cached(sync_state_key(), build_sync_state)
+
+
+def build_sync_state():
+    """Derive the sync state from the database, only runs on a cache miss"""
+    zone_count = frappe.db.count("Zone")
+    street_zones = frappe.get_all("Zone", filters={"streets_synced_on": ["is", "set"]}, pluck="name")
+
+    if not frappe.get_all("Building", limit=1, pluck="name"):
+        buildings = EMPTY
+    elif frappe.get_all("Street", filters={"buildings_fetched_on": ["is", "not set"]}, limit=1, pluck="name"):
+        buildings = PARTIAL
+    else:
+        buildings = POPULATED
+
+    return {
+        "zones": POPULATED if zone_count else EMPTY,
+        "streets": get_level(len(street_zones), zone_count),
+        "buildings": buildings,
+        "street_zones": street_zones
+    }
+
+
+def get_level(synced, total):
+    if not synced:
+        return EMPTY
+    return POPULATED if synced >= total else PARTIAL
+
+
+def has_local_zones():
+    return get_sync_state()["zones"] != EMPTY
+
+
+def has_local_streets(zone_number):
+    return str(zone_number) in get_sync_state()["street_zones"]
+
+
+def has_local_buildings():
+    return get_sync_state()["buildings"] != EMPTY
+
+
+def is_missing(zone_number, street_number, building_number=None):
+    """Whether QNAS recently had no such street, or no such building on the street.
+
+    Misses of a street live in one Redis hash, field "" for the street itself
+    and the building number for buildings, each holding its own expiry time."""
+    key = missing_key(zone_number, street_number)
+    now = time.time()
+    for field in ("", building_number):
+        if field is not None and (frappe.cache.hget(key, field) or 0) > now:
+            return True
+    return False
+
+
+def mark_missing(zone_number, street_number, building_number=None, ttl=MISSING_TTL):
+    """Remember a QNAS miss so repeat lookups don't call QNAS again for `ttl` seconds"""
+    key = missing_key(zone_number, street_number)
+    frappe.cache.hset(key, building_number or "", time.time() + ttl)
+    frappe.cache.expire(frappe.cache.make_key(key), ttl)
+
+
+def clear_missing(zone_number, street_number):
+    clear_cache_on_commit(missing_key(zone_number, street_number))
+
+
+def clear_cache(key, prefix=False):
+    """Drop a cached option list, or every list under a key prefix, from Redis and this process"""
+    if prefix:
+        frappe.cache.delete_keys(key)
+        local_cache.delete_prefix(get_local_key(key))
+    else:
+        frappe.cache.delete_value(key)
+        local_cache.delete(get_local_key(key))
+
+
+def clear_cache_on_commit(key, prefix=False):
+    """Invalidate once the current transaction commits, so readers can't re-cache old rows"""
+    frappe.db.after_commit.add(partial(clear_cache, key, prefix))
+
+
+def clear_gazetteer():
+    clear_cache_on_commit(CACHE_PREFIX, prefix=True)
+
+
+def clear_sync_state():
+    clear_cache_on_commit(sync_state_key())
+
+
+def clear_zones_cache():
+    clear_cache_on_commit(zones_key())
+
+
+def clear_streets_cache(zone_number=None):
+    if zone_number:
+        clear_cache_on_commit(streets_key(zone_number))
+    else:
+        clear_cache_on_commit(f"{CACHE_PREFIX}streets:", prefix=True)
+
+
+def clear_buildings_cache(zone_number=None, street_number=None):
+    if zone_number and street_number:
+        clear_cache_on_commit(buildings_key(zone_number, street_number))
+    else:
+        clear_cache_on_commit(f"{CACHE_PREFIX}buildings:", prefix=True)
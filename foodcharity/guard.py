@@ -0,0 +1,143 @@
+import hashlib
+import json
+import pickle
+import time
+from functools import wraps
+
+import frappe
+from frappe import _
+
+GUARD_PREFIX = "foodcharity:guard:"
+COALESCE_LOCK_TTL_MS = 10000
+COALESCE_WAIT = 5
+COALESCE_POLL = 0.05
+
+# Refill the bucket at `rate` tokens per second up to `burst`, and take one
+# token if there is one. Returns {allowed, seconds until the next token}.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring((1 - tokens) / rate)}
+"""
+
+token_bucket_script = None
+
+
+def guest_endpoint(rate, burst, cache_ttl=None):
+    """Guard a guest endpoint for HTTP callers.
+
+    Every client IP gets a token bucket per endpoint (`rate` requests per second,
+    bursts up to `burst`) kept in Redis so the limit holds across workers.
+    Read-only endpoints can also pass `cache_ttl` to memoize responses per
+    arguments for that many seconds. Concurrent misses for the same arguments
+    are coalesced, one worker runs the endpoint while the others wait for its
+    result. Internal calls (jobs, tests, other endpoints) are not guarded.
+
+    Goes below @frappe.whitelist so the whitelisted function is the guarded one."""
+    def decorator(fn):
+        endpoint = f"{fn.__module__}.{fn.__name__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            ip = getattr(frappe.local, "request_ip", None)
+            if not ip:
+                return fn(*args, **kwargs)
+
+            if frappe.session.user == "Guest":
+                check_rate_limit(f"{endpoint}:{ip}", rate, burst)
+
+            if not cache_ttl:
+                return fn(*args, **kwargs)
+            return get_coalesced(get_memo_key(endpoint, args, kwargs), lambda: fn(*args, **kwargs), cache_ttl)
+
+        return wrapper
+
+    return decorator
+
+
+def check_rate_limit(key, rate, burst):
+    allowed, retry_after = take_token(key, rate, burst)
+    if not allowed:
+        frappe.throw(
+            _("Too many requests, please try again in {0} seconds").format(max(1, round(retry_after))),
+            frappe.TooManyRequestsError,
+        )
+
+
+def take_token(key, rate, burst):
+    """Take a token from the bucket at `key`, returns (allowed, seconds to wait).
+
+    Fails open when Redis is unavailable, donors shouldn't be locked out by a cache outage."""
+    global token_bucket_script
+    try:
+        if not token_bucket_script:
+            token_bucket_script = frappe.cache.register_script(TOKEN_BUCKET_SCRIPT)
+        allowed, retry_after = token_bucket_script(
+            keys=[frappe.cache.make_key(f"{GUARD_PREFIX}bucket:{key}")],
+            args=[rate, burst, time.time()],
+        )
+        return bool(allowed), float(retry_after)
+    except Exception:
+        frappe.log_error("Guest endpoint rate limiter unavailable")
+        return True, 0
+
+
+def get_memo_key(endpoint, args, kwargs):
+    arguments = json.dumps([args, kwargs], sort_keys=True, default=str)
+    return f"{GUARD_PREFIX}memo:{endpoint}:{hashlib.sha1(arguments.encode()).hexdigest()}"
+
+
+def get_coalesced(key, generator, ttl, lock_ttl_ms=COALESCE_LOCK_TTL_MS, wait=COALESCE_WAIT, on_timeout=None):
+    """Return the memoized result for `key`, computing it in at most one worker at a time.
+
+    Workers finding the lock taken wait up to `wait` seconds for the result.
+    After that, or when the worker holding the lock failed, they compute it
+    themselves, or return `on_timeout()` when given, so a slow upstream isn't
+    called again by every waiter. `lock_ttl_ms` should outlast the slowest
+    `generator` run.
+
+    Reads Redis directly rather than through frappe.cache.get_value, whose
+    per-request cache would keep returning the first miss while we wait."""
+    redis_key = frappe.cache.make_key(key)
+    lock_key = frappe.cache.make_key(f"{key}:lock")
+
+    cached = get_memo(redis_key)
+    if cached is not None:
+        return cached[0]
+
+    if frappe.cache.set(lock_key, 1, nx=True, px=lock_ttl_ms):
+        try:
+            value = generator()
+            frappe.cache.set(redis_key, pickle.dumps((value,)), ex=ttl)
+            return value
+        finally:
+            frappe.cache.delete(lock_key)
+
+    # Another worker is computing the same response, wait for it rather than hitting the DB again
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(COALESCE_POLL)
+        cached = get_memo(redis_key)
+        if cached is not None:
+            return cached[0]
+        if not frappe.cache.exists(lock_key):
+            break
+
+    return on_timeout() if on_timeout else generator()
+
+
+def get_memo(redis_key):
+    value = frappe.cache.get(redis_key)
+    return pickle.loads(value) if value is not None else None
@@ -99,7 +99,12 @@ fixtures = [
 # ------------
 
 # before_install = "foodcharity.install.before_install"
-# after_install = "foodcharity.install.after_install"
+after_install = "foodcharity.indexes.ensure_indexes"
+
+# Migration
+# ------------
+
+after_migrate = ["foodcharity.indexes.ensure_indexes"]
 
 # Uninstallation
 # ------------
@@ -164,6 +169,12 @@ fixtures = [
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"hourly": [
+		"foodcharity.coordinates.resolve_pending_coordinates"
+	],
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"foodcharity.tasks.all"
@@ -0,0 +1,117 @@
+import frappe
+
+# (doctype, fields, index name) for the hot API lookups
+INDEXES = [
+    ("Building", ["zone", "street_number", "building_number"], "zone_street_building_index"),
+    ("Building", ["geohash"], "geohash_index"),
+    ("Street", ["zone", "street_number"], "zone_street_index"),
+    ("Orders", ["assigned_volunteer", "creation"], "assigned_volunteer_creation_index"),
+    ("Orders", ["order_status", "creation"], "order_status_creation_index"),
+    ("Orders", ["accommodation_area", "creation"], "accommodation_area_creation_index"),
+    ("Orders", ["geohash"], "geohash_index"),
+    ("Orders", ["modified", "name"], "modified_name_index"),
+    ("Orders", ["zone_number", "street_number", "building_number"], "zone_street_building_index"),
+    ("Volunteer", ["interest"], "interest_index"),
+]
+
+# (label, query) pairs checked by `bench explain-foodcharity-queries`
+HOT_QUERIES = [
+    (
+        "get_buildings",
+        """SELECT building_number, latitude, longitude FROM `tabBuilding`
+        WHERE zone = %(zone)s AND street_number = %(street_number)s ORDER BY building_number ASC""",
+    ),
+    (
+        "resolve_building (get_location / get_building_coordinates / Orders.update_coordinates)",
+        """SELECT latitude, longitude FROM `tabBuilding` WHERE name = %(building)s""",
+    ),
+    (
+        "get_streets",
+        """SELECT street_number, street_name_en, street_name_ar FROM `tabStreet`
+        WHERE zone = %(zone)s ORDER BY street_number ASC""",
+    ),
+    (
+        "get_driver_orders",
+        """SELECT name, latitude, longitude FROM `tabOrders`
+        WHERE assigned_volunteer = %(driver)s ORDER BY creation DESC""",
+    ),
+    (
+        "orders by status",
+        """SELECT name FROM `tabOrders`
+        WHERE order_status = %(order_status)s ORDER BY creation DESC""",
+    ),
+    (
+        "get_all_orders_for_coordinator (driver filter, keyset page)",
+        """SELECT o.name, v.full_name FROM `tabOrders` o
+        LEFT JOIN `tabVolunteer` v ON v.name = o.assigned_volunteer
+        WHERE o.assigned_volunteer = %(driver)s
+            AND (o.creation < %(cursor_creation)s OR (o.creation = %(cursor_creation)s AND o.name < %(cursor_name)s))
+        ORDER BY o.creation DESC, o.name DESC LIMIT 101""",
+    ),
+    (
+        "orders_within / orders_in_bbox",
+        """SELECT name, latitude, longitude FROM `tabOrders`
+        WHERE (geohash LIKE %(cell)s OR geohash LIKE %(neighbour_cell)s)
+            AND latitude BETWEEN %(min_lat)s AND %(max_lat)s AND longitude BETWEEN %(min_lng)s AND %(max_lng)s""",
+    ),
+    (
+        "nearest_building",
+        """SELECT name, latitude, longitude FROM `tabBuilding`
+        WHERE geohash LIKE %(cell)s OR geohash LIKE %(neighbour_cell)s""",
+    ),
+    (
+        "get_changed_orders (driver / coordinator delta feed)",
+        """SELECT name, modified FROM `tabOrders`
+        WHERE modified > %(cursor_creation)s OR (modified = %(cursor_creation)s AND name > %(cursor_name)s)
+        ORDER BY modified ASC, name ASC LIMIT 501""",
+    ),
+    (
+        "update_building_orders",
+        """SELECT name, coordinate FROM `tabOrders`
+        WHERE zone_number = %(zone)s AND street_number = %(street_number)s
+            AND IFNULL(order_status, '') NOT IN ('Delivered', 'Collected')""",
+    ),
+    (
+        "get_all_drivers",
+        """SELECT name FROM `tabVolunteer` WHERE interest = 'Driver'""",
+    ),
+]
+
+
+def ensure_indexes():
+    """Create any missing composite indexes, safe to run on every migrate"""
+    for doctype, fields, index_name in INDEXES:
+        frappe.db.add_index(doctype, fields, index_name)
+
+
+def get_sample_values():
+    """Real key values to EXPLAIN with, so the plans reflect actual data"""
+    building = frappe.db.get_value(
+        "Building", {}, ["name", "zone", "street_number", "building_number"], as_dict=True
+    ) or {}
+    return {
+        "zone": building.get("zone") or "1",
+        "street_number": building.get("street_number") or "1",
+        "building_number": building.get("building_number") or "1",
+        "building": building.get("name") or "1-1-1",
+        "driver": frappe.db.get_value("Volunteer", {"interest": "Driver"}, "name") or "V001",
+        "order_status": "Pending",
+        "cursor_creation": "9999-12-31",
+        "cursor_name": "",
+        # Two cells in central Doha
+        "cell": "thkxue%",
+        "neighbour_cell": "thkxug%",
+        "min_lat": 25.28,
+        "max_lat": 25.29,
+        "min_lng": 51.52,
+        "max_lng": 51.54,
+    }
+
+
+def explain_hot_queries():
+    """Return (label, EXPLAIN rows) for every hot API query"""
+    values = get_sample_values()
+    return [
+        (label, frappe.db.sql(f"EXPLAIN {query}", values, as_dict=True))
+        for label, query in HOT_QUERIES
+    ]
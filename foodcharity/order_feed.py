@@ -0,0 +1,86 @@
+import frappe
+
+FEED_LIMIT = 500
+EPOCH = "1900-01-01 00:00:00"
+
+
+def make_cursor(modified, name, deleted=None, deleted_name=""):
+    """Position in the order feed, and separately in the deletion log so
+    tombstones already handed out aren't returned again"""
+    return frappe.as_json({
+        "modified": str(modified),
+        "name": name,
+        "deleted": str(deleted or modified),
+        "deleted_name": deleted_name,
+    }, indent=None)
+
+
+def parse_cursor(cursor):
+    cursor = frappe.parse_json(cursor) or {}
+    modified = cursor.get("modified") or EPOCH
+    return modified, cursor.get("name") or "", cursor.get("deleted") or modified, cursor.get("deleted_name") or ""
+
+
+def get_changes_cursor():
+    """Cursor at the most recently modified order, taken before a full load so
+    nothing written while the load runs is missed by the next delta"""
+    row = frappe.db.sql("""
+        SELECT modified, name FROM `tabOrders`
+        ORDER BY modified DESC, name DESC
+        LIMIT 1
+    """)
+    modified, name = row[0] if row else (EPOCH, "")
+    deleted = frappe.db.sql("""
+        SELECT creation, name FROM `tabDeleted Document`
+        WHERE deleted_doctype = 'Orders'
+        ORDER BY creation DESC, name DESC
+        LIMIT 1
+    """)
+    return make_cursor(modified, name, *(deleted[0] if deleted else ()))
+
+
+def get_changed_orders(since, conditions=None, values=None, limit=FEED_LIMIT):
+    """Orders modified after the `since` cursor, split by whether they match `conditions`.
+
+    Returns (changed, removed, cursor, has_more). `changed` orders match the
+    caller's filters and should be upserted, `removed` ones were modified out
+    of them (or deleted) and should be dropped. Every assignment, status or
+    amount change bumps `modified`, so a reassigned order shows up as removed
+    for its old driver and changed for the new one."""
+    since_modified, since_name, since_deleted, since_deleted_name = parse_cursor(since)
+    values = dict(values or {}, since_modified=since_modified, since_name=since_name, limit=limit + 1)
+    matches = " AND ".join(conditions) if conditions else "1"
+
+    rows = frappe.db.sql(f"""
+        SELECT o.name, o.modified, COALESCE(({matches}), 0) AS matches
+        FROM `tabOrders` o
+        WHERE (o.modified > %(since_modified)s OR (o.modified = %(since_modified)s AND o.name > %(since_name)s))
+        ORDER BY o.modified ASC, o.name ASC
+        LIMIT %(limit)s
+    """, values, as_dict=True)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changed = [row.name for row in rows if row.matches]
+    removed = [row.name for row in rows if not row.matches]
+    if not has_more:
+        tombstones = get_deleted_orders(since_deleted, since_deleted_name)
+        removed += [row.deleted_name for row in tombstones]
+        if tombstones:
+            since_deleted, since_deleted_name = tombstones[-1].creation, tombstones[-1].name
+
+    if rows:
+        since_modified, since_name = rows[-1].modified, rows[-1].name
+    cursor = make_cursor(since_modified, since_name, since_deleted, since_deleted_name)
+    return changed, removed, cursor, has_more
+
+
+def get_deleted_orders(since_deleted, since_deleted_name):
+    """Tombstones for orders deleted after the cursor, from Frappe's Deleted Document log"""
+    return frappe.db.sql("""
+        SELECT name, creation, deleted_name
+        FROM `tabDeleted Document`
+        WHERE deleted_doctype = 'Orders'
+            AND (creation > %(since)s OR (creation = %(since)s AND name > %(since_name)s))
+        ORDER BY creation ASC, name ASC
+    """, {"since": since_deleted, "since_name": since_deleted_name}, as_dict=True)
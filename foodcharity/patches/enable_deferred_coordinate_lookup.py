@@ -0,0 +1,12 @@
+import frappe
+
+
+def execute():
+    """Single doctype defaults only apply to new sites, give existing sites the
+    field default (background resolver on) unless an admin already chose a value"""
+    if frappe.db.sql(
+        "SELECT 1 FROM `tabSingles` WHERE doctype = %s AND field = %s",
+        ("Foodcharity Settings", "defer_coordinate_lookup"),
+    ):
+        return
+    frappe.db.set_single_value("Foodcharity Settings", "defer_coordinate_lookup", 1)
@@ -0,0 +1,15 @@
+import frappe
+from frappe.utils import now_datetime
+
+from foodcharity.gazetteer import clear_sync_state
+
+
+def execute():
+    """Zones synced before the sync-state marker existed were always served from local streets"""
+    frappe.db.sql(
+        """UPDATE `tabZone` z SET z.streets_synced_on = %s
+        WHERE z.streets_synced_on IS NULL
+        AND EXISTS (SELECT 1 FROM `tabStreet` s WHERE s.zone = z.name)""",
+        now_datetime(),
+    )
+    clear_sync_state()
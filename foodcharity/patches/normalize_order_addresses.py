@@ -0,0 +1,26 @@
+import frappe
+
+from foodcharity.address import normalize_number
+from foodcharity.coordinates import backfill_coordinates
+
+BATCH_SIZE = 1000
+ADDRESS_FIELDS = ("zone_number", "street_number", "building_number")
+
+
+def execute():
+    """Normalize the address parts of orders saved before Orders.normalize_address,
+    so they join to their buildings by name, then fill the coordinates that now match"""
+    orders = frappe.get_all("Orders", fields=["name", *ADDRESS_FIELDS])
+    updates = {}
+    for order in orders:
+        normalized = {f: normalize_number(order.get(f)) for f in ADDRESS_FIELDS if order.get(f)}
+        if any(order.get(f) != value for f, value in normalized.items()):
+            updates[order.name] = normalized
+
+    names = list(updates)
+    for start in range(0, len(names), BATCH_SIZE):
+        frappe.db.bulk_update(
+            "Orders", {name: updates[name] for name in names[start:start + BATCH_SIZE]}, update_modified=False
+        )
+
+    backfill_coordinates()
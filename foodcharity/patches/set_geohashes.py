@@ -0,0 +1,19 @@
+import frappe
+
+from foodcharity.spatial import get_geohash
+
+BATCH_SIZE = 1000
+
+
+def execute():
+    """Fill the geohash cells of buildings and orders saved before they existed"""
+    for doctype in ("Building", "Orders"):
+        records = frappe.get_all(
+            doctype, filters={"latitude": ("!=", 0)}, fields=["name", "latitude", "longitude"]
+        )
+        for start in range(0, len(records), BATCH_SIZE):
+            updates = {
+                record.name: {"geohash": get_geohash(record.latitude, record.longitude)}
+                for record in records[start:start + BATCH_SIZE]
+            }
+            frappe.db.bulk_update(doctype, updates, update_modified=False)
@@ -0,0 +1,19 @@
+import frappe
+
+from foodcharity.routing import parse_coordinate
+
+BATCH_SIZE = 1000
+
+
+def execute():
+    """Fill the typed latitude and longitude of orders saved before they existed"""
+    orders = frappe.get_all("Orders", filters={"coordinate": ("is", "set")}, fields=["name", "coordinate"])
+    for start in range(0, len(orders), BATCH_SIZE):
+        updates = {}
+        for order in orders[start:start + BATCH_SIZE]:
+            latitude, longitude = parse_coordinate(order.coordinate)
+            # Unparsable coordinates keep the column default of 0
+            if latitude is not None:
+                updates[order.name] = {"latitude": latitude, "longitude": longitude}
+        if updates:
+            frappe.db.bulk_update("Orders", updates, update_modified=False)
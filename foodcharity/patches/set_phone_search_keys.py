@@ -0,0 +1,21 @@
+import frappe
+
+from foodcharity.phone import get_phone_search_key
+
+BATCH_SIZE = 1000
+
+
+def execute():
+    """Fill the reversed-digits phone keys for orders and volunteers saved before they existed"""
+    backfill("Orders", {"mobile": "mobile_search_key", "whatsapp_number": "whatsapp_search_key"})
+    backfill("Volunteer", {"mobile_number": "mobile_search_key"})
+
+
+def backfill(doctype, key_fields):
+    records = frappe.get_all(doctype, fields=["name", *key_fields])
+    for start in range(0, len(records), BATCH_SIZE):
+        updates = {
+            record.name: {key: get_phone_search_key(record.get(phone)) for phone, key in key_fields.items()}
+            for record in records[start:start + BATCH_SIZE]
+        }
+        frappe.db.bulk_update(doctype, updates, update_modified=False)
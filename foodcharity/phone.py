@@ -0,0 +1,39 @@
+import re
+
+from frappe.utils import cstr
+
+COUNTRY_CODE = "974"
+LOCAL_LENGTH = 8
+
+
+def normalize_phone(value):
+    """Digits-only E.164 form (without the +) of a phone number.
+
+    Local Qatar numbers get the 974 country code, numbers written with a 00
+    international prefix lose it."""
+    digits = re.sub(r"\D", "", cstr(value))
+    if digits.startswith("00"):
+        digits = digits[2:]
+    if len(digits) == LOCAL_LENGTH:
+        digits = COUNTRY_CODE + digits
+    return digits
+
+
+def get_phone_search_key(value):
+    """Reversed normalized digits, so "ends with" lookups become indexed prefix matches"""
+    return normalize_phone(value)[::-1] or None
+
+
+def get_phone_search_pattern(value):
+    """LIKE pattern matching every stored number that ends with the given digits.
+
+    The +974 country code is dropped from the input, so "+974 5555 1234" and
+    "55551234" match the same records."""
+    digits = re.sub(r"\D", "", cstr(value))
+    if digits.startswith("00"):
+        digits = digits[2:]
+    if digits.startswith(COUNTRY_CODE) and len(digits) == len(COUNTRY_CODE) + LOCAL_LENGTH:
+        digits = digits[len(COUNTRY_CODE):]
+    if not digits:
+        return None
+    return digits[::-1] + "%"
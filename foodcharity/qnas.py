@@ -0,0 +1,394 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = "https://qnas.qa/"
+
+DEFAULT_REQUESTS_PER_SECOND = 5
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_TIMEOUT = (5, 30)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Interactive lookups (order form, order saves) give up quickly and use local data
+LOOKUP_TIMEOUT = (3, 10)
+LOOKUP_MAX_RETRIES = 1
+LOOKUP_BACKOFF = 0.2
+
+HEADERS_TTL = 300
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+BREAKER_POLL = 1
+# Sync jobs pause this long for an open circuit before giving up on the run
+SYNC_BREAKER_MAX_WAIT = 600
+STATS_KEY = "foodcharity:qnas:stats"
+
+
+class QnasUnavailableError(requests.exceptions.RequestException):
+    """Raised without calling QNAS while the circuit breaker is open"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter, acquire() blocks until a token is free"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate or 0)
+        self.capacity = float(capacity or max(1, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size=DEFAULT_MAX_WORKERS):
+    """Create a requests session with a keep-alive connection pool sized for the workers"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class QnasFetcher:
+    """Concurrent QNAS fetcher with a bounded worker pool, shared connection pool,
+    token bucket rate limit and retry with exponential backoff"""
+
+    def __init__(
+        self,
+        headers=None,
+        base_url=BASE_URL,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff=0.5,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.headers = headers or {"Accept": "application/json"}
+        self.base_url = base_url
+        self.max_workers = max(1, int(max_workers or 1))
+        self.max_retries = max(0, int(max_retries or 0))
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(requests_per_second)
+        self.session = make_session(self.max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def get_headers(self):
+        return self.headers
+
+    def get_json(self, path):
+        """GET a QNAS path, retrying connection errors and throttled/5xx responses"""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.session.get(f"{self.base_url}{path}", headers=self.get_headers(), timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+
+            time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+            attempt += 1
+
+    def fetch_many(self, items, path_for):
+        """Fetch `path_for(item)` for every item on the worker pool.
+
+        Yields (item, data, error) in the same order as `items`, keeping at most
+        two requests per worker in flight so memory stays bounded on long runs.
+        Database writes must stay in the caller, worker threads only do HTTP."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for item in items:
+                pending.append((item, executor.submit(self._fetch, path_for(item))))
+                if len(pending) >= self.max_workers * 2:
+                    item, future = pending.popleft()
+                    yield (item, *future.result())
+                    stats.flush()
+
+            while pending:
+                item, future = pending.popleft()
+                yield (item, *future.result())
+
+        stats.flush()
+
+    def _fetch(self, path):
+        try:
+            return self.get_json(path), None
+        except Exception as e:
+            return None, e
+
+
+class CircuitBreaker:
+    """Stops calling QNAS after repeated failures so callers fall back to local data fast.
+
+    After `failure_threshold` consecutive failures the circuit opens for
+    `reset_timeout` seconds, then a single trial request decides whether it
+    closes again. State is per process, like the connection pool."""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def retry_in(self):
+        """Seconds until a trial request could be allowed"""
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            if self.trial_running:
+                return BREAKER_POLL
+            return max(0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class QnasStats:
+    """Per-endpoint call, error and latency counters.
+
+    Worker threads have no site context, so counts are kept in process and
+    added to a Redis hash by flush() from the request or job thread."""
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, elapsed_ms, error=False, rejected=False):
+        with self.lock:
+            counters = self.pending.setdefault(endpoint, {"calls": 0, "errors": 0, "rejected": 0, "total_ms": 0})
+            counters["calls"] += 1
+            counters["errors"] += int(error)
+            counters["rejected"] += int(rejected)
+            counters["total_ms"] += int(elapsed_ms)
+
+    def flush(self):
+        if not getattr(frappe.local, "site", None):
+            return
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            pipeline = frappe.cache.pipeline()
+            for endpoint, counters in pending.items():
+                for field, value in counters.items():
+                    if value:
+                        pipeline.hincrby(frappe.cache.make_key(STATS_KEY), f"{endpoint}:{field}", value)
+            pipeline.execute()
+        except Exception:
+            pass
+
+
+breaker = CircuitBreaker()
+stats = QnasStats()
+
+
+def get_endpoint(path):
+    return path.split("/", 1)[0]
+
+
+class QnasClient(QnasFetcher):
+    """QnasFetcher behind the shared circuit breaker, recording per-endpoint stats.
+
+    Without explicit `headers` the current site's auth headers are used on
+    every call, so one client can serve every site in a web worker. Clients
+    handed to fetch_many worker threads must be given headers up front.
+
+    With `max_wait` calls pause while the circuit is open instead of failing
+    fast, and once a wait runs out every later call fails fast."""
+
+    def __init__(self, breaker=breaker, headers=None, max_wait=0, **kwargs):
+        super().__init__(headers=headers, **kwargs)
+        self.breaker = breaker
+        self.site_headers = headers is None
+        self.max_wait = max_wait
+        self.gave_up = False
+
+    def get_headers(self):
+        return get_qnas_headers() if self.site_headers else self.headers
+
+    def get_json(self, path):
+        endpoint = get_endpoint(path)
+        if not self.allow():
+            stats.record(endpoint, 0, error=True, rejected=True)
+            raise QnasUnavailableError(f"QNAS circuit open, skipped {path}")
+
+        start = time.monotonic()
+        try:
+            data = super().get_json(path)
+        except requests.exceptions.HTTPError as e:
+            # A 404 is an answer (unknown street), only server side failures trip the breaker
+            if e.response is not None and e.response.status_code < 500:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            stats.record(endpoint, (time.monotonic() - start) * 1000, error=True)
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            stats.record(endpoint, (time.monotonic() - start) * 1000, error=True)
+            raise
+
+        self.breaker.record_success()
+        stats.record(endpoint, (time.monotonic() - start) * 1000)
+        return data
+
+    def allow(self):
+        deadline = time.monotonic() + self.max_wait
+        while not self.breaker.allow():
+            now = time.monotonic()
+            if self.gave_up or now >= deadline:
+                self.gave_up = bool(self.max_wait)
+                return False
+            time.sleep(max(0.05, min(self.breaker.retry_in(), deadline - now)))
+        return True
+
+
+qnas_client = None
+headers_cache = {}
+headers_lock = threading.Lock()
+
+
+def get_qnas_client():
+    """Process wide client for interactive lookups, reusing one connection pool"""
+    global qnas_client
+    if qnas_client is None:
+        qnas_client = QnasClient(
+            requests_per_second=0,
+            max_workers=DEFAULT_MAX_WORKERS,
+            max_retries=LOOKUP_MAX_RETRIES,
+            backoff=LOOKUP_BACKOFF,
+            timeout=LOOKUP_TIMEOUT,
+        )
+    return qnas_client
+
+
+def get_qnas_json(path):
+    """GET a QNAS path with the shared client"""
+    try:
+        return get_qnas_client().get_json(path)
+    finally:
+        stats.flush()
+
+
+def get_qnas_headers():
+    """QNAS API headers for the current site, cached for a few minutes so the
+    token isn't decrypted on every request"""
+    site = frappe.local.site
+    with headers_lock:
+        cached = headers_cache.get(site)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+    headers = build_qnas_headers()
+    with headers_lock:
+        headers_cache[site] = (time.monotonic() + HEADERS_TTL, headers)
+    return headers
+
+
+def build_qnas_headers():
+    """Get QNAS API headers from settings"""
+    try:
+        settings = frappe.get_single("Foodcharity Settings")
+        if settings.qnas_enabled and settings.qnas_api_token and settings.qnas_api_domain:
+            return {
+                "X-Token": settings.get_password("qnas_api_token"),
+                "X-Domain": settings.qnas_api_domain,
+                "Accept": "application/json"
+            }
+    except Exception:
+        pass
+    return {"Accept": "application/json"}
+
+
+def clear_qnas_headers():
+    with headers_lock:
+        headers_cache.pop(frappe.local.site, None)
+
+
+def get_qnas_stats():
+    """Per-endpoint QNAS counters across all workers, with the average latency"""
+    # Through a raw pipeline, RedisWrapper.hgetall would try to unpickle the counters
+    pipeline = frappe.cache.pipeline()
+    pipeline.hgetall(frappe.cache.make_key(STATS_KEY))
+    raw = pipeline.execute()[0] or {}
+    result = {}
+    for key, value in raw.items():
+        endpoint, field = frappe.safe_decode(key).rsplit(":", 1)
+        result.setdefault(endpoint, {})[field] = int(value)
+    for counters in result.values():
+        counters["avg_ms"] = round(counters.get("total_ms", 0) / max(1, counters.get("calls", 0)), 1)
+    return result
+
+
+def get_sync_fetcher():
+    """Build a client for the background sync jobs from Foodcharity Settings.
+
+    Jobs get a breaker of their own and wait out an open circuit, so an outage
+    pauses the run rather than failing every remaining street, and doesn't
+    trip the breaker of interactive lookups in the same worker."""
+    settings = frappe.get_single("Foodcharity Settings")
+    return QnasClient(
+        breaker=CircuitBreaker(),
+        headers=get_qnas_headers(),
+        max_wait=SYNC_BREAKER_MAX_WAIT,
+        requests_per_second=settings.qnas_requests_per_second or DEFAULT_REQUESTS_PER_SECOND,
+        max_workers=settings.qnas_max_workers or DEFAULT_MAX_WORKERS,
+    )
@@ -0,0 +1,30 @@
+import frappe
+
+ORDER_CHANGE_EVENT = "foodcharity_order_change"
+COORDINATOR_ROOM = "foodcharity:coordinator"
+
+
+def get_driver_room(driver_id):
+    return f"foodcharity:driver:{driver_id}"
+
+
+def publish_order_changes(names, drivers=(), **changes):
+    """Tell the coordinator and the affected drivers that orders changed.
+
+    Events only carry the order names and the changed fields, the dashboards
+    then pull the rows from the delta feed. The guest dashboards can't join the
+    permission checked doc rooms, so events go to task rooms, which any socket
+    can subscribe to by name. Sent after commit so the feed already sees them."""
+    names = [names] if isinstance(names, str) else list(names)
+    if not names:
+        return
+
+    rooms = [COORDINATOR_ROOM] + [get_driver_room(driver) for driver in sorted(set(filter(None, drivers)))]
+    for room in rooms:
+        frappe.publish_realtime(ORDER_CHANGE_EVENT, {"names": names, **changes}, task_id=room, after_commit=True)
+
+
+def publish_order_update(order_name, **changes):
+    """Publish a change made with db.set_value, which skips the Orders controller hooks"""
+    driver = frappe.db.get_value("Orders", order_name, "assigned_volunteer")
+    publish_order_changes(order_name, [driver], **changes)
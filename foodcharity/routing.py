@@ -0,0 +1,383 @@
+import hashlib
+import json
+import math
+import time
+
+import frappe
+import numpy as np
+from frappe.utils import cint
+
+EARTH_RADIUS_M = 6371008.8
+# Average number of points per grid cell, a few keeps ring searches short
+POINTS_PER_CELL = 4
+# Longest run of consecutive stops Or-opt tries to move elsewhere in the route
+OR_OPT_SEGMENT = 3
+# Moves saving less than this many metres are not worth another pass
+MIN_GAIN_M = 0.01
+ROUTE_CACHE_PREFIX = "foodcharity:route:"
+ROUTE_CACHE_TTL = 600
+
+
+def parse_coordinate(coordinate):
+    """(lat, lng) from an Orders `coordinate` string, or (None, None).
+
+    QNAS returns x/y in either order, a "latitude" above 40 is a Qatar longitude."""
+    if not coordinate or "," not in str(coordinate):
+        return None, None
+    try:
+        lat, lng = (float(part.strip()) for part in str(coordinate).split(",")[:2])
+    except ValueError:
+        return None, None
+    return normalize_lat_lng(lat, lng)
+
+
+def normalize_lat_lng(lat, lng):
+    """(lat, lng) with QNAS x/y put in order, or (None, None) when either is unset"""
+    if not (lat and lng):
+        return None, None
+    if lat > 40:
+        lat, lng = lng, lat
+    return lat, lng
+
+
+def project(lat, lng):
+    """Equirectangular projection to metres around the points' mean latitude.
+
+    Over a country the size of Qatar this is within a fraction of a percent of
+    the haversine distance, and plain Euclidean distance on the result ranks
+    neighbours the same way."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lng = np.radians(np.asarray(lng, dtype=float))
+    if not lat.size:
+        return lat, lng
+    return EARTH_RADIUS_M * lng * math.cos(float(lat.mean())), EARTH_RADIUS_M * lat
+
+
+class GridIndex:
+    """Uniform grid over projected points (plain lists) supporting nearest lookups and removal.
+
+    Cells are sized for a few points each, so a lookup only scans the rings of
+    cells around the query point until no closer point can exist."""
+
+    def __init__(self, x, y, ids):
+        self.x = x
+        self.y = y
+        xs = [x[i] for i in ids]
+        ys = [y[i] for i in ids]
+        span = max(max(xs) - min(xs), max(ys) - min(ys), 1.0)
+        self.cell = span / max(1.0, math.sqrt(len(ids) / POINTS_PER_CELL))
+        self.size = len(ids)
+        self.cells = {}
+        for i in ids:
+            self.cells.setdefault(self.get_cell(i), []).append(i)
+
+        self.min_cx = min(cx for cx, _ in self.cells)
+        self.max_cx = max(cx for cx, _ in self.cells)
+        self.min_cy = min(cy for _, cy in self.cells)
+        self.max_cy = max(cy for _, cy in self.cells)
+
+    def get_cell(self, i):
+        return math.floor(self.x[i] / self.cell), math.floor(self.y[i] / self.cell)
+
+    def remove(self, i):
+        key = self.get_cell(i)
+        points = self.cells[key]
+        points.remove(i)
+        if not points:
+            del self.cells[key]
+        self.size -= 1
+
+    def nearest(self, i):
+        """Closest remaining point to point `i`, by projected distance.
+
+        Scans rings of cells outwards, falling back to checking every remaining
+        point once that would be cheaper than scanning more (mostly empty) cells."""
+        px, py = self.x[i], self.y[i]
+        cx, cy = self.get_cell(i)
+        max_ring = max(cx - self.min_cx, self.max_cx - cx, cy - self.min_cy, self.max_cy - cy)
+
+        best, best_distance = None, math.inf
+        scanned = 0
+        for ring in range(max_ring + 1):
+            scanned += max(1, 8 * ring)
+            if scanned > self.size + len(self.cells):
+                return self.closest(px, py, self.points())[0]
+
+            best, best_distance = self.closest(px, py, self.ring_points(cx, cy, ring), best, best_distance)
+            # Anything outside this ring is at least `ring` cells away
+            if best is not None and best_distance <= (ring * self.cell) ** 2:
+                break
+        return best
+
+    def ring_points(self, cx, cy, ring):
+        for key in ring_cells(cx, cy, ring):
+            yield from self.cells.get(key, ())
+
+    def points(self):
+        for points in self.cells.values():
+            yield from points
+
+    def closest(self, px, py, candidates, best=None, best_distance=math.inf):
+        x, y = self.x, self.y
+        for j in candidates:
+            d = (x[j] - px) ** 2 + (y[j] - py) ** 2
+            if d < best_distance:
+                best, best_distance = j, d
+        return best, best_distance
+
+
+def ring_cells(cx, cy, ring):
+    if ring == 0:
+        yield cx, cy
+        return
+    for dx in range(-ring, ring + 1):
+        yield cx + dx, cy - ring
+        yield cx + dx, cy + ring
+    for dy in range(-ring + 1, ring):
+        yield cx - ring, cy + dy
+        yield cx + ring, cy + dy
+
+
+def nearest_neighbour_order(lat, lng, start=None):
+    """Visit order of the points, starting from `start` (the northernmost
+    point by default) and always going to the closest point not yet visited.
+
+    Runs in about O(n log n): lookups only scan nearby grid cells, and the
+    grid is rebuilt coarser whenever three quarters of its points are gone
+    so the search never crawls across empty cells."""
+    lat = np.asarray(lat, dtype=float)
+    lng = np.asarray(lng, dtype=float)
+    if not lat.size:
+        return []
+
+    x, y = project(lat, lng)
+    if start is None:
+        start = int(np.lexsort((lng, -lat))[0])
+    return nearest_neighbour_walk(x, y, start)
+
+
+def nearest_neighbour_walk(x, y, start):
+    # Plain lists, indexing numpy arrays one element at a time is slow
+    x, y = x.tolist(), y.tolist()
+    current = start
+    remaining = np.ones(len(x), dtype=bool)
+    remaining[current] = False
+
+    grid = GridIndex(x, y, np.flatnonzero(remaining).tolist()) if len(x) > 1 else None
+    built_size = len(x) - 1
+    order = [current]
+    while len(order) < len(x):
+        if grid.size * 4 < built_size:
+            grid = GridIndex(x, y, np.flatnonzero(remaining).tolist())
+            built_size = grid.size
+
+        current = grid.nearest(current)
+        grid.remove(current)
+        remaining[current] = False
+        order.append(current)
+
+    return order
+
+
+def route_length(x, y, route):
+    """Length in metres of the open path visiting projected points in `route` order"""
+    if len(route) < 2:
+        return 0.0
+    route = np.asarray(route)
+    return float(np.hypot(np.diff(x[route]), np.diff(y[route])).sum())
+
+
+def improve_route(x, y, route, budget_ms, fixed_start=True):
+    """Shorten an open route with 2-opt and Or-opt moves until neither finds an
+    improvement or `budget_ms` runs out.
+
+    Every candidate move for a position is scored in one NumPy expression, so
+    a pass over the route costs O(n) array operations rather than O(n²) Python
+    steps. With `fixed_start` the first stop (the depot) never moves."""
+    route = np.asarray(route, dtype=np.int64)
+    deadline = time.monotonic() + budget_ms / 1000
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = two_opt(x, y, route, deadline, fixed_start)
+        route, moved = or_opt(x, y, route, deadline, fixed_start)
+        improved = improved or moved
+    return route.tolist()
+
+
+def two_opt(x, y, route, deadline, fixed_start):
+    """Reverse route[i:j + 1] wherever that shortens the route, in place"""
+    n = len(route)
+    px, py = x[route], y[route]
+    legs = np.hypot(np.diff(px), np.diff(py))
+    improved = False
+
+    for i in range(1 if fixed_start else 0, n - 1):
+        if time.monotonic() > deadline:
+            break
+
+        j = np.arange(i + 1, n)
+        has_next = j < n - 1
+        after = np.minimum(j + 1, n - 1)
+        # Legs (i - 1, i) and (j, j + 1) become (i - 1, j) and (i, j + 1)
+        removed = np.where(has_next, legs[np.minimum(j, n - 2)], 0)
+        added = np.where(has_next, np.hypot(px[after] - px[i], py[after] - py[i]), 0)
+        if i > 0:
+            removed = removed + legs[i - 1]
+            added = added + np.hypot(px[j] - px[i - 1], py[j] - py[i - 1])
+
+        gains = removed - added
+        best = int(np.argmax(gains))
+        if gains[best] > MIN_GAIN_M:
+            end = int(j[best]) + 1
+            route[i:end] = route[i:end][::-1].copy()
+            px[i:end], py[i:end] = px[i:end][::-1].copy(), py[i:end][::-1].copy()
+            legs = np.hypot(np.diff(px), np.diff(py))
+            improved = True
+
+    return improved
+
+
+def or_opt(x, y, route, deadline, fixed_start):
+    """Move runs of up to OR_OPT_SEGMENT stops, optionally reversed, to the
+    position where they add the least distance. Returns (route, improved)."""
+    improved = False
+    i = 1 if fixed_start else 0
+    while i < len(route) and time.monotonic() < deadline:
+        moved = None
+        for length in range(1, min(OR_OPT_SEGMENT, len(route) - i, len(route) - 1) + 1):
+            moved = move_segment(x, y, route, i, length, fixed_start)
+            if moved is not None:
+                break
+
+        if moved is None:
+            i += 1
+        else:
+            route, improved = moved, True
+    return route, improved
+
+
+def move_segment(x, y, route, i, length, fixed_start):
+    """route with route[i:i + length] moved to its best position, or None if no move helps"""
+    segment = route[i:i + length]
+    rest = np.concatenate((route[:i], route[i + length:]))
+    first, last = segment[0], segment[-1]
+
+    def leg(a, b):
+        return math.hypot(x[a] - x[b], y[a] - y[b])
+
+    previous = route[i - 1] if i > 0 else None
+    following = route[i + length] if i + length < len(route) else None
+    saved = (leg(previous, first) if previous is not None else 0) + (leg(last, following) if following is not None else 0)
+    if previous is not None and following is not None:
+        saved -= leg(previous, following)
+
+    # Slot k puts the segment between rest[k - 1] and rest[k]
+    m = len(rest)
+    k = np.arange(m + 1)
+    has_left, has_right = k > 0, k < m
+    left, right = rest[np.maximum(k - 1, 0)], rest[np.minimum(k, m - 1)]
+    lx, ly, rx, ry = x[left], y[left], x[right], y[right]
+
+    bridged = np.where(has_left & has_right, np.hypot(lx - rx, ly - ry), 0)
+    forward = (
+        np.where(has_left, np.hypot(lx - x[first], ly - y[first]), 0)
+        + np.where(has_right, np.hypot(x[last] - rx, y[last] - ry), 0)
+        - bridged
+    )
+    backward = (
+        np.where(has_left, np.hypot(lx - x[last], ly - y[last]), 0)
+        + np.where(has_right, np.hypot(x[first] - rx, y[first] - ry), 0)
+        - bridged
+    )
+    if fixed_start:
+        forward[0] = backward[0] = np.inf
+
+    costs = np.minimum(forward, backward)
+    best = int(np.argmin(costs))
+    if saved - costs[best] <= MIN_GAIN_M:
+        return None
+
+    if backward[best] < forward[best]:
+        segment = segment[::-1]
+    return np.concatenate((rest[:best], segment, rest[best:]))
+
+
+def plan_route(lat, lng, depot=None, budget_ms=0):
+    """Delivery order for the points, returns (order, length before, length after).
+
+    The nearest neighbour walk starts at the `depot` (lat, lng) when given,
+    otherwise at the northernmost point, then 2-opt / Or-opt improve it for up
+    to `budget_ms`. Lengths are in metres and include the leg from the depot."""
+    lat, lng = list(lat), list(lng)
+    if not lat:
+        return [], 0.0, 0.0
+    if depot:
+        lat, lng = [depot[0], *lat], [depot[1], *lng]
+
+    x, y = project(lat, lng)
+    start = 0 if depot else int(np.lexsort((lng, [-v for v in lat]))[0])
+    route = nearest_neighbour_walk(x, y, start)
+    before = route_length(x, y, route)
+    if budget_ms and len(route) > 2:
+        route = improve_route(x, y, route, budget_ms, fixed_start=bool(depot))
+    after = route_length(x, y, route)
+
+    if depot:
+        route = [i - 1 for i in route[1:]]
+    return route, before, after
+
+
+def sort_rows_by_route(rows, depot=None, budget_ms=0):
+    """Rows with a `latitude` and `longitude` in planned route order, followed by
+    the rows without. Returns (rows, length before, length after) in metres."""
+    located, unlocated = [], []
+    for row in rows:
+        if row.get("latitude") and row.get("longitude"):
+            located.append(row)
+        else:
+            unlocated.append(row)
+
+    if not located:
+        return list(rows), 0.0, 0.0
+
+    route, before, after = plan_route(
+        [row["latitude"] for row in located], [row["longitude"] for row in located], depot, budget_ms
+    )
+    return [located[i] for i in route] + unlocated, before, after
+
+
+def sort_rows_by_cached_route(rows, depot=None, budget_ms=0):
+    """`sort_rows_by_route` remembered for the same stops, depot and budget, so
+    clients polling a driver's orders don't plan an unchanged route again"""
+    stops = sorted((row["name"], row.get("latitude"), row.get("longitude")) for row in rows)
+    plan = json.dumps([stops, depot, budget_ms], default=str)
+    key = f"{ROUTE_CACHE_PREFIX}{hashlib.sha1(plan.encode()).hexdigest()}"
+
+    cached = frappe.cache.get_value(key)
+    if cached:
+        position = {name: i for i, name in enumerate(cached["route"])}
+        rows = sorted(rows, key=lambda row: position.get(row["name"], len(position)))
+        return rows, cached["before"], cached["after"]
+
+    rows, before, after = sort_rows_by_route(rows, depot, budget_ms)
+    frappe.cache.set_value(
+        key, {"route": [row["name"] for row in rows], "before": before, "after": after},
+        expires_in_sec=ROUTE_CACHE_TTL,
+    )
+    return rows, before, after
+
+
+def get_route_settings():
+    """Depot and optimisation budget for `plan_route` from Foodcharity Settings"""
+    depot = parse_coordinate(frappe.db.get_single_value("Foodcharity Settings", "depot_coordinate", cache=True))
+    return {
+        "depot": depot if depot[0] is not None else None,
+        "budget_ms": cint(frappe.db.get_single_value("Foodcharity Settings", "route_optimization_ms", cache=True))
+    }
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great circle distance in metres"""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
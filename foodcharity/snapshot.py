@@ -0,0 +1,96 @@
+import gzip
+import hashlib
+import json
+import os
+from functools import partial
+from itertools import groupby
+
+import frappe
+from frappe.utils import now_datetime
+
+from foodcharity.gazetteer import clear_cache_on_commit, manifest_key, street_option, zone_option
+
+SNAPSHOT_URL = "/files/gazetteer/"
+
+
+def get_snapshot_dir():
+    """The site's own public folder, every site on the bench shares the app's"""
+    return frappe.get_site_path("public", "files", "gazetteer")
+
+
+def write_snapshot(prefix, options):
+    """Write `options` as `{prefix}.{hash}.json` plus a gzip sibling, return its URL.
+
+    File names are content hashed, so the files can be cached for long and
+    unchanged data keeps the same URL across syncs."""
+    data = json.dumps(options, separators=(",", ":"), ensure_ascii=False).encode()
+    filename = f"{prefix}.{hashlib.sha1(data).hexdigest()[:12]}.json"
+    path = os.path.join(get_snapshot_dir(), filename)
+
+    if not os.path.exists(path):
+        for target, content in ((path, data), (f"{path}.gz", gzip.compress(data, mtime=0))):
+            tmp = f"{target}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(content)
+            os.replace(tmp, target)
+
+    return SNAPSHOT_URL + filename
+
+
+def build_snapshots():
+    """Write zone and per-zone street snapshots and record the manifest on Foodcharity Settings"""
+    os.makedirs(get_snapshot_dir(), exist_ok=True)
+
+    zones = frappe.get_all(
+        "Zone",
+        fields=["zone_number", "zone_name_en", "zone_name_ar", "streets_synced_on"],
+        order_by="zone_number asc"
+    )
+    if not zones:
+        return {}
+
+    # Only zones with a fully synced street list get a snapshot, others keep the API fallback
+    synced_zones = [z.zone_number for z in zones if z.streets_synced_on]
+    streets = frappe.get_all(
+        "Street",
+        filters={"zone": ["in", synced_zones or [""]]},
+        fields=["zone", "street_number", "street_name_en", "street_name_ar"],
+        order_by="zone asc, street_number asc"
+    )
+
+    manifest = {
+        "zones": write_snapshot("zones", [zone_option(z) for z in zones]),
+        "streets": {
+            zone: write_snapshot(f"streets-{zone}", [street_option(s) for s in zone_streets])
+            for zone, zone_streets in groupby(streets, key=lambda s: s.zone)
+        },
+        "generated_on": str(now_datetime())
+    }
+    manifest["version"] = hashlib.sha1(
+        json.dumps([manifest["zones"], manifest["streets"]], sort_keys=True).encode()
+    ).hexdigest()[:12]
+
+    frappe.db.set_value("Foodcharity Settings", "Foodcharity Settings", "gazetteer_manifest", json.dumps(manifest))
+    clear_cache_on_commit(manifest_key())
+    # Once the new manifest is committed nothing points at the old files any more
+    frappe.db.after_commit.add(partial(remove_stale_snapshots, manifest))
+    return manifest
+
+
+def remove_stale_snapshots(manifest):
+    """Delete snapshot files (and their gzip siblings) the manifest doesn't reference"""
+    current = {url[len(SNAPSHOT_URL):] for url in [manifest["zones"], *manifest["streets"].values()]}
+    snapshot_dir = get_snapshot_dir()
+    for filename in os.listdir(snapshot_dir):
+        # .tmp files are still being written
+        if not filename.endswith(".tmp") and filename.removesuffix(".gz") not in current:
+            try:
+                os.remove(os.path.join(snapshot_dir, filename))
+            except FileNotFoundError:
+                # Removed by a concurrent sync of the same site
+                pass
+
+
+def load_manifest():
+    manifest = frappe.db.get_single_value("Foodcharity Settings", "gazetteer_manifest")
+    return json.loads(manifest) if manifest else {}
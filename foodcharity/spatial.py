@@ -0,0 +1,167 @@
+import math
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import flt
+
+from foodcharity.routing import EARTH_RADIUS_M, haversine, normalize_lat_lng
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Stored cells are about 150 m across, a street's buildings share a few of them
+GEOHASH_PRECISION = 7
+# Queries use coarser cells until the area is covered by at most this many
+MAX_QUERY_CELLS = 32
+# The nearest building search starts this close and widens fourfold each miss
+NEAREST_START_RADIUS_M = 100
+NEAREST_MAX_RADIUS_M = 6400
+MAX_ORDERS = 1000
+# orders_within candidates are read up to this many before sorting by distance
+MAX_CANDIDATES = 5000
+MAX_RADIUS_M = 10000
+
+ORDER_FIELDS = """name, name1, order_status, assigned_volunteer, no_of_biriyani, accommodation_area,
+    zone_number, street_number, building_number, coordinate, latitude, longitude"""
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    """Geohash of a point, None when it has no coordinates.
+
+    Points sharing a prefix are in the same cell, so a B-tree index on the
+    column answers "everything in this cell" with a prefix range scan."""
+    if lat is None or lng is None:
+        return None
+
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, even = [], 0, True
+    for i in range(precision * 5):
+        value, interval = (lng, lng_range) if even else (lat, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        if i % 5 == 4:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+    return "".join(geohash)
+
+
+def get_geohash(latitude, longitude):
+    """Geohash of a saved latitude/longitude pair, which may be QNAS x/y the other way round"""
+    return encode_geohash(*normalize_lat_lng(flt(latitude), flt(longitude)))
+
+
+def get_cell_size(precision):
+    """(lat, lng) size in degrees of a geohash cell"""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+def get_covering_cells(min_lat, min_lng, max_lat, max_lng):
+    """Geohash prefixes of the cells overlapping a bounding box, as fine as
+    `MAX_QUERY_CELLS` allows"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_size, lng_size = get_cell_size(precision)
+        rows = range(math.floor((min_lat + 90) / lat_size), math.floor((max_lat + 90) / lat_size) + 1)
+        cols = range(math.floor((min_lng + 180) / lng_size), math.floor((max_lng + 180) / lng_size) + 1)
+        if len(rows) * len(cols) <= MAX_QUERY_CELLS or precision == 1:
+            # Encode each cell's centre, it can't fall on a neighbour's edge
+            return sorted({
+                encode_geohash((row + 0.5) * lat_size - 90, (col + 0.5) * lng_size - 180, precision)
+                for row in rows for col in cols
+            })
+
+
+def get_cell_condition(cells, column="geohash"):
+    """SQL condition and values matching rows in any of the cells, each an index range scan"""
+    return "({})".format(" OR ".join([f"{column} LIKE %s"] * len(cells))), [f"{cell}%" for cell in cells]
+
+
+def get_bbox(lat, lng, radius):
+    """(min_lat, min_lng, max_lat, max_lng) of the box around a circle of `radius` metres"""
+    lat_delta = math.degrees(radius / EARTH_RADIUS_M)
+    lng_delta = lat_delta / max(math.cos(math.radians(lat)), 0.01)
+    return lat - lat_delta, lng - lng_delta, lat + lat_delta, lng + lng_delta
+
+
+def get_orders_in_bbox(min_lat, min_lng, max_lat, max_lng, order_status=None, limit=MAX_ORDERS):
+    """Located orders inside a bounding box, reading only the index ranges of its cells"""
+    if min_lat > max_lat or min_lng > max_lng:
+        frappe.throw(_("Invalid bounding box, the minimum must not be above the maximum"))
+
+    condition, values = get_cell_condition(get_covering_cells(min_lat, min_lng, max_lat, max_lng))
+    conditions = [condition, "latitude BETWEEN %s AND %s", "longitude BETWEEN %s AND %s"]
+    values += [min_lat, max_lat, min_lng, max_lng]
+    if order_status:
+        conditions.append("order_status = %s")
+        values.append(order_status)
+
+    return frappe.db.sql(f"""
+        SELECT {ORDER_FIELDS}
+        FROM `tabOrders`
+        WHERE {" AND ".join(conditions)}
+        LIMIT {int(limit)}
+    """, values, as_dict=True)
+
+
+def get_orders_within(lat, lng, radius, order_status=None, limit=MAX_ORDERS):
+    """Located orders within `radius` metres, nearest first, with their `distance` in metres"""
+    if not 0 < radius <= MAX_RADIUS_M:
+        frappe.throw(_("Radius must be between 0 and {0} metres").format(MAX_RADIUS_M))
+
+    orders = get_orders_in_bbox(*get_bbox(lat, lng, radius), order_status=order_status, limit=MAX_CANDIDATES)
+    if not orders:
+        return []
+
+    distances = haversine(
+        lat, lng, np.array([o.latitude for o in orders]), np.array([o.longitude for o in orders])
+    ).tolist()
+    for order, distance in zip(orders, distances):
+        order.distance = round(distance, 1)
+    return sorted((o for o in orders if o.distance <= radius), key=lambda o: o.distance)[:limit]
+
+
+def get_nearest_building(lat, lng, max_radius=NEAREST_MAX_RADIUS_M):
+    """Closest local building to a GPS point with its `distance` in metres, or None.
+
+    Searches the cells around the point, widening until a building turns up
+    within the searched radius or `max_radius` is reached."""
+    radius = NEAREST_START_RADIUS_M
+    while True:
+        radius = min(radius, max_radius)
+        condition, values = get_cell_condition(get_covering_cells(*get_bbox(lat, lng, radius)))
+        buildings = frappe.db.sql(f"""
+            SELECT name, zone, street_number, building_number, latitude, longitude
+            FROM `tabBuilding`
+            WHERE {condition}
+        """, values, as_dict=True)
+
+        nearest = None
+        for building in buildings:
+            # Buildings keep QNAS x/y as saved, which may be the other way round
+            building.latitude, building.longitude = normalize_lat_lng(building.latitude, building.longitude)
+            if building.latitude is None:
+                continue
+            building.distance = round(float(haversine(lat, lng, building.latitude, building.longitude)), 1)
+            if building.distance <= radius and (nearest is None or building.distance < nearest.distance):
+                nearest = building
+
+        if nearest or radius >= max_radius:
+            return nearest
+        radius *= 4
+
+
+def parse_point(lat, lng):
+    """Request arguments as a (lat, lng) pair, throwing on anything else"""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        lat = lng = None
+    if lat is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        frappe.throw(_("Invalid coordinates"))
+    return lat, lng
@@ -0,0 +1,6 @@
+import frappe
+
+
+def get_context(context):
+    # The socket.io namespace is the site name, which need not match the host name
+    context.site_name = frappe.local.site
@@ -25,9 +25,9 @@ export default function OrderForm({ doctype }: OrderFormProps) {
   const [submitted, setSubmitted] = useState(false)
   const [orderId, setOrderId] = useState<string | null>(null)
 
-  // Location data hooks
-  const { zones, isLoading: zonesLoading } = useZones()
-  const { streets, isLoading: streetsLoading } = useStreets(formData.zone_number || null)
+  // Location data hooks, zones and streets come from the static snapshots when available
+  const { zones, isLoading: zonesLoading } = useZones({ snapshot: true })
+  const { streets, isLoading: streetsLoading } = useStreets(formData.zone_number || null, { snapshot: true })
   const { buildings, isLoading: buildingsLoading } = useBuildings(
     formData.zone_number || null,
     formData.street_number || null
@@ -1,3 +1,4 @@
+import { useEffect, useState } from 'react'
 import { useFrappeGetCall } from 'frappe-react-sdk'
 
 interface LocationOption {
@@ -7,33 +8,108 @@ interface LocationOption {
   y?: number
 }
 
-export function useZones() {
+interface GazetteerManifest {
+  version?: string
+  zones?: string
+  streets?: Record<string, string>
+}
+
+interface LocationDataOptions {
+  // Read zones/streets from the static /assets snapshots when the server has built them
+  snapshot?: boolean
+}
+
+const snapshotRequests = new Map<string, Promise<LocationOption[]>>()
+
+function fetchSnapshot(url: string) {
+  let request = snapshotRequests.get(url)
+  if (!request) {
+    request = fetch(url).then((response) => {
+      if (!response.ok) {
+        throw new Error(`Snapshot request failed: ${response.status}`)
+      }
+      return response.json()
+    })
+    request.catch(() => snapshotRequests.delete(url))
+    snapshotRequests.set(url, request)
+  }
+  return request
+}
+
+function useGazetteerManifest(enabled: boolean) {
+  const { data, error, isLoading } = useFrappeGetCall<{ message: GazetteerManifest }>(
+    enabled ? 'foodcharity.api.get_gazetteer_manifest' : null,
+    undefined,
+    undefined,
+    { revalidateOnFocus: false, revalidateIfStale: false }
+  )
+
+  return {
+    manifest: data?.message,
+    // Without snapshots, or if the manifest can't be loaded, callers use the API directly
+    ready: !enabled || !!data || !!error,
+    isLoading: enabled && isLoading,
+  }
+}
+
+function useSnapshot(url: string | undefined) {
+  const [result, setResult] = useState<{ url?: string; data?: LocationOption[]; error?: Error }>({})
+
+  useEffect(() => {
+    if (!url) return
+    let cancelled = false
+    fetchSnapshot(url)
+      .then((data) => !cancelled && setResult({ url, data }))
+      .catch((error) => !cancelled && setResult({ url, error }))
+    return () => {
+      cancelled = true
+    }
+  }, [url])
+
+  const current = url && result.url === url ? result : {}
+  return {
+    data: current.data,
+    failed: !!current.error,
+    isLoading: !!url && !current.data && !current.error,
+  }
+}
+
+export function useZones(options: LocationDataOptions = {}) {
+  const { manifest, ready, isLoading: manifestLoading } = useGazetteerManifest(!!options.snapshot)
+  const snapshot = useSnapshot(manifest?.zones)
+  const useApi = ready && (!manifest?.zones || snapshot.failed)
+
   const { data, error, isLoading } = useFrappeGetCall<{ message: LocationOption[] }>(
-    'foodcharity.api.get_zones',
+    useApi ? 'foodcharity.api.get_zones' : null,
     undefined,
     undefined,
     { revalidateOnFocus: false }
   )
 
   return {
-    zones: data?.message || [],
+    zones: snapshot.data || data?.message || [],
     error,
-    isLoading,
+    isLoading: manifestLoading || snapshot.isLoading || isLoading,
   }
 }
 
-export function useStreets(zoneNumber: string | null) {
+export function useStreets(zoneNumber: string | null, options: LocationDataOptions = {}) {
+  const { manifest, ready, isLoading: manifestLoading } = useGazetteerManifest(!!options.snapshot)
+  const snapshotUrl = zoneNumber ? manifest?.streets?.[zoneNumber] : undefined
+  const snapshot = useSnapshot(snapshotUrl)
+  const useApi = !!zoneNumber && ready && (!snapshotUrl || snapshot.failed)
+
   const { data, error, isLoading } = useFrappeGetCall<{ message: LocationOption[] }>(
-    zoneNumber ? 'foodcharity.api.get_streets' : null,
-    zoneNumber ? { zone_number: zoneNumber } : undefined,
+    useApi ? 'foodcharity.api.get_streets' : null,
+    useApi ? { zone_number: zoneNumber } : undefined,
     undefined,
     { revalidateOnFocus: false }
   )
 
   return {
-    streets: data?.message || [],
+    streets: snapshot.data || data?.message || [],
     error,
-    isLoading,
+    isLoading: (!!zoneNumber && manifestLoading) || snapshot.isLoading || isLoading,
   }
 }
 